@@ -0,0 +1,336 @@
+"""Harbor adaptive schedule module.
+
+This module chooses the garbage collection and audit log purge schedules from
+measured job history instead of a static cron expression. The chosen values
+stay within the bounds of the ``adaptive`` section of the schedule files and
+the decision inputs are exported as metrics.
+"""
+
+import asyncio
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+from typing import Any, Dict, List, Optional, Tuple
+
+from instance import instance_name
+from metrics import set_gauge
+from pagination import count_objects
+
+SUCCESS_STATUS = "Success"
+# Intervals below a day must divide it evenly to map onto a cron hour field
+HOURLY_INTERVALS = (1, 2, 3, 4, 6, 8, 12)
+
+GC_DELETED_PATTERN = re.compile(r"(\d+) blobs and (\d+) manifests are actually deleted")
+GC_FREED_PATTERN = re.compile(r"actual frees up (\d+) MB space")
+
+# Freed bytes and deleted blobs parsed from the logs of finished GC jobs, by
+# instance and job ID
+_gc_log_stats: Dict[Optional[str], Dict[int, Tuple[int, int]]] = {}
+# Newest GC job the worker count was last adjusted for, by instance
+_gc_adjusted_job: Dict[Optional[str], int] = {}
+
+
+def job_seconds(job: Any) -> float:
+    """Return the duration of a job from its creation and update time.
+
+    Args:
+        job: GC or purge job history entry
+
+    Returns:
+        float: Duration in seconds, 0 if unknown
+    """
+    if not job.creation_time or not job.update_time:
+        return 0.0
+    return max((job.update_time - job.creation_time).total_seconds(), 0.0)
+
+
+def is_dry_run(job: Any) -> bool:
+    """Check whether a job was a dry run that did not delete anything.
+
+    Args:
+        job: GC or purge job history entry
+
+    Returns:
+        bool: True if the job parameters enable ``dry_run``
+    """
+    parameters = job.job_parameters or {}
+    if isinstance(parameters, str):
+        try:
+            parameters = json.loads(parameters)
+        except json.JSONDecodeError:
+            return False
+    return isinstance(parameters, dict) and bool(parameters.get("dry_run"))
+
+
+def average_gap_hours(jobs: List[Any]) -> Optional[float]:
+    """Return the average time between the starts of consecutive jobs.
+
+    Args:
+        jobs: Job history entries, newest first
+
+    Returns:
+        Average gap in hours, None with fewer than two jobs
+    """
+    times = [job.creation_time for job in jobs if job.creation_time]
+    if len(times) < 2:
+        return None
+    return (times[0] - times[-1]).total_seconds() / 3600 / (len(times) - 1)
+
+
+def parse_gc_log(log: str) -> Tuple[int, int]:
+    """Extract freed bytes and deleted blobs from a GC job log.
+
+    Args:
+        log: GC job log
+
+    Returns:
+        Tuple of freed bytes and deleted blob count
+    """
+    freed = GC_FREED_PATTERN.search(log)
+    deleted = GC_DELETED_PATTERN.search(log)
+    return (
+        int(freed.group(1)) * 1024 * 1024 if freed else 0,
+        int(deleted.group(1)) if deleted else 0,
+    )
+
+
+def cron_for_interval(base_cron: str, interval_hours: float) -> str:
+    """Build a cron expression for an interval, keeping the base run time.
+
+    Harbor uses six field cron expressions starting with seconds. Intervals
+    below a day are rounded to the nearest divisor of 24 hours, longer ones
+    to whole days.
+
+    Args:
+        base_cron: Configured cron expression the minute and hour are taken from
+        interval_hours: Interval between runs in hours
+
+    Returns:
+        str: Cron expression
+    """
+    fields = base_cron.split()
+    second, minute, hour = (fields + ["0", "0", "0"])[:3]
+    hour = hour if hour.isdigit() else "0"
+
+    if interval_hours < 24:
+        step = min(HOURLY_INTERVALS, key=lambda h: abs(h - interval_hours))
+        first_hour = int(hour) % step
+        return f"{second} {minute} {first_hour}/{step} * * *"
+
+    days = max(round(interval_hours / 24), 1)
+    if days == 1:
+        return f"{second} {minute} {hour} * * *"
+    return f"{second} {minute} {hour} */{days} * *"
+
+
+def clamp(value: float, lower: float, upper: float) -> float:
+    """Clamp a value into a range.
+
+    Args:
+        value: Value to clamp
+        lower: Lower bound
+        upper: Upper bound
+
+    Returns:
+        float: Clamped value
+    """
+    return max(lower, min(upper, value))
+
+
+async def load_gc_log_stats(client: Any, jobs: List[Any]) -> Dict[int, Tuple[int, int]]:
+    """Return the freed bytes and deleted blobs of finished GC jobs.
+
+    The log of a finished job does not change, so only the logs of jobs not
+    seen by an earlier run are fetched, concurrently.
+
+    Args:
+        client: Harbor API client instance
+        jobs: Finished GC jobs
+
+    Returns:
+        Dict[int, Tuple[int, int]]: Freed bytes and deleted blobs by job ID
+    """
+    known = _gc_log_stats.get(instance_name(), {})
+    new_jobs = [job for job in jobs if job.id not in known]
+    logs = await asyncio.gather(
+        *(client.get_gc_log(job.id, as_list=False) for job in new_jobs)
+    )
+    stats = {job.id: known[job.id] for job in jobs if job.id in known}
+    stats.update({job.id: parse_gc_log(log) for job, log in zip(new_jobs, logs)})
+    _gc_log_stats[instance_name()] = stats
+    return stats
+
+
+async def adapt_gc_schedule(
+    client: Any, schedule_config: Dict[str, Any], logger: Logger
+) -> Dict[str, Any]:
+    """Choose the GC schedule and worker count from the GC job history.
+
+    The interval is scaled so that a run frees about ``target_freed_bytes``,
+    workers are added while runs take longer than ``target_duration_seconds``
+    and removed while runs take less than a quarter of it. The worker count
+    starts from the GC schedule currently in Harbor and moves by one step per
+    new GC run, so syncs without a new run keep it unchanged. Dry runs are
+    not taken into account.
+
+    Args:
+        client: Harbor API client instance
+        schedule_config: GC schedule configuration with an ``adaptive`` section
+        logger: Logger instance
+
+    Returns:
+        Dict[str, Any]: Schedule configuration to apply, without ``adaptive``
+    """
+    adaptive = schedule_config["adaptive"]
+    schedule = {
+        key: value for key, value in schedule_config.items() if key != "adaptive"
+    }
+    parameters = dict(schedule.get("parameters", {}))
+    base_cron = schedule.get("schedule", {}).get("cron", "0 0 0 * * *")
+
+    min_hours = adaptive.get("min_interval_hours", 1)
+    max_hours = adaptive.get("max_interval_hours", 168)
+    min_workers = adaptive.get("min_workers", 1)
+    max_workers = adaptive.get("max_workers", 5)
+    target_freed = adaptive.get("target_freed_bytes", 1024**3)
+    target_duration = adaptive.get("target_duration_seconds", 3600)
+
+    history = adaptive.get("history", 10)
+    jobs = [
+        job
+        for job in await client.get_gc_jobs(
+            sort="-creation_time", page_size=history, limit=history
+        )
+        if job.job_status == SUCCESS_STATUS and not is_dry_run(job)
+    ]
+    if not jobs:
+        logger.info("No GC history yet, keeping configured GC schedule")
+        return schedule
+
+    log_stats = await load_gc_log_stats(client, jobs)
+    freed_bytes = sum(freed for freed, _ in log_stats.values())
+    deleted_blobs = sum(deleted for _, deleted in log_stats.values())
+    avg_freed = freed_bytes / len(jobs)
+    avg_deleted = deleted_blobs / len(jobs)
+    avg_duration = sum(job_seconds(job) for job in jobs) / len(jobs)
+    current_hours = average_gap_hours(jobs) or adaptive.get(
+        "default_interval_hours", 24
+    )
+
+    # Run less often when runs free little, more often when they free a lot
+    scale = target_freed / avg_freed if avg_freed else max_hours / current_hours
+    interval_hours = clamp(current_hours * scale, min_hours, max_hours)
+
+    current_schedule = await client.get_gc_schedule()
+    workers = (current_schedule.parameters or {}).get("workers") or parameters.get(
+        "workers", min_workers
+    )
+    if _gc_adjusted_job.get(instance_name()) != jobs[0].id:
+        if avg_duration > target_duration:
+            workers += 1
+        elif avg_duration < target_duration / 4:
+            workers -= 1
+        _gc_adjusted_job[instance_name()] = jobs[0].id
+    workers = int(clamp(workers, min_workers, max_workers))
+
+    set_gauge("gc_freed_bytes_avg", avg_freed, "Average bytes freed per GC run.")
+    set_gauge("gc_deleted_blobs_avg", avg_deleted, "Average blobs deleted per GC run.")
+    set_gauge("gc_duration_seconds_avg", avg_duration, "Average GC run duration.")
+    set_gauge("gc_interval_hours", interval_hours, "Chosen interval between GC runs.")
+    set_gauge("gc_workers", workers, "Chosen number of GC workers.")
+
+    schedule["parameters"] = {**parameters, "workers": workers}
+    schedule["schedule"] = {
+        **schedule.get("schedule", {}),
+        "type": "Custom",
+        "cron": cron_for_interval(base_cron, interval_hours),
+    }
+    logger.info(
+        "Adapted GC schedule",
+        extra={
+            "avg_freed_bytes": avg_freed,
+            "avg_duration_seconds": avg_duration,
+            "cron": schedule["schedule"]["cron"],
+            "workers": workers,
+        },
+    )
+    return schedule
+
+
+async def adapt_purge_job_schedule(
+    client: Any, schedule_config: Dict[str, Any], logger: Logger
+) -> Dict[str, Any]:
+    """Choose the audit log purge schedule from the audit log growth rate.
+
+    The interval is chosen so that a run purges about ``target_rows_per_run``
+    audit log entries, measured over the last ``window_hours``.
+
+    Args:
+        client: Harbor API client instance
+        schedule_config: Purge job schedule configuration with an ``adaptive`` section
+        logger: Logger instance
+
+    Returns:
+        Dict[str, Any]: Schedule configuration to apply, without ``adaptive``
+    """
+    adaptive = schedule_config["adaptive"]
+    schedule = {
+        key: value for key, value in schedule_config.items() if key != "adaptive"
+    }
+    base_cron = schedule.get("schedule", {}).get("cron", "0 0 0 * * *")
+
+    min_hours = adaptive.get("min_interval_hours", 1)
+    max_hours = adaptive.get("max_interval_hours", 168)
+    target_rows = adaptive.get("target_rows_per_run", 100000)
+    window_hours = adaptive.get("window_hours", 24)
+
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(hours=window_hours)
+    time_format = "%Y-%m-%d %H:%M:%S"
+    rows = await count_objects(
+        client,
+        "/audit-logs",
+        {"q": f"op_time=[{start.strftime(time_format)}~{now.strftime(time_format)}]"},
+    )
+    growth_per_hour = rows / window_hours
+
+    jobs = await client.get_purge_job_history(
+        sort="-creation_time", page_size=5, limit=5
+    )
+    finished = [
+        job for job in jobs if job.job_status == SUCCESS_STATUS and not is_dry_run(job)
+    ]
+    avg_duration = (
+        sum(job_seconds(job) for job in finished) / len(finished) if finished else 0.0
+    )
+
+    interval_hours = clamp(
+        target_rows / growth_per_hour if growth_per_hour else max_hours,
+        min_hours,
+        max_hours,
+    )
+
+    set_gauge(
+        "audit_log_growth_per_hour",
+        growth_per_hour,
+        "Audit log entries added per hour.",
+    )
+    set_gauge("purge_duration_seconds_avg", avg_duration, "Average purge job duration.")
+    set_gauge(
+        "purge_interval_hours", interval_hours, "Chosen interval between purge runs."
+    )
+
+    schedule["schedule"] = {
+        **schedule.get("schedule", {}),
+        "type": "Custom",
+        "cron": cron_for_interval(base_cron, interval_hours),
+    }
+    logger.info(
+        "Adapted purge job schedule",
+        extra={
+            "growth_per_hour": growth_per_hour,
+            "cron": schedule["schedule"]["cron"],
+        },
+    )
+    return schedule
@@ -0,0 +1,135 @@
+"""Harbor apply engine module.
+
+Stages decide per item which write a configuration needs and hand the writes
+to this module, which runs independent items concurrently. Writes for the
+same key, e.g. deleting and recreating a resource with the same name, keep
+their order. Failed items do not stop the others, the failures are raised
+together once all items are done.
+"""
+
+import asyncio
+import itertools
+import os
+from contextvars import ContextVar
+from logging import Logger
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from metrics import set_gauge
+
+# Maximum number of item writes of a stage running at the same time
+APPLY_CONCURRENCY = int(os.environ.get("APPLY_CONCURRENCY", "8"))
+
+Operation = Tuple[Any, Callable[[], Awaitable[None]]]
+
+# Apply call and item key of the running operation, recorded by plans
+_current_operation: ContextVar[Optional[Tuple[int, str]]] = ContextVar(
+    "current_operation", default=None
+)
+_apply_calls = itertools.count(1)
+
+
+def current_operation() -> Optional[Tuple[int, str]]:
+    """Return the apply call and item key of the running operation.
+
+    Returns:
+        Tuple of the number of the apply call and the item key, None outside
+        of an operation
+    """
+    return _current_operation.get()
+
+
+class ApplyError(Exception):
+    """Raised if item writes of a stage failed."""
+
+    def __init__(self, stage: str, failures: List[Tuple[Any, Exception]], total: int):
+        """Initialize the error.
+
+        Args:
+            stage: Name of the stage
+            failures: Keys of the failed items and their errors
+            total: Number of item writes of the stage
+        """
+        self.stage = stage
+        self.failures = failures
+        self.total = total
+        key, error = failures[0]
+        super().__init__(
+            f"{len(failures)} of {total} {stage} operations failed, "
+            f"first {key}: {error}"
+        )
+
+
+async def apply_operations(
+    stage: str,
+    operations: Iterable[Operation],
+    logger: Logger,
+    concurrency: Optional[int] = None,
+) -> None:
+    """Run the item writes of a stage with bounded concurrency.
+
+    Operations sharing a key run one after the other in the given order and
+    the remaining ones are skipped once one of them fails. Operations with
+    different keys run concurrently, at most ``concurrency`` at a time.
+
+    Args:
+        stage: Name of the stage, used in logs and metrics
+        operations: Pairs of item key and a function performing the write
+        logger: Logger instance
+        concurrency: Maximum number of concurrent writes, defaults to
+            APPLY_CONCURRENCY
+
+    Raises:
+        ApplyError: If any operation failed, after all others are done
+    """
+    chains: Dict[Any, List[Callable[[], Awaitable[None]]]] = {}
+    for key, operation in operations:
+        chains.setdefault(key, []).append(operation)
+    total = sum(len(chain) for chain in chains.values())
+    if not total:
+        return
+
+    call = next(_apply_calls)
+    semaphore = asyncio.Semaphore(max(concurrency or APPLY_CONCURRENCY, 1))
+    failures: List[Tuple[Any, Exception]] = []
+
+    async def run_chain(key: Any, chain: List[Callable[[], Awaitable[None]]]) -> None:
+        _current_operation.set((call, str(key)))
+        for operation in chain:
+            try:
+                async with semaphore:
+                    await operation()
+            except Exception as e:
+                failures.append((key, e))
+                return
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await asyncio.gather(*(run_chain(key, chain) for key, chain in chains.items()))
+    seconds = loop.time() - started
+
+    rate = total / seconds if seconds > 0 else float(total)
+    set_gauge("apply_operations", total, "Item writes of the last apply.", stage=stage)
+    set_gauge(
+        "apply_failures",
+        len(failures),
+        "Failed item writes of the last apply.",
+        stage=stage,
+    )
+    set_gauge(
+        "apply_operations_per_second",
+        rate,
+        "Item write throughput of the last apply.",
+        stage=stage,
+    )
+    logger.info(
+        "Applied operations",
+        extra={
+            "stage": stage,
+            "operations": total,
+            "failed": len(failures),
+            "seconds": round(seconds, 3),
+            "operations_per_second": round(rate, 2),
+        },
+    )
+    if failures:
+        raise ApplyError(stage, failures, total)
@@ -1,18 +1,148 @@
 """Harbor configuration management module.
 
 This module handles the synchronization of Harbor configuration settings,
-including OIDC authentication parameters.
+including OIDC authentication parameters. Only the settings that differ from
+the current Harbor configuration are sent.
 """
 
+import hashlib
 import logging
-import os
 import json
+from pathlib import Path
+from typing import Any, Dict, Optional
 
 from harborapi.client import HarborAsyncClient
 from harborapi.models import Configurations
 from harborapi.exceptions import HarborAPIException
 
 from utils import load_json
+from instance import getenv, instance_name, require_env
+from planning import planning
+
+# Settings Harbor accepts but never returns, like the OIDC client secret. A
+# fingerprint of the last applied value of each, and of the robot and registry
+# secrets, is kept in OIDC_SECRET_FINGERPRINT_PATH to detect changes
+SECRET_KEY = "oidc_client_secret"
+WRITE_ONLY_KEYS = {SECRET_KEY, "ldap_search_password", "uaa_client_secret"}
+
+# Fingerprints of the applied write-only settings by instance
+_applied_secret_fingerprints: Dict[Optional[str], Dict[str, str]] = {}
+
+
+def secret_fingerprint(secret: Any) -> str:
+    """Return the fingerprint of a secret.
+
+    Args:
+        secret: Secret value, other values than strings are fingerprinted as
+            JSON
+
+    Returns:
+        str: SHA-256 hex digest of the secret
+    """
+    if not isinstance(secret, str):
+        secret = json.dumps(secret, sort_keys=True)
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def load_secret_fingerprints() -> Dict[str, str]:
+    """Return the fingerprints of the last applied write-only settings.
+
+    Files written before other settings than the OIDC client secret were
+    fingerprinted hold just the secret's fingerprint.
+
+    Returns:
+        Dict[str, str]: Fingerprints by setting
+    """
+    fingerprints = _applied_secret_fingerprints.get(instance_name())
+    fingerprint_path = getenv("OIDC_SECRET_FINGERPRINT_PATH")
+    if fingerprints is not None or not fingerprint_path:
+        return dict(fingerprints or {})
+    try:
+        content = Path(fingerprint_path).read_text().strip()
+    except FileNotFoundError:
+        return {}
+    try:
+        fingerprints = json.loads(content)
+    except json.JSONDecodeError:
+        fingerprints = None
+    if isinstance(fingerprints, dict):
+        return fingerprints
+    return {SECRET_KEY: content} if content else {}
+
+
+def store_secret_fingerprints(
+    fingerprints: Dict[str, str], logger: logging.Logger
+) -> None:
+    """Remember the fingerprints of applied write-only settings.
+
+    Args:
+        fingerprints: Fingerprints of the applied settings by setting
+        logger: Logger instance for output.
+    """
+    if planning() or not fingerprints:
+        # Nothing was applied, the settings are still pending for the next run
+        return
+    applied = {**load_secret_fingerprints(), **fingerprints}
+    _applied_secret_fingerprints[instance_name()] = applied
+    fingerprint_path = getenv("OIDC_SECRET_FINGERPRINT_PATH")
+    if not fingerprint_path:
+        return
+    try:
+        Path(fingerprint_path).write_text(json.dumps(applied, sort_keys=True))
+    except OSError as e:
+        logger.warning("Failed to store secret fingerprints: %s", str(e))
+
+
+def secret_changed(key: str, secret: Any) -> bool:
+    """Check whether a write-only value differs from the last applied one.
+
+    Args:
+        key: Name the fingerprint of the value is kept under
+        secret: Value to apply
+
+    Returns:
+        bool: True if the fingerprint of the value is not the stored one
+    """
+    return secret_fingerprint(secret) != load_secret_fingerprints().get(key)
+
+
+def write_only(key: str, current: Any) -> bool:
+    """Check whether Harbor does not return the current value of a setting.
+
+    Args:
+        key: Name of the setting
+        current: Current configuration as returned by ``get_config``
+
+    Returns:
+        bool: True for known write-only settings and settings missing in the
+        current configuration
+    """
+    return key in WRITE_ONLY_KEYS or getattr(current, key, None) is None
+
+
+def changed_settings(desired: Dict[str, Any], current: Any) -> Dict[str, Any]:
+    """Return the desired settings that differ from the current configuration.
+
+    Write-only settings, e.g. the OIDC client secret, are compared by the
+    fingerprint of their last applied value, as Harbor does not return them.
+
+    Args:
+        desired: Desired settings
+        current: Current configuration as returned by ``get_config``
+
+    Returns:
+        Dict[str, Any]: Changed settings
+    """
+    fingerprints = load_secret_fingerprints()
+    changes = {}
+    for key, value in desired.items():
+        if write_only(key, current):
+            if value is not None and secret_fingerprint(value) != fingerprints.get(key):
+                changes[key] = value
+            continue
+        if getattr(current, key).value != value:
+            changes[key] = value
+    return changes
 
 
 async def sync_harbor_configuration(
@@ -20,6 +150,10 @@ async def sync_harbor_configuration(
 ) -> None:
     """Synchronize the Harbor configuration from a JSON file.
 
+    The current configuration is fetched first and only the changed settings
+    are sent, as every update reinitializes e.g. the OIDC settings. Nothing is
+    sent if no setting changed.
+
     Args:
         client: Harbor API client instance.
         path: Path to the configuration JSON file.
@@ -37,12 +171,27 @@ async def sync_harbor_configuration(
 
         # Get required OIDC configuration
         harbor_config = Configurations(**config_data)
-        harbor_config.oidc_client_secret = os.environ["OIDC_STATIC_CLIENT_TOKEN"]
-        harbor_config.oidc_endpoint = os.environ["OIDC_ENDPOINT"]
-        harbor_config.robot_name_prefix = os.environ["ROBOT_NAME_PREFIX"]
+        harbor_config.oidc_client_secret = require_env("OIDC_STATIC_CLIENT_TOKEN")
+        harbor_config.oidc_endpoint = require_env("OIDC_ENDPOINT")
+        harbor_config.robot_name_prefix = require_env("ROBOT_NAME_PREFIX")
+
+        desired = harbor_config.model_dump(exclude_unset=True)
+        current = await client.get_config()
+        changes = changed_settings(desired, current)
+        if not changes:
+            logger.info("Harbor configuration is up to date")
+            return
 
-        logger.info("Updating Harbor configuration")
-        await client.update_config(harbor_config)
+        logger.info("Updating Harbor configuration: %s", ", ".join(sorted(changes)))
+        await client.update_config(Configurations(**changes))
+        store_secret_fingerprints(
+            {
+                key: secret_fingerprint(value)
+                for key, value in changes.items()
+                if write_only(key, current)
+            },
+            logger,
+        )
         logger.info("Harbor configuration updated successfully")
 
     except (FileNotFoundError, json.JSONDecodeError) as e:
@@ -0,0 +1,224 @@
+"""Harbor deadline module.
+
+Requests get a timeout by the kind of endpoint: short for reads, longer for
+writes and longest for writes Harbor needs time for, e.g. registry changes it
+validates by reaching the remote registry or GC schedule changes. With
+CYCLE_BUDGET_SECONDS, a run also has a deadline. No request timeout reaches
+past it, and once it passes the running stage is cancelled together with its
+requests in flight. The interrupted stage runs first in the next run, so a
+slow stage cannot keep the stages after it from ever running.
+"""
+
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from logging import Logger
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from instance import getenv, instance_name
+
+READ_TIMEOUT_SECONDS = float(os.environ.get("READ_TIMEOUT_SECONDS", "15"))
+WRITE_TIMEOUT_SECONDS = float(os.environ.get("WRITE_TIMEOUT_SECONDS", "30"))
+SLOW_WRITE_TIMEOUT_SECONDS = float(os.environ.get("SLOW_WRITE_TIMEOUT_SECONDS", "100"))
+
+# Path parts of the writes Harbor needs long for
+SLOW_WRITE_PATHS = ("/system/gc", "/system/purgeaudit", "/registries", "/replication")
+
+# Deadline of the current run in event loop time, None without a budget
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+# Stage interrupted by the deadline of the previous run by instance
+_interrupted: Dict[Optional[str], Optional[str]] = {}
+
+
+class BudgetExceeded(Exception):
+    """Raised if a run did not finish within its time budget."""
+
+    def __init__(self, stage: Optional[str], seconds: float):
+        """Initialize the error.
+
+        Args:
+            stage: Stage interrupted by the deadline, None between stages
+            seconds: Time budget of the run
+        """
+        self.stage = stage
+        self.seconds = seconds
+        super().__init__(
+            f"Time budget of {seconds:g} seconds exceeded"
+            + (f" in {stage}" if stage else "")
+        )
+
+
+@dataclass
+class RunBudget:
+    """Time budget of a run and the stage it is spent on."""
+
+    seconds: Optional[float]
+    deadline: Optional[float]
+    stage: Optional[str] = None
+
+
+def cycle_budget() -> Optional[float]:
+    """Return the time budget of a run of the current instance.
+
+    Returns:
+        Seconds from CYCLE_BUDGET_SECONDS, None if runs are not limited
+    """
+    value = getenv("CYCLE_BUDGET_SECONDS")
+    return float(value) if value else None
+
+
+def request_timeout(request: httpx.Request) -> float:
+    """Return the timeout of a request.
+
+    Args:
+        request: Request of the Harbor client
+
+    Returns:
+        float: Timeout of the endpoint class, cut to the time left until the
+        deadline of the run
+    """
+    if request.method in ("GET", "HEAD"):
+        timeout = READ_TIMEOUT_SECONDS
+    elif any(part in request.url.path for part in SLOW_WRITE_PATHS):
+        timeout = SLOW_WRITE_TIMEOUT_SECONDS
+    else:
+        timeout = WRITE_TIMEOUT_SECONDS
+    deadline = _deadline.get()
+    if deadline is not None:
+        timeout = min(timeout, deadline - asyncio.get_running_loop().time())
+    return timeout
+
+
+class DeadlineTransport(httpx.AsyncBaseTransport):
+    """HTTP transport applying the timeout of each request's endpoint class."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        """Initialize the transport.
+
+        Args:
+            transport: Transport sending the requests to Harbor
+        """
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Send a request with the timeout of its endpoint class.
+
+        Args:
+            request: Request of the Harbor client
+
+        Returns:
+            httpx.Response: Harbor's response
+
+        Raises:
+            httpx.TimeoutException: If the deadline of the run has passed
+        """
+        timeout = request_timeout(request)
+        if timeout <= 0:
+            raise httpx.TimeoutException("Deadline of the run passed", request=request)
+        request.extensions["timeout"] = httpx.Timeout(timeout).as_dict()
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """Close the wrapped transport."""
+        await self.transport.aclose()
+
+
+def interrupted_stage() -> Optional[str]:
+    """Return the stage the deadline of the previous run interrupted.
+
+    Returns:
+        Configuration file of the stage, None if the previous run finished
+    """
+    if instance_name() in _interrupted:
+        return _interrupted[instance_name()]
+    state_path = getenv("CYCLE_STATE_PATH")
+    if not state_path:
+        return None
+    try:
+        return json.loads(Path(state_path).read_text()).get("interrupted_stage")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def record_interrupted(stage: Optional[str], logger: Logger) -> None:
+    """Remember the stage interrupted by the deadline for the next run.
+
+    The stage is also stored in CYCLE_STATE_PATH, if set, for runs in a new
+    process.
+
+    Args:
+        stage: Configuration file of the stage, None once a run finished
+        logger: Logger instance
+    """
+    if stage is None and interrupted_stage() is None:
+        return
+    _interrupted[instance_name()] = stage
+    state_path = getenv("CYCLE_STATE_PATH")
+    if not state_path:
+        return
+    try:
+        Path(state_path).write_text(json.dumps({"interrupted_stage": stage}))
+    except OSError as e:
+        logger.warning("Failed to store cycle state", extra={"error": str(e)})
+
+
+def resume_order(stages: List[str]) -> List[str]:
+    """Order the stages of a run to start with the interrupted stage.
+
+    Stages before the interrupted one succeeded in the previous run and run
+    last.
+
+    Args:
+        stages: Configuration files of the stages, in dependency order
+
+    Returns:
+        List[str]: Stages in the order of the run
+    """
+    stage = interrupted_stage()
+    if stage not in stages:
+        return stages
+    index = stages.index(stage)
+    return stages[index:] + stages[:index]
+
+
+@asynccontextmanager
+async def run_budget(logger: Logger) -> AsyncIterator[RunBudget]:
+    """Limit the enclosed run to CYCLE_BUDGET_SECONDS.
+
+    Code inside the context sets ``stage`` of the yielded budget to the stage
+    it runs. If the deadline passes, the stage is cancelled and recorded as
+    interrupted, otherwise a previously interrupted stage is forgotten.
+
+    Args:
+        logger: Logger instance
+
+    Yields:
+        RunBudget: Budget of the run
+
+    Raises:
+        BudgetExceeded: If the run did not finish in time
+    """
+    seconds = cycle_budget()
+    deadline = None
+    if seconds is not None:
+        deadline = asyncio.get_running_loop().time() + seconds
+    budget = RunBudget(seconds, deadline)
+    token = _deadline.set(deadline)
+    try:
+        async with asyncio.timeout_at(deadline) as timeout:
+            yield budget
+    except TimeoutError as e:
+        if not timeout.expired():
+            raise
+        record_interrupted(budget.stage, logger)
+        raise BudgetExceeded(budget.stage, seconds) from e
+    finally:
+        _deadline.reset(token)
+    record_interrupted(None, logger)
@@ -10,7 +10,8 @@ import json
 from harborapi.client import HarborAsyncClient
 from harborapi.exceptions import HarborAPIException
 
-from .utils import load_json
+from utils import load_json
+from adaptive_schedule import adapt_gc_schedule
 
 
 async def sync_garbage_collection_schedule(
@@ -19,7 +20,8 @@ async def sync_garbage_collection_schedule(
     """Synchronize the garbage collection schedule with Harbor.
 
     This function will attempt to update an existing schedule, and if none exists,
-    it will create a new one.
+    it will create a new one. If the schedule has an ``adaptive`` section, the
+    cron expression and worker count are chosen from the GC job history.
 
     Args:
         client: Harbor API client instance.
@@ -34,6 +36,8 @@ async def sync_garbage_collection_schedule(
     try:
         logger.info("Loading garbage collection schedule from %s", path)
         schedule_config = load_json(path)
+        if "adaptive" in schedule_config:
+            schedule_config = await adapt_gc_schedule(client, schedule_config, logger)
 
         logger.info("Creating or updating existing garbage collection schedule")
         await client.update_gc_schedule(schedule_config)
@@ -7,30 +7,111 @@ robot accounts, webhooks, and more.
 
 import os
 import sys
+import json
+import queue
+import atexit
 import asyncio
+import argparse
 import logging
-from dataclasses import dataclass
+from logging.handlers import QueueHandler, QueueListener
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
 
+import httpx
 from harborapi import HarborAsyncClient
 from pythonjsonlogger import jsonlogger
 
-from src.utils import wait_until_healthy
-from src.password_utils import sync_admin_password
-from src.configuration import sync_harbor_configuration
-from src.registries import sync_registries
-from src.purge_job_schedule import sync_purge_job_schedule
-from src.garbage_collection_schedule import sync_garbage_collection_schedule
-from src.project_members import sync_project_members
-from src.projects import sync_projects
-from src.robot_accounts import sync_robot_accounts
-from src.webhooks import sync_webhooks
-from src.retention_policies import sync_retention_policies
-from src.replications import sync_replications
+# The operator modules import each other by their top-level name, importing
+# them the same way here keeps a single copy of each module and its state
+from utils import load_json, wait_until_healthy
+from password_utils import sync_admin_password
+from session_auth import SessionHarborClient, login, start_session
+from configuration import sync_harbor_configuration
+from registries import sync_registries
+from purge_job_schedule import sync_purge_job_schedule
+from garbage_collection_schedule import sync_garbage_collection_schedule
+from project_members import sync_project_members
+from projects import sync_projects
+from robot_accounts import sync_robot_accounts
+from webhooks import sync_webhooks
+from retention_policies import sync_retention_policies
+from replications import sync_replications
+from replication_monitor import monitor_replications
+from retention_simulator import simulate_retention
+from webhook_receiver import WebhookReceiver
+from preflight import validate_config_files
+from snapshot import open_snapshot, restore_snapshot, write_snapshot
+from instance import instance_context
+from metrics import write_metrics
+from sharding import join_shards, keep_leases, owns_project, renew_leadership
+from incremental import entry_scope, plan_sync, project_scope, save_plan
+from project_selectors import invalidate_project_index
+from planning import PlanRecorder, apply_change_set, planning_context
+from log_summary import LOG_SUMMARY, SummaryFilter, stage_summary
+from stage_scheduler import StageScheduler, parse_stage_schedules
+from deadlines import BudgetExceeded, DeadlineTransport, resume_order, run_budget
 
 
 __version__ = os.getenv("HARBOR_OPERATOR_VERSION", "0.0.0-dev")
 
+# Configuration files and their synchronization, in dependency order
+CONFIG_FILES = {
+    "configurations.json": sync_harbor_configuration,
+    "registries.json": sync_registries,
+    "projects.json": sync_projects,
+    "project-members.json": sync_project_members,
+    "replications.json": sync_replications,
+    "replication-monitor.json": monitor_replications,
+    "robots.json": sync_robot_accounts,
+    "webhooks.json": sync_webhooks,
+    "purge-job-schedule.json": sync_purge_job_schedule,
+    "garbage-collection-schedule.json": sync_garbage_collection_schedule,
+    "retention-policies.json": sync_retention_policies,
+}
+
+# Stages whose configuration can be split into a directory of fragments,
+# e.g. robots.d/*.json instead of robots.json
+FRAGMENT_STAGES = {
+    "registries.json",
+    "projects.json",
+    "project-members.json",
+    "replications.json",
+    "robots.json",
+    "webhooks.json",
+    "retention-policies.json",
+}
+
+# Stages whose results a stage needs, scheduled stages wait for them to succeed
+STAGE_DEPENDENCIES = {
+    "projects.json": ("registries.json",),
+    "project-members.json": ("projects.json",),
+    "replications.json": ("registries.json",),
+    "replication-monitor.json": ("replications.json",),
+    "robots.json": ("projects.json",),
+    "webhooks.json": ("projects.json",),
+    "retention-policies.json": ("projects.json",),
+}
+
+# Stages reconciled for single projects on webhook events. Robot accounts
+# include system robots and are left to the leader's full synchronization
+TARGETED_STAGES = (
+    "project-members.json",
+    "webhooks.json",
+    "retention-policies.json",
+)
+
+# Stages changing Harbor-wide settings, only run by the shard leader
+GLOBAL_STAGES = {
+    "configurations.json",
+    "registries.json",
+    "replications.json",
+    "replication-monitor.json",
+    "robots.json",
+    "purge-job-schedule.json",
+    "garbage-collection-schedule.json",
+}
+
 
 @dataclass
 class HarborConfig:
@@ -41,20 +122,30 @@ class HarborConfig:
     api_url: str
     config_folder: str
     json_logging: bool
+    auth_mode: str = "basic"
+    # Fleet mode settings
+    name: Optional[str] = None
+    base_folder: Optional[str] = None
+    env: Dict[str, str] = field(default_factory=dict)
+    max_connections: Optional[int] = None
 
     @classmethod
-    def from_env(cls) -> "HarborConfig":
+    def from_env(cls, overrides: Optional[Dict[str, str]] = None) -> "HarborConfig":
         """Create configuration from environment variables.
 
+        Args:
+            overrides: Environment variables overriding the process environment
+
         Returns:
             HarborConfig: Configuration instance
 
         Raises:
             ValueError: If required environment variables are missing
         """
-        admin_password = os.environ.get("ADMIN_PASSWORD_NEW")
-        api_url = os.environ.get("HARBOR_API_URL")
-        config_folder = os.environ.get("CONFIG_FOLDER_PATH")
+        env = {**os.environ, **(overrides or {})}
+        admin_password = env.get("ADMIN_PASSWORD_NEW")
+        api_url = env.get("HARBOR_API_URL")
+        config_folder = env.get("CONFIG_FOLDER_PATH")
 
         if not all([admin_password, api_url, config_folder]):
             raise ValueError(
@@ -63,14 +154,58 @@ class HarborConfig:
             )
 
         return cls(
-            admin_username=os.environ.get("ADMIN_USERNAME", "admin"),
+            admin_username=env.get("ADMIN_USERNAME", "admin"),
             admin_password=admin_password,
             api_url=api_url,
             config_folder=config_folder,
-            json_logging=os.environ.get("JSON_LOGGING", "").lower()
+            json_logging=env.get("JSON_LOGGING", "").lower()
             in ["true", "1", "yes", "y"],
+            auth_mode=env.get("AUTH_MODE", "basic").lower(),
+            env=dict(overrides or {}),
         )
 
+    @classmethod
+    def fleet_from_file(cls, path: str) -> Tuple[List["HarborConfig"], int]:
+        """Create the configurations of a fleet of Harbor instances.
+
+        Each instance has a unique ``name``, environment variables in ``env``
+        overriding the process environment and an optional ``max_connections``
+        limit. Configuration files missing in an instance's
+        ``CONFIG_FOLDER_PATH`` are taken from the shared ``base_folder``.
+
+        Args:
+            path: Path to the fleet configuration file
+
+        Returns:
+            Tuple of the instance configurations and the number of instances
+            synchronized at the same time
+
+        Raises:
+            ValueError: If an instance is invalid or a name is not unique
+        """
+        fleet = load_json(path)
+        base_folder = fleet.get("base_folder")
+
+        configs = []
+        for instance in fleet.get("instances", []):
+            name = instance.get("name")
+            if not name or any(config.name == name for config in configs):
+                raise ValueError(f"Fleet instance names must be unique: {name!r}")
+
+            env = dict(instance.get("env", {}))
+            if base_folder:
+                env.setdefault("CONFIG_FOLDER_PATH", base_folder)
+            try:
+                config = cls.from_env(env)
+            except ValueError as e:
+                raise ValueError(f"Invalid fleet instance {name}: {e}") from e
+            config.name = name
+            config.base_folder = base_folder
+            config.max_connections = instance.get("max_connections")
+            configs.append(config)
+
+        return configs, fleet.get("concurrency", len(configs))
+
 
 def set_up_logging(use_json: bool) -> logging.Logger:
     """Configure logging with either JSON or standard format.
@@ -82,7 +217,7 @@ def set_up_logging(use_json: bool) -> logging.Logger:
         logging.Logger: Configured logger instance
     """
     logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 
     formatter = (
         jsonlogger.JsonFormatter()
@@ -92,11 +227,42 @@ def set_up_logging(use_json: bool) -> logging.Logger:
 
     handler = logging.StreamHandler()
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+
+    # Records are formatted and written by a background thread, so neither
+    # formatting nor a slow stdout blocks the event loop
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    if LOG_SUMMARY:
+        queue_handler.addFilter(SummaryFilter(logger.level <= logging.DEBUG))
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
 
     return logger
 
 
+def instance_logger(logger: logging.Logger, name: str) -> logging.Logger:
+    """Return a child logger that adds the instance name to every record.
+
+    Args:
+        logger: Parent logger
+        name: Name of the Harbor instance
+
+    Returns:
+        logging.Logger: Logger of the instance
+    """
+    child = logger.getChild(name)
+    if not child.filters:
+
+        def add_instance(record: logging.LogRecord) -> bool:
+            record.instance = name
+            return True
+
+        child.addFilter(add_instance)
+    return child
+
+
 class HarborSynchronizer:
     """Handles synchronization of Harbor configurations."""
 
@@ -108,14 +274,56 @@ class HarborSynchronizer:
             logger: Logger instance
         """
         self.config = config
-        self.logger = logger
-        self.client = HarborAsyncClient(
+        self.logger = instance_logger(logger, config.name) if config.name else logger
+        client_class = (
+            SessionHarborClient if config.auth_mode == "session" else HarborAsyncClient
+        )
+        self.client = client_class(
             url=config.api_url,
             username=config.admin_username,
             secret=config.admin_password,
             timeout=100,
             verify=False,
         )
+        if config.max_connections:
+            # Bound the concurrent requests of this instance, e.g. in fleet mode
+            self.client.client._transport = httpx.AsyncHTTPTransport(
+                verify=False,
+                limits=httpx.Limits(max_connections=config.max_connections),
+            )
+        # Time out requests by endpoint class and within the deadline of a run
+        self.client.client._transport = DeadlineTransport(self.client.client._transport)
+
+    def _config_path(self, filename: str) -> Path:
+        """Return the path of a configuration file.
+
+        A directory of fragments named after the file with a ``.d`` suffix,
+        e.g. ``robots.d``, is used instead of the file if it exists. Files
+        missing in the instance's config folder are taken from the shared base
+        folder, if one is configured.
+
+        Args:
+            filename: Name of the configuration file
+
+        Returns:
+            Path: Path of the configuration file or directory
+        """
+        names = [filename]
+        if filename in FRAGMENT_STAGES:
+            names.insert(0, filename.removesuffix(".json") + ".d")
+        folders = [self.config.config_folder]
+        if self.config.base_folder:
+            folders.append(self.config.base_folder)
+        for folder in folders:
+            for name in names:
+                path = Path(folder) / name
+                if path.exists():
+                    return path
+        return Path(self.config.config_folder) / filename
+
+    def _config_paths(self) -> Dict[str, Path]:
+        """Return the paths of all configuration files by file name."""
+        return {filename: self._config_path(filename) for filename in CONFIG_FILES}
 
     async def _sync_config_file(
         self, filename: str, sync_func: callable, required: bool = False
@@ -130,7 +338,7 @@ class HarborSynchronizer:
         Raises:
             FileNotFoundError: If a required configuration file is missing
         """
-        path = Path(self.config.config_folder) / filename
+        path = self._config_path(filename)
 
         if not path.exists():
             msg = f"Configuration file not found: {filename}"
@@ -141,11 +349,49 @@ class HarborSynchronizer:
             return
 
         try:
-            await sync_func(self.client, str(path), self.logger)
+            with stage_summary(filename, self.logger):
+                await sync_func(self.client, str(path), self.logger)
         except Exception as e:
             self.logger.error(f"Failed to sync {filename}", extra={"error": str(e)})
             raise
 
+    async def _run_stage(
+        self,
+        filename: str,
+        sync_func: callable,
+        projects: Optional[Set[str]],
+        entries: Optional[Set[str]] = None,
+    ) -> None:
+        """Run a synchronization stage, limited to some projects or entries.
+
+        Harbor-wide stages are skipped unless this replica is the shard leader.
+
+        Args:
+            filename: Name of the configuration file
+            sync_func: Function to call for synchronization
+            projects: Names of the projects to synchronize, None for all
+            entries: Keys of the entries to synchronize, None for all
+        """
+        if filename in GLOBAL_STAGES and not await renew_leadership(self.logger):
+            self.logger.info(f"Not the shard leader - skipping {filename}")
+            return
+        with project_scope(projects), entry_scope(entries):
+            await self._sync_config_file(filename, sync_func)
+
+    async def _authenticate(self) -> None:
+        """Authenticate the client, updating the admin password if needed."""
+        if self.config.auth_mode == "session":
+            self.logger.info("Authenticating with Harbor session")
+            await start_session(
+                self.client,
+                self.config.admin_username,
+                self.config.admin_password,
+                self.logger,
+            )
+        else:
+            self.logger.info("Checking admin password")
+            await sync_admin_password(self.client, self.logger)
+
     async def synchronize(self) -> None:
         """Synchronize all Harbor configurations.
 
@@ -155,39 +401,517 @@ class HarborSynchronizer:
         Raises:
             Exception: If any synchronization step fails
         """
-        try:
-            self.logger.info("Starting Harbor synchronization")
+        with instance_context(self.config.name, self.config.env):
+            await self._synchronize_stages()
 
-            # Wait for Harbor to be healthy
-            self.logger.info("Waiting for Harbor to be healthy")
-            await wait_until_healthy(self.client, self.logger)
+    async def _synchronize_stages(self) -> None:
+        """Synchronize all Harbor configurations of the current instance.
 
-            # Update admin password if needed
-            self.logger.info("Checking admin password")
-            await sync_admin_password(self.client, self.logger)
+        Raises:
+            Exception: If any synchronization step fails
+        """
+        try:
+            self.logger.info("Starting Harbor synchronization")
 
-            # Sync configurations in dependency order
-            config_files = {
-                "configurations.json": sync_harbor_configuration,
-                "registries.json": sync_registries,
-                "projects.json": sync_projects,
-                "project-members.json": sync_project_members,
-                "replications.json": sync_replications,
-                "robots.json": sync_robot_accounts,
-                "webhooks.json": sync_webhooks,
-                "purge-job-schedule.json": sync_purge_job_schedule,
-                "garbage-collection-schedule.json": sync_garbage_collection_schedule,
-                "retention-policies.json": sync_retention_policies,
-            }
-
-            for filename, sync_func in config_files.items():
-                await self._sync_config_file(filename, sync_func)
+            # Fail on invalid configuration files before any request
+            await validate_config_files(self._config_paths(), self.logger)
+
+            # Stop the run once CYCLE_BUDGET_SECONDS have passed
+            async with run_budget(self.logger) as budget:
+                # Wait for Harbor to be healthy
+                self.logger.info("Waiting for Harbor to be healthy")
+                await wait_until_healthy(self.client, self.logger)
+
+                # Update admin password if needed
+                await self._authenticate()
+
+                # Projects may have changed since the previous run of a daemon
+                invalidate_project_index()
+
+                # Split project-scoped work between the replicas
+                await join_shards(self.logger)
+
+                # Limit the run to changes since the previous run in incremental mode
+                plan = await plan_sync(self.client, self._config_paths(), self.logger)
+
+                # Sync configurations in dependency order, starting with the
+                # stage the budget of the previous run ran out in
+                for filename in resume_order(list(CONFIG_FILES)):
+                    run, projects = plan.stage_scope(filename)
+                    if not run:
+                        self.logger.info(f"No changes for {filename} - skipping")
+                        continue
+                    budget.stage = filename
+                    await self._run_stage(
+                        filename,
+                        CONFIG_FILES[filename],
+                        projects,
+                        plan.stage_entry_scope(filename),
+                    )
+                budget.stage = None
+
+            save_plan(plan, self.logger)
 
             self.logger.info("Harbor synchronization completed successfully")
 
         except Exception as e:
             self.logger.error("Harbor synchronization failed", extra={"error": str(e)})
             raise
+        finally:
+            write_metrics(self.logger)
+
+    async def reconcile_projects(self, projects: Set[str]) -> None:
+        """Reconcile the project-scoped configuration of some projects.
+
+        Only the members, webhooks and retention policies are synchronized,
+        robot accounts and Harbor-wide settings are left to the next full
+        synchronization. The client is authenticated and the shard membership
+        refreshed first, projects assigned to other replicas are logged and
+        skipped.
+
+        Args:
+            projects: Names of the projects
+
+        Raises:
+            Exception: If any synchronization step fails
+        """
+        with instance_context(self.config.name, self.config.env):
+            try:
+                self.logger.info(
+                    "Starting targeted reconciliation",
+                    extra={"projects": sorted(projects)},
+                )
+                await self._authenticate()
+                invalidate_project_index()
+                await join_shards(self.logger)
+
+                foreign = {project for project in projects if not owns_project(project)}
+                if foreign:
+                    self.logger.info(
+                        "Skipping projects of other replicas",
+                        extra={"projects": sorted(foreign)},
+                    )
+                projects = projects - foreign
+                if not projects:
+                    return
+                for filename in TARGETED_STAGES:
+                    await self._run_stage(filename, CONFIG_FILES[filename], projects)
+                self.logger.info("Targeted reconciliation completed successfully")
+            except Exception as e:
+                self.logger.error(
+                    "Targeted reconciliation failed", extra={"error": str(e)}
+                )
+                raise
+            finally:
+                write_metrics(self.logger)
+
+    async def run_due_stages(self, scheduler: StageScheduler) -> None:
+        """Run the stages that are due, in dependency order.
+
+        Stages whose dependencies have not succeeded are postponed. The
+        outcome of every stage run is recorded with the scheduler, stages
+        cancelled once CYCLE_BUDGET_SECONDS have passed count as failed.
+
+        Args:
+            scheduler: Scheduler of the stages
+        """
+        loop = asyncio.get_running_loop()
+        due = scheduler.due(loop.time())
+        if not due:
+            return
+        with instance_context(self.config.name, self.config.env):
+            self.logger.info("Starting scheduled stages", extra={"stages": due})
+            try:
+                async with run_budget(self.logger) as budget:
+                    try:
+                        await validate_config_files(self._config_paths(), self.logger)
+                        await wait_until_healthy(self.client, self.logger)
+                        await self._authenticate()
+                        invalidate_project_index()
+                        await join_shards(self.logger)
+                    except Exception as e:
+                        self.logger.error(
+                            "Scheduled stages failed", extra={"error": str(e)}
+                        )
+                        for filename in due:
+                            scheduler.record(filename, False, loop.time())
+                        return
+
+                    for filename in due:
+                        budget.stage = filename
+                        await self._run_scheduled_stage(scheduler, filename)
+                    budget.stage = None
+            except BudgetExceeded as e:
+                # Stages not reached are still due and run next
+                self.logger.error("Scheduled stages failed", extra={"error": str(e)})
+                for filename in [e.stage] if e.stage else due:
+                    scheduler.record(filename, False, loop.time())
+            finally:
+                write_metrics(self.logger)
+
+    async def _run_scheduled_stage(
+        self, scheduler: StageScheduler, filename: str
+    ) -> None:
+        """Run a due stage and schedule its next run.
+
+        Args:
+            scheduler: Scheduler of the stages
+            filename: Name of the configuration file
+        """
+        loop = asyncio.get_running_loop()
+        blocking = scheduler.blocking(filename)
+        if blocking:
+            delay = scheduler.postpone(filename, loop.time())
+            self.logger.warning(
+                f"Dependencies of {filename} not synchronized - postponing",
+                extra={"dependencies": blocking, "seconds": round(delay)},
+            )
+            return
+        try:
+            await self._run_stage(filename, CONFIG_FILES[filename], None)
+            success = True
+        except Exception:
+            success = False  # Logged by the stage
+        delay, failures = scheduler.record(filename, success, loop.time())
+        self.logger.info(
+            f"Next run of {filename} scheduled",
+            extra={"seconds": round(delay), "failures": failures},
+        )
+
+    async def run_daemon(self) -> None:
+        """Synchronize periodically and reconcile projects on webhook events.
+
+        A full synchronization runs every SYNC_INTERVAL_SECONDS. If
+        STAGE_SCHEDULES is set, each stage runs on its own schedule instead.
+        If WEBHOOK_LISTEN_PORT is set, the projects of Harbor webhook events
+        received in between are reconciled right away. Failed runs are logged
+        and retried with the next run. Shard leases are renewed in the
+        background, independent of the runs.
+        """
+        interval = int(os.environ.get("SYNC_INTERVAL_SECONDS", "3600"))
+        scheduler = None
+        schedules = os.environ.get("STAGE_SCHEDULES")
+        if schedules:
+            scheduler = StageScheduler(
+                parse_stage_schedules(schedules, CONFIG_FILES, interval),
+                STAGE_DEPENDENCIES,
+            )
+        receiver = None
+        listen_port = os.environ.get("WEBHOOK_LISTEN_PORT")
+        if listen_port:
+            receiver = WebhookReceiver(
+                self.logger, os.environ.get("WEBHOOK_RECEIVER_AUTH_HEADER")
+            )
+            await receiver.start(int(listen_port))
+        with instance_context(self.config.name, self.config.env):
+            lease_keeper = asyncio.create_task(keep_leases(self.logger))
+
+        loop = asyncio.get_running_loop()
+        next_sync = loop.time()
+        try:
+            while True:
+                if scheduler is not None:
+                    await self.run_due_stages(scheduler)
+                    next_sync = scheduler.next_run()
+                elif loop.time() >= next_sync:
+                    try:
+                        await self.synchronize()
+                    except Exception:
+                        pass  # Logged by synchronize, retried with the next run
+                    next_sync = loop.time() + interval
+
+                timeout = max(next_sync - loop.time(), 0)
+                if receiver is None:
+                    await asyncio.sleep(timeout)
+                    continue
+                projects = await receiver.wait_for_projects(timeout)
+                if projects:
+                    try:
+                        await self.reconcile_projects(projects)
+                    except Exception:
+                        pass  # Logged by reconcile_projects, corrected by the next run
+        finally:
+            lease_keeper.cancel()
+            if receiver:
+                await receiver.close()
+
+    async def snapshot(self, output_path: str) -> None:
+        """Write a snapshot of all managed Harbor resources.
+
+        Args:
+            output_path: Snapshot file, gzip compressed if it ends with ``.gz``
+
+        Raises:
+            Exception: If any Harbor API operation fails
+        """
+        with instance_context(self.config.name, self.config.env):
+            await wait_until_healthy(self.client, self.logger)
+            await self._authenticate()
+            self.logger.info("Writing snapshot", extra={"path": output_path})
+            with open_snapshot(output_path, "w") as output:
+                await write_snapshot(self.client, output, self.logger)
+            self.logger.info("Snapshot written successfully")
+
+    async def restore(
+        self, input_path: str, concurrency: int, prune: bool = False
+    ) -> None:
+        """Restore Harbor from a snapshot.
+
+        Resources missing in the snapshot are removed like resources missing
+        in the configuration files. Resource types without any entry in the
+        snapshot are left alone unless ``prune`` is set.
+
+        Args:
+            input_path: Snapshot file, gzip compressed if it ends with ``.gz``
+            concurrency: Maximum number of configuration files applied at once
+            prune: Whether to delete all resources of types missing in the
+                snapshot
+
+        Raises:
+            Exception: If any synchronization step fails
+        """
+        with instance_context(self.config.name, self.config.env):
+            await wait_until_healthy(self.client, self.logger)
+            await self._authenticate()
+            self.logger.info("Restoring snapshot", extra={"path": input_path})
+            try:
+                with open_snapshot(input_path, "r") as snapshot:
+                    await restore_snapshot(
+                        self.client,
+                        snapshot,
+                        CONFIG_FILES,
+                        self.logger,
+                        concurrency,
+                        prune,
+                    )
+            except Exception as e:
+                self.logger.error("Snapshot restore failed", extra={"error": str(e)})
+                raise
+            finally:
+                write_metrics(self.logger)
+            self.logger.info("Snapshot restored successfully")
+
+    async def plan(self, output_path: Optional[str] = None) -> None:
+        """Compute the changes a synchronization would make without making them.
+
+        All stages run against a recorder that caches reads across stages and
+        records writes instead of sending them. The admin password is not
+        synchronized and shard leases are not taken, the plan covers every
+        stage and project. Stages failing on resources only created by the
+        plan are reported in the change set.
+
+        Args:
+            output_path: File to write the change set to, stdout if not given
+
+        Raises:
+            Exception: If Harbor is unreachable or rejects the credentials
+        """
+        with instance_context(self.config.name, self.config.env):
+            await validate_config_files(self._config_paths(), self.logger)
+            await wait_until_healthy(self.client, self.logger)
+            if self.config.auth_mode == "session":
+                await login(
+                    self.client,
+                    self.config.admin_username,
+                    self.config.admin_password,
+                    self.logger,
+                )
+            invalidate_project_index()
+
+            self.logger.info("Computing plan")
+            transport = self.client.client._transport
+            recorder = PlanRecorder(transport, self.config.api_url)
+            self.client.client._transport = recorder
+            try:
+                with planning_context():
+                    for filename, sync_func in CONFIG_FILES.items():
+                        recorder.stage = filename
+                        try:
+                            await self._sync_config_file(filename, sync_func)
+                        except Exception as e:
+                            recorder.errors.append({"stage": filename, "error": str(e)})
+            finally:
+                self.client.client._transport = transport
+
+            change_set = recorder.change_set(self.config.api_url)
+            if output_path:
+                # Request bodies may contain secrets from the environment
+                Path(output_path).touch(mode=0o600)
+                Path(output_path).write_text(json.dumps(change_set, indent=2))
+            else:
+                json.dump(change_set, sys.stdout, indent=2)
+                sys.stdout.write("\n")
+            self.logger.info(
+                "Plan computed",
+                extra={
+                    "changes": len(change_set["changes"]),
+                    "counts": change_set["counts"],
+                    "reads": change_set["reads"],
+                    "cached_reads": change_set["cached_reads"],
+                    "errors": len(change_set["errors"]),
+                },
+            )
+
+    async def apply_plan(self, plan_path: str) -> None:
+        """Apply the change set of a plan without reading Harbor again.
+
+        Args:
+            plan_path: File the plan wrote the change set to
+
+        Raises:
+            Exception: If any Harbor API operation fails
+        """
+        with instance_context(self.config.name, self.config.env):
+            change_set = json.loads(Path(plan_path).read_text())
+            if change_set.get("source") != self.config.api_url:
+                self.logger.warning(
+                    "Plan was computed against another Harbor instance",
+                    extra={"source": change_set.get("source")},
+                )
+            await wait_until_healthy(self.client, self.logger)
+            await self._authenticate()
+            try:
+                await apply_change_set(self.client, change_set, self.logger)
+            except Exception as e:
+                self.logger.error("Applying plan failed", extra={"error": str(e)})
+                raise
+            finally:
+                write_metrics(self.logger)
+            self.logger.info("Plan applied successfully")
+
+    async def simulate_retention(self, output_path: Optional[str] = None) -> None:
+        """Simulate the configured retention policies without applying them.
+
+        Args:
+            output_path: File to write the report to, stdout if not given
+
+        Raises:
+            FileNotFoundError: If retention-policies.json is missing
+        """
+        path = self._config_path("retention-policies.json")
+        if not path.exists():
+            raise FileNotFoundError(
+                "Configuration file not found: retention-policies.json"
+            )
+
+        await wait_until_healthy(self.client, self.logger)
+        if output_path:
+            with open(output_path, "w") as output:
+                await simulate_retention(self.client, str(path), self.logger, output)
+        else:
+            await simulate_retention(self.client, str(path), self.logger)
+
+
+async def synchronize_fleet(
+    configs: List[HarborConfig], logger: logging.Logger, concurrency: int
+) -> List[str]:
+    """Synchronize a fleet of Harbor instances from one event loop.
+
+    At most ``concurrency`` instances are synchronized at the same time. A
+    failing instance does not stop the synchronization of the others.
+
+    Args:
+        configs: Configurations of the instances
+        logger: Logger instance
+        concurrency: Maximum number of instances synchronized at the same time
+
+    Returns:
+        List[str]: Names of the instances that failed
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def synchronize_instance(config: HarborConfig) -> None:
+        async with semaphore:
+            await HarborSynchronizer(config, logger).synchronize()
+
+    logger.info("Starting fleet synchronization", extra={"instances": len(configs)})
+    results = await asyncio.gather(
+        *(synchronize_instance(config) for config in configs),
+        return_exceptions=True,
+    )
+    failed = [
+        config.name
+        for config, result in zip(configs, results)
+        if isinstance(result, Exception)
+    ]
+    logger.info(
+        "Fleet synchronization completed",
+        extra={"instances": len(configs), "failed": failed},
+    )
+    return failed
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """Parse the command line arguments.
+
+    Args:
+        argv: Command line arguments without the program name
+
+    Returns:
+        argparse.Namespace: Parsed arguments, ``command`` defaults to ``sync``
+    """
+    parser = argparse.ArgumentParser(prog="harbor", description="Harbor Day2 Operator")
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"Harbor Day2 Operator {__version__}",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser(
+        "sync", help="Synchronize Harbor with the configuration files (default)"
+    )
+    subparsers.add_parser(
+        "daemon",
+        help="Synchronize periodically and reconcile projects on webhook events",
+    )
+    simulate_parser = subparsers.add_parser(
+        "simulate-retention",
+        help="Report the artifacts the retention policies would delete",
+    )
+    simulate_parser.add_argument(
+        "--output", help="File to write the report to (default: stdout)"
+    )
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot", help="Write all managed Harbor resources to a snapshot file"
+    )
+    snapshot_parser.add_argument(
+        "--output", required=True, help="Snapshot file, compressed if it ends in .gz"
+    )
+    restore_parser = subparsers.add_parser(
+        "restore", help="Apply a snapshot file to Harbor"
+    )
+    restore_parser.add_argument(
+        "--input", required=True, help="Snapshot file, compressed if it ends in .gz"
+    )
+    restore_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Configuration files applied at the same time (default: 4)",
+    )
+    restore_parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Delete all resources of types without entries in the snapshot",
+    )
+
+    plan_parser = subparsers.add_parser(
+        "plan", help="Compute the changes a synchronization would make"
+    )
+    plan_parser.add_argument(
+        "--output", help="File to write the change set to (default: stdout)"
+    )
+    apply_parser = subparsers.add_parser(
+        "apply", help="Apply the change set of a plan without reading Harbor"
+    )
+    apply_parser.add_argument(
+        "--plan", required=True, help="Change set file written by the plan command"
+    )
+
+    args = parser.parse_args(argv)
+    args.command = args.command or "sync"
+    return args
 
 
 async def main() -> None:
@@ -199,21 +923,44 @@ async def main() -> None:
     Raises:
         Exception: If initialization or synchronization fails
     """
-    # Check for version flag
-    if len(sys.argv) > 1 and sys.argv[1] == "--version":
-        print(f"Harbor Day2 Operator {__version__}")
-        sys.exit(0)
+    # Parse command line, exits on --version
+    args = parse_args(sys.argv[1:])
 
     try:
+        fleet_config_path = os.environ.get("FLEET_CONFIG_PATH")
+        if fleet_config_path:
+            if args.command != "sync":
+                raise ValueError(f"{args.command} is not supported in fleet mode")
+            configs, concurrency = HarborConfig.fleet_from_file(fleet_config_path)
+            logger = set_up_logging(
+                os.environ.get("JSON_LOGGING", "").lower() in ["true", "1", "yes", "y"]
+            )
+            if await synchronize_fleet(configs, logger, concurrency):
+                sys.exit(1)
+            return
+
         # Load configuration from environment
         config = HarborConfig.from_env()
 
         # Setup logging
         logger = set_up_logging(config.json_logging)
 
-        # Initialize and run synchronizer
+        # Initialize synchronizer and run the requested command
         synchronizer = HarborSynchronizer(config, logger)
-        await synchronizer.synchronize()
+        if args.command == "simulate-retention":
+            await synchronizer.simulate_retention(args.output)
+        elif args.command == "snapshot":
+            await synchronizer.snapshot(args.output)
+        elif args.command == "restore":
+            await synchronizer.restore(args.input, args.concurrency, args.prune)
+        elif args.command == "plan":
+            await synchronizer.plan(args.output)
+        elif args.command == "apply":
+            await synchronizer.apply_plan(args.plan)
+        elif args.command == "daemon":
+            await synchronizer.run_daemon()
+        else:
+            await synchronizer.synchronize()
     except ValueError as e:
         logger = logging.getLogger()
         logger.error("Fatal error: %s", str(e))
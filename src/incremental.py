@@ -0,0 +1,540 @@
+"""Harbor incremental synchronization module.
+
+After a full synchronization, later runs only reconcile what changed: stages
+whose configuration file changed, and resources that received operations by
+other users according to Harbor's audit log since the previous run. A full
+synchronization still runs periodically to catch anything the audit log
+missed.
+
+For configurations split into a directory of fragments, the entries of each
+fragment are remembered, and a changed fragment limits its stage to the
+entries it had before and has now.
+"""
+
+import hashlib
+import json
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from instance import getenv
+from pagination import iter_records
+from sharding import owns_project, shard_members
+from utils import (
+    TEMPLATE_PATTERN,
+    fragment_paths,
+    read_config_file,
+    replace_env_vars_in_obj,
+)
+
+AUDIT_LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Audit log timestamps have second resolution, overlap the ranges slightly
+CURSOR_OVERLAP = timedelta(seconds=1)
+
+# Stages that reconcile single projects and can be limited to some projects
+PROJECT_STAGES = {
+    "projects.json",
+    "project-members.json",
+    "webhooks.json",
+    "retention-policies.json",
+}
+# Stages that run on every run, as they observe Harbor instead of changing it
+ALWAYS_STAGES = {"replication-monitor.json"}
+
+# Environment variables stages read besides the placeholders of their files
+STAGE_ENV_INPUTS = {
+    "robots.json": ("ROBOT_NAME_PREFIX",),
+    "webhooks.json": ("WEBHOOK_RECEIVER_URL", "WEBHOOK_RECEIVER_AUTH_HEADER"),
+}
+ENV_PLACEHOLDER_PATTERN = re.compile(rb"\$\{([A-Z0-9_]+)\}")
+
+# Fields identifying the entries of fragments, by stage. Changed fragments of
+# other stages synchronize the whole stage.
+ENTRY_KEYS = {
+    "projects.json": "project_name",
+    "project-members.json": "project_name",
+    "webhooks.json": "project_name",
+    "robots.json": "name",
+}
+
+# Keywords of audit log resource types and the stages reconciling them
+RESOURCE_STAGES: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("member", ("project-members.json",)),
+    ("user_group", ("project-members.json",)),
+    ("robot", ("robots.json",)),
+    ("webhook", ("webhooks.json",)),
+    ("notification", ("webhooks.json",)),
+    ("retention", ("retention-policies.json",)),
+    ("replication", ("replications.json",)),
+    ("registry", ("registries.json",)),
+    ("configur", ("configurations.json",)),
+    ("gc", ("garbage-collection-schedule.json",)),
+    ("purge", ("purge-job-schedule.json",)),
+    ("project", tuple(sorted(PROJECT_STAGES))),
+)
+
+
+class AuditLogRecord(NamedTuple):
+    """Fields of an audit log entry needed to plan a run."""
+
+    username: Optional[str]
+    resource: Optional[str]
+    resource_type: Optional[str]
+
+
+# Projects the running stage is limited to, None for all
+_project_scope: ContextVar[Optional[Set[str]]] = ContextVar(
+    "project_scope", default=None
+)
+# Entries the running stage is limited to, None for all
+_entry_scope: ContextVar[Optional[Set[str]]] = ContextVar("entry_scope", default=None)
+
+
+@dataclass
+class SyncPlan:
+    """Stages and projects to reconcile in a run."""
+
+    full: bool
+    cursor: datetime
+    file_fingerprints: Dict[str, str]
+    input_fingerprints: Dict[str, str] = field(default_factory=dict)
+    shard_members: List[str] = field(default_factory=list)
+    full_stages: Set[str] = field(default_factory=set)
+    stage_projects: Dict[str, Set[str]] = field(default_factory=dict)
+    stage_entries: Dict[str, Set[str]] = field(default_factory=dict)
+    fragments: Dict[str, Dict[str, Dict[str, Any]]] = field(default_factory=dict)
+
+    def stage_scope(self, filename: str) -> Tuple[bool, Optional[Set[str]]]:
+        """Return whether a stage runs and which projects it is limited to.
+
+        Args:
+            filename: Configuration file of the stage
+
+        Returns:
+            Tuple of whether the stage runs and its projects, None for all
+        """
+        if self.full or filename in ALWAYS_STAGES or filename in self.full_stages:
+            return True, None
+        if filename in self.stage_projects:
+            return True, self.stage_projects[filename]
+        if filename in self.stage_entries:
+            return True, None
+        return False, None
+
+    def stage_entry_scope(self, filename: str) -> Optional[Set[str]]:
+        """Return the entries a stage is limited to.
+
+        Args:
+            filename: Configuration file of the stage
+
+        Returns:
+            Keys of the entries of changed fragments, None for all entries
+        """
+        if self.full or filename in self.full_stages:
+            return None
+        return self.stage_entries.get(filename)
+
+
+def content_fingerprint(content: bytes) -> str:
+    """Return the fingerprint of the content of a configuration file.
+
+    The values of the ``${VAR}`` placeholders are part of the fingerprint, so
+    a changed secret from the environment changes it as well.
+
+    Args:
+        content: Content of the file
+
+    Returns:
+        str: SHA-256 hex digest of the content and its placeholder values
+    """
+    digest = hashlib.sha256(content)
+    for name in sorted(set(ENV_PLACEHOLDER_PATTERN.findall(content))):
+        digest.update(json.dumps([name.decode(), getenv(name.decode())]).encode())
+    return digest.hexdigest()
+
+
+def input_fingerprint(filename: str) -> Optional[str]:
+    """Return the fingerprint of the environment variables a stage reads.
+
+    Args:
+        filename: Configuration file of the stage
+
+    Returns:
+        SHA-256 hex digest of the values of STAGE_ENV_INPUTS, None if the
+        stage reads none
+    """
+    names = STAGE_ENV_INPUTS.get(filename)
+    if not names:
+        return None
+    content = json.dumps({name: getenv(name) for name in names}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def file_fingerprint(path: Path) -> Optional[str]:
+    """Return the fingerprint of a configuration file.
+
+    Args:
+        path: Path of the configuration file
+
+    Returns:
+        Fingerprint of the content, or of the fragment fingerprints of a
+        directory, None if the file does not exist
+    """
+    if not path.exists():
+        return None
+    if path.is_dir():
+        return directory_fingerprint(fragment_fingerprints(path))
+    return content_fingerprint(path.read_bytes())
+
+
+def fragment_fingerprints(path: Path) -> Dict[str, str]:
+    """Return the fingerprints of the fragments of a configuration directory.
+
+    Args:
+        path: Path of the configuration directory
+
+    Returns:
+        Dict[str, str]: Fingerprint of each fragment by file name
+    """
+    return {
+        fragment.name: content_fingerprint(fragment.read_bytes())
+        for fragment in fragment_paths(path)
+    }
+
+
+def directory_fingerprint(fingerprints: Dict[str, str]) -> str:
+    """Return the fingerprint of a configuration directory.
+
+    Args:
+        fingerprints: Fingerprints of its fragments by file name
+
+    Returns:
+        str: SHA-256 hex digest of the fragment names and fingerprints
+    """
+    content = json.dumps(fingerprints, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def fragment_keys(filename: str, path: Path) -> Optional[List[str]]:
+    """Return the keys of the entries of a fragment.
+
+    Args:
+        filename: Configuration file of the stage
+        path: Path of the fragment
+
+    Returns:
+        Keys of the entries, None if the stage has no entry keys or an entry
+        has none, e.g. an entry selecting several projects
+    """
+    key_field = ENTRY_KEYS.get(filename)
+    if key_field is None:
+        return None
+    try:
+        content = TEMPLATE_PATTERN.sub("0", read_config_file(str(path)))
+        entries = replace_env_vars_in_obj(json.loads(content))
+    except ValueError:
+        return None
+    if not isinstance(entries, list):
+        return None
+    keys = [
+        entry.get(key_field) if isinstance(entry, dict) else None for entry in entries
+    ]
+    if not all(isinstance(key, str) for key in keys):
+        return None
+    return keys
+
+
+def fragment_states(
+    filename: str, path: Path, previous: Dict[str, Dict[str, Any]]
+) -> Dict[str, Dict[str, Any]]:
+    """Return the fingerprints and entry keys of the fragments of a directory.
+
+    Only fragments that changed since the previous run are parsed.
+
+    Args:
+        filename: Configuration file of the stage
+        path: Path of the configuration directory
+        previous: States of the fragments in the previous run
+
+    Returns:
+        Dict[str, Dict[str, Any]]: ``hash`` and ``keys`` of each fragment by
+        file name
+    """
+    states = {}
+    for name, fingerprint in fragment_fingerprints(path).items():
+        state = previous.get(name)
+        if not state or state.get("hash") != fingerprint:
+            state = {"hash": fingerprint, "keys": fragment_keys(filename, path / name)}
+        states[name] = state
+    return states
+
+
+def changed_entries(
+    previous: Dict[str, Dict[str, Any]], current: Dict[str, Dict[str, Any]]
+) -> Optional[Set[str]]:
+    """Return the keys of the entries in fragments changed since the previous run.
+
+    Entries of changed and removed fragments are included as they were
+    before, so removed entries are deleted.
+
+    Args:
+        previous: States of the fragments in the previous run
+        current: States of the fragments now
+
+    Returns:
+        Keys of the entries to reconcile, None if a changed fragment has
+        entries without a key
+    """
+    keys: Set[str] = set()
+    for name in previous.keys() | current.keys():
+        before, now = previous.get(name), current.get(name)
+        if before and now and before.get("hash") == now["hash"]:
+            continue
+        for state in (before, now):
+            if state is None:
+                continue
+            if state.get("keys") is None:
+                return None
+            keys.update(state["keys"])
+    return keys
+
+
+def load_state() -> Optional[Dict[str, Any]]:
+    """Load the state of the previous run from INCREMENTAL_STATE_PATH.
+
+    Returns:
+        The state, None if incremental mode is disabled or no state exists
+    """
+    state_path = getenv("INCREMENTAL_STATE_PATH")
+    if not state_path:
+        return None
+    try:
+        return json.loads(Path(state_path).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_plan(plan: SyncPlan, logger: Logger) -> None:
+    """Store the state of a successful run in INCREMENTAL_STATE_PATH.
+
+    Args:
+        plan: Plan of the run
+        logger: Logger instance
+    """
+    state_path = getenv("INCREMENTAL_STATE_PATH")
+    if not state_path:
+        return
+    previous = load_state() or {}
+    state = {
+        "cursor": plan.cursor.isoformat(),
+        "last_full_sync": (
+            plan.cursor.isoformat() if plan.full else previous.get("last_full_sync")
+        ),
+        "files": plan.file_fingerprints,
+        "inputs": plan.input_fingerprints,
+        "fragments": plan.fragments,
+        "shard_members": plan.shard_members,
+    }
+    try:
+        Path(state_path).write_text(json.dumps(state))
+    except OSError as e:
+        logger.warning("Failed to store incremental state", extra={"error": str(e)})
+
+
+def stages_for_resource(resource_type: str) -> Tuple[str, ...]:
+    """Return the stages reconciling an audit log resource type.
+
+    Args:
+        resource_type: Resource type of an audit log entry
+
+    Returns:
+        Tuple[str, ...]: Configuration files of the stages, empty for
+        resources the operator does not manage (e.g. artifacts)
+    """
+    resource_type = resource_type.lower()
+    for keyword, stages in RESOURCE_STAGES:
+        if keyword in resource_type:
+            return stages
+    return ()
+
+
+async def plan_sync(
+    client: Any, config_paths: Dict[str, Path], logger: Logger
+) -> SyncPlan:
+    """Decide which stages and projects the current run reconciles.
+
+    A full run is planned without state of a previous run, once
+    FULL_SYNC_INTERVAL_SECONDS have passed since the last full run, or when
+    the shard members changed and projects moved between replicas.
+    Operations of the operator's own user are not considered changes.
+    Changed fragments of a configuration directory limit their stage to
+    their entries, if the entries have keys.
+
+    Args:
+        client: Harbor API client instance
+        config_paths: Configuration file paths by file name
+        logger: Logger instance
+
+    Returns:
+        SyncPlan: Plan of the run
+    """
+    now = datetime.now(timezone.utc)
+    state = load_state()
+    previous_fragments = (state or {}).get("fragments", {})
+    fragments = {
+        filename: fragment_states(filename, path, previous_fragments.get(filename, {}))
+        for filename, path in config_paths.items()
+        if path.is_dir()
+    }
+    fingerprints = {}
+    for filename, path in config_paths.items():
+        if filename in fragments:
+            fingerprints[filename] = directory_fingerprint(
+                {name: state["hash"] for name, state in fragments[filename].items()}
+            )
+        elif (fingerprint := file_fingerprint(path)) is not None:
+            fingerprints[filename] = fingerprint
+    inputs = {
+        filename: fingerprint
+        for filename in config_paths
+        if (fingerprint := input_fingerprint(filename)) is not None
+    }
+    plan = SyncPlan(
+        full=True,
+        cursor=now,
+        file_fingerprints=fingerprints,
+        input_fingerprints=inputs,
+        shard_members=shard_members(),
+        fragments=fragments,
+    )
+
+    full_interval = int(getenv("FULL_SYNC_INTERVAL_SECONDS", "21600"))
+    if not state or not state.get("last_full_sync"):
+        return plan
+    last_full_sync = datetime.fromisoformat(state["last_full_sync"])
+    if (now - last_full_sync).total_seconds() >= full_interval:
+        logger.info("Full synchronization interval reached")
+        return plan
+    if state.get("shard_members", []) != plan.shard_members:
+        logger.info("Shard members changed, synchronizing all projects")
+        return plan
+    plan.full = False
+
+    # Stages whose configuration changed, limited to the entries of changed
+    # fragments if possible
+    previous_files = state.get("files", {})
+    for filename, fingerprint in fingerprints.items():
+        if previous_files.get(filename) == fingerprint:
+            continue
+        keys = None
+        if filename in fragments and filename in previous_fragments:
+            keys = changed_entries(previous_fragments[filename], fragments[filename])
+        if keys is None:
+            plan.full_stages.add(filename)
+        elif filename in PROJECT_STAGES:
+            plan.stage_projects.setdefault(filename, set()).update(keys)
+        else:
+            plan.stage_entries.setdefault(filename, set()).update(keys)
+
+    # Stages whose environment inputs changed, e.g. a new webhook receiver URL
+    previous_inputs = state.get("inputs", {})
+    for filename, fingerprint in inputs.items():
+        if previous_inputs.get(filename) != fingerprint:
+            plan.full_stages.add(filename)
+
+    # Stages with out-of-band changes according to the audit log
+    start = datetime.fromisoformat(state["cursor"]) - CURSOR_OVERLAP
+    own_user = getenv("ADMIN_USERNAME", "admin")
+    query = (
+        f"op_time=[{start.strftime(AUDIT_LOG_TIME_FORMAT)}"
+        f"~{now.strftime(AUDIT_LOG_TIME_FORMAT)}]"
+    )
+    change_count = 0
+    async for entry in iter_records(
+        client, AuditLogRecord, "/audit-logs", {"q": query}
+    ):
+        if entry.username == own_user:
+            continue
+        for stage in stages_for_resource(entry.resource_type or ""):
+            change_count += 1
+            project_name = (entry.resource or "").split("/", 1)[0]
+            if stage in PROJECT_STAGES and project_name:
+                plan.stage_projects.setdefault(stage, set()).add(project_name)
+            else:
+                plan.full_stages.add(stage)
+
+    logger.info(
+        "Planned incremental synchronization",
+        extra={
+            "changes": change_count,
+            "full_stages": sorted(plan.full_stages),
+            "project_stages": {
+                stage: sorted(projects)
+                for stage, projects in plan.stage_projects.items()
+            },
+            "entry_stages": {
+                stage: sorted(keys) for stage, keys in plan.stage_entries.items()
+            },
+        },
+    )
+    return plan
+
+
+@contextmanager
+def project_scope(projects: Optional[Set[str]]) -> Iterator[None]:
+    """Limit the stages run inside the context to some projects.
+
+    Args:
+        projects: Names of the projects, None for all projects
+    """
+    token = _project_scope.set(projects)
+    try:
+        yield
+    finally:
+        _project_scope.reset(token)
+
+
+@contextmanager
+def entry_scope(keys: Optional[Set[str]]) -> Iterator[None]:
+    """Limit the stage run inside the context to some entries.
+
+    Args:
+        keys: Keys of the entries, see ENTRY_KEYS, None for all entries
+    """
+    token = _entry_scope.set(keys)
+    try:
+        yield
+    finally:
+        _entry_scope.reset(token)
+
+
+def handles_entry(key: str) -> bool:
+    """Check whether the running stage reconciles an entry.
+
+    Args:
+        key: Key of the entry, see ENTRY_KEYS
+
+    Returns:
+        bool: True if the entry is in the entry scope of the run
+    """
+    keys = _entry_scope.get()
+    return keys is None or key in keys
+
+
+def handles_project(project_name: str) -> bool:
+    """Check whether the running stage reconciles a project.
+
+    Args:
+        project_name: Name of the project
+
+    Returns:
+        bool: True if the project is assigned to this replica and in the
+        project scope of the run
+    """
+    projects = _project_scope.get()
+    return owns_project(project_name) and (projects is None or project_name in projects)
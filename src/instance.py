@@ -0,0 +1,78 @@
+"""Harbor instance context module.
+
+In fleet mode one process reconciles several Harbor instances concurrently.
+This module tracks the instance the current task works on, so settings that
+differ per instance are read from the instance's environment overrides and
+per instance state is kept apart.
+"""
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+_instance_name: ContextVar[Optional[str]] = ContextVar("instance_name", default=None)
+_instance_env: ContextVar[Dict[str, str]] = ContextVar("instance_env", default={})
+
+
+@contextmanager
+def instance_context(name: Optional[str], env: Dict[str, str]) -> Iterator[None]:
+    """Run the enclosed code on behalf of a Harbor instance.
+
+    Asyncio tasks started inside the context inherit it, concurrent tasks of
+    other instances are not affected.
+
+    Args:
+        name: Name of the instance, None outside of fleet mode
+        env: Environment variables overridden for the instance
+    """
+    name_token = _instance_name.set(name)
+    env_token = _instance_env.set(env)
+    try:
+        yield
+    finally:
+        _instance_env.reset(env_token)
+        _instance_name.reset(name_token)
+
+
+def instance_name() -> Optional[str]:
+    """Return the name of the current instance.
+
+    Returns:
+        Name of the instance, None outside of fleet mode
+    """
+    return _instance_name.get()
+
+
+def getenv(name: str, default: Optional[str] = None) -> Optional[str]:
+    """Return an environment variable of the current instance.
+
+    Args:
+        name: Name of the environment variable
+        default: Value returned if the variable is not set
+
+    Returns:
+        The instance override, else the process environment variable
+    """
+    env = _instance_env.get()
+    if name in env:
+        return env[name]
+    return os.environ.get(name, default)
+
+
+def require_env(name: str) -> str:
+    """Return a required environment variable of the current instance.
+
+    Args:
+        name: Name of the environment variable
+
+    Returns:
+        str: Value of the variable
+
+    Raises:
+        KeyError: If the variable is not set
+    """
+    value = getenv(name)
+    if value is None:
+        raise KeyError(name)
+    return value
@@ -0,0 +1,122 @@
+"""Harbor log summary module.
+
+With tens of thousands of items per run, a log line per item is a visible
+share of the run time. In summary mode the routine lines stages log for
+every item, whether or not it changes, are only counted, and each stage ends
+with one record of its counts by message, its duration and its errors. Lines
+about changes and errors are still logged, and at DEBUG level all lines are.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional
+
+LOG_SUMMARY = os.environ.get("LOG_SUMMARY", "").lower() in ["true", "1", "yes", "y"]
+
+# Extra fields naming the item a record is about
+ITEM_FIELDS = (
+    "project",
+    "project_id",
+    "robot",
+    "registry",
+    "replication",
+    "policy",
+    "member",
+)
+
+# Item messages logged for unchanged items or for every project synchronized,
+# changes and secrets being set are always logged
+ROUTINE_MESSAGES = {
+    "Project is up to date",
+    "Project member is up to date",
+    "Registry is up to date",
+    "Robot is up to date",
+    "Replication rule is up to date",
+    "Webhook policy is up to date",
+    "Synchronizing webhooks for project",
+    "Syncing project members",
+    "Retention policy is up to date",
+}
+
+
+@dataclass
+class StageSummary:
+    """Counts of the records logged by a stage."""
+
+    stage: str
+    started: float = field(default_factory=time.monotonic)
+    actions: Dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+
+
+_stage_summary: ContextVar[Optional[StageSummary]] = ContextVar(
+    "stage_summary", default=None
+)
+
+
+class SummaryFilter(logging.Filter):
+    """Counts the item records of the running stage and drops routine ones."""
+
+    def __init__(self, verbose: bool = False):
+        """Initialize the filter.
+
+        Args:
+            verbose: Whether routine item records are still logged
+        """
+        super().__init__()
+        self.verbose = verbose
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Count a record and decide whether it is logged.
+
+        Args:
+            record: Log record
+
+        Returns:
+            bool: False for routine item records of a stage, unless verbose
+        """
+        summary = _stage_summary.get()
+        if summary is None:
+            return True
+        if record.levelno >= logging.ERROR:
+            summary.errors += 1
+            return True
+        if not any(hasattr(record, name) for name in ITEM_FIELDS):
+            return True
+        message = str(record.msg)
+        summary.actions[message] = summary.actions.get(message, 0) + 1
+        return self.verbose or message not in ROUTINE_MESSAGES
+
+
+@contextmanager
+def stage_summary(stage: str, logger: logging.Logger) -> Iterator[None]:
+    """Log one summary record for the stage run inside the context.
+
+    Does nothing unless LOG_SUMMARY is enabled.
+
+    Args:
+        stage: Name of the stage
+        logger: Logger instance
+    """
+    if not LOG_SUMMARY:
+        yield
+        return
+    summary = StageSummary(stage)
+    token = _stage_summary.set(summary)
+    try:
+        yield
+    finally:
+        _stage_summary.reset(token)
+        logger.info(
+            "Stage summary",
+            extra={
+                "stage": stage,
+                "seconds": round(time.monotonic() - summary.started, 3),
+                "actions": summary.actions,
+                "errors": summary.errors,
+            },
+        )
@@ -0,0 +1,93 @@
+"""Harbor operator metrics module.
+
+This module collects gauges during a synchronization run and writes them in
+the Prometheus text exposition format, e.g. for the node exporter textfile
+collector.
+"""
+
+import os
+from logging import Logger
+from pathlib import Path
+from typing import Dict, Tuple
+
+from instance import instance_name
+
+# Environment variables for metrics export
+METRICS_FILE_PATH = os.environ.get("METRICS_FILE_PATH")
+
+METRIC_PREFIX = "harbor_operator_"
+
+_gauges: Dict[str, Tuple[str, Dict[Tuple[Tuple[str, str], ...], float]]] = {}
+
+
+def set_gauge(name: str, value: float, description: str, **labels: str) -> None:
+    """Set the value of a gauge for the given labels.
+
+    In fleet mode the name of the current instance is added as ``instance``
+    label.
+
+    Args:
+        name: Metric name without the operator prefix
+        value: Metric value
+        description: Help text of the metric
+        labels: Metric labels
+    """
+    if instance_name() is not None:
+        labels = {"instance": instance_name(), **labels}
+    _, samples = _gauges.setdefault(METRIC_PREFIX + name, (description, {}))
+    samples[tuple(sorted((key, str(val)) for key, val in labels.items()))] = value
+
+
+def escape_label_value(value: str) -> str:
+    """Escape a label value for the Prometheus text format.
+
+    Args:
+        value: Label value
+
+    Returns:
+        str: Escaped label value
+    """
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_metrics() -> str:
+    """Render all collected gauges in the Prometheus text exposition format.
+
+    Returns:
+        str: Rendered metrics
+    """
+    lines = []
+    for name, (description, samples) in sorted(_gauges.items()):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(samples.items()):
+            label_string = ",".join(
+                f'{key}="{escape_label_value(val)}"' for key, val in labels
+            )
+            lines.append(
+                f"{name}{{{label_string}}} {value}" if labels else f"{name} {value}"
+            )
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def write_metrics(logger: Logger) -> None:
+    """Write the collected gauges to METRICS_FILE_PATH if it is set.
+
+    The file is replaced atomically so collectors never read a partial file.
+
+    Args:
+        logger: Logger instance for recording operations
+    """
+    if not METRICS_FILE_PATH or not _gauges:
+        return
+
+    path = Path(METRICS_FILE_PATH)
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        tmp_path.write_text(render_metrics())
+        os.replace(tmp_path, path)
+        logger.info("Metrics written", extra={"path": str(path)})
+    except OSError as e:
+        logger.error(
+            "Failed to write metrics", extra={"path": str(path), "error": str(e)}
+        )
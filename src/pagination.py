@@ -0,0 +1,359 @@
+"""Harbor listing pagination module.
+
+This module streams Harbor list endpoints page by page and diffs the streamed
+objects against the desired configuration, so memory stays proportional to
+the page size plus the desired configuration instead of the number of
+objects in Harbor.
+"""
+
+import asyncio
+import math
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
+
+from harborapi.exceptions import check_response_status
+from harborapi.retry import retry
+from harborapi.utils import get_project_headers, handle_json_response
+
+# Largest page size accepted by the Harbor API
+DEFAULT_PAGE_SIZE = 100
+# Maximum number of pages of a single listing fetched at the same time
+PAGE_CONCURRENCY = int(os.environ.get("PAGE_CONCURRENCY", "8"))
+
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+
+
+@dataclass
+class ListingDiff:
+    """Harbor objects of a listing split by their desired state.
+
+    ``matched`` holds the objects that are also desired, ``unlisted`` the
+    objects missing in the desired set and ``missing`` the desired keys
+    without a Harbor object.
+    """
+
+    matched: Dict[Any, Any] = field(default_factory=dict)
+    unlisted: Dict[Any, Any] = field(default_factory=dict)
+    missing: List[Any] = field(default_factory=list)
+
+
+@retry()
+async def fetch_page(
+    client: Any,
+    path: str,
+    params: Optional[Dict[str, Any]],
+    headers: Optional[Dict[str, Any]],
+    page: int,
+    page_size: int,
+) -> Tuple[List[Any], Optional[int]]:
+    """Fetch a single page of a Harbor list endpoint.
+
+    Args:
+        client: Harbor API client instance
+        path: Path of the list endpoint
+        params: Additional query parameters
+        headers: Additional request headers
+        page: Page number, starting at 1
+        page_size: Number of objects per page
+
+    Returns:
+        Tuple of the page objects and the ``X-Total-Count`` header, if sent
+    """
+    resp = await client.client.get(
+        client.url + path,
+        params={**(params or {}), "page": page, "page_size": page_size},
+        headers=client._get_headers(headers),
+    )
+    client.log_response(resp)
+    check_response_status(resp)
+    total_count = resp.headers.get("x-total-count")
+    return (
+        handle_json_response(resp) or [],
+        int(total_count) if total_count is not None else None,
+    )
+
+
+async def iter_pages(
+    client: Any,
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, Any]] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    concurrency: int = PAGE_CONCURRENCY,
+) -> AsyncIterator[List[Any]]:
+    """Stream the raw JSON pages of a Harbor list endpoint.
+
+    The first page tells the total number of objects via ``X-Total-Count``.
+    The remaining pages are then fetched concurrently, with at most
+    ``concurrency`` requests in flight, and yielded in order. Without the
+    header, pages are fetched one after another until a short page.
+
+    Args:
+        client: Harbor API client instance
+        path: Path of the list endpoint, e.g. ``/projects``
+        params: Additional query parameters
+        headers: Additional request headers
+        page_size: Number of objects per page
+        concurrency: Maximum number of pages fetched at the same time
+
+    Yields:
+        List[Any]: Objects of one page
+    """
+    items, total_count = await fetch_page(client, path, params, headers, 1, page_size)
+    if not items:
+        return
+    yield items
+
+    if total_count is None:
+        page = 2
+        while len(items) == page_size:
+            items, _ = await fetch_page(client, path, params, headers, page, page_size)
+            if not items:
+                return
+            yield items
+            page += 1
+        return
+
+    pages = iter(range(2, math.ceil(total_count / page_size) + 1))
+    in_flight: Deque[asyncio.Task] = deque()
+
+    def schedule_next_page() -> None:
+        page = next(pages, None)
+        if page is not None:
+            in_flight.append(
+                asyncio.create_task(
+                    fetch_page(client, path, params, headers, page, page_size)
+                )
+            )
+
+    try:
+        for _ in range(max(concurrency, 1)):
+            schedule_next_page()
+        while in_flight:
+            items, _ = await in_flight.popleft()
+            schedule_next_page()
+            if items:
+                yield items
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+async def iter_models(
+    client: Any,
+    model: Type[Any],
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, Any]] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> AsyncIterator[Any]:
+    """Stream the objects of a Harbor list endpoint as models.
+
+    Only the models of the current page are kept in memory.
+
+    Args:
+        client: Harbor API client instance
+        model: harborapi model class of the listed objects
+        path: Path of the list endpoint
+        params: Additional query parameters
+        headers: Additional request headers
+        page_size: Number of objects per page
+
+    Yields:
+        Any: One model per listed object
+    """
+    async for items in iter_pages(client, path, params, headers, page_size):
+        for item in client.construct_model(model, items, is_list=True):
+            yield item
+
+
+async def iter_records(
+    client: Any,
+    record: Type[Any],
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, Any]] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> AsyncIterator[Any]:
+    """Stream the objects of a Harbor list endpoint as compact records.
+
+    Unlike ``iter_models``, the objects are not validated into harborapi
+    models. Only the fields of the record are kept, missing fields are None
+    and nested objects stay plain JSON. This saves memory and CPU for large
+    listings of which a stage only needs the names and ids.
+
+    Args:
+        client: Harbor API client instance
+        record: ``NamedTuple`` class with the JSON field names to keep
+        path: Path of the list endpoint
+        params: Additional query parameters
+        headers: Additional request headers
+        page_size: Number of objects per page
+
+    Yields:
+        Any: One record per listed object
+    """
+    fields = record._fields
+    async for items in iter_pages(client, path, params, headers, page_size):
+        for item in items:
+            yield record._make(map(item.get, fields))
+
+
+async def list_records(
+    client: Any,
+    record: Type[Any],
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, Any]] = None,
+) -> List[Any]:
+    """List all objects of a Harbor list endpoint as compact records.
+
+    Args:
+        client: Harbor API client instance
+        record: ``NamedTuple`` class with the JSON field names to keep
+        path: Path of the list endpoint
+        params: Additional query parameters
+        headers: Additional request headers
+
+    Returns:
+        List[Any]: All listed objects, see ``iter_records``
+    """
+    return [item async for item in iter_records(client, record, path, params, headers)]
+
+
+async def list_models(
+    client: Any,
+    model: Type[Any],
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, Any]] = None,
+) -> List[Any]:
+    """List all objects of a Harbor list endpoint as models.
+
+    Args:
+        client: Harbor API client instance
+        model: harborapi model class of the listed objects
+        path: Path of the list endpoint
+        params: Additional query parameters
+        headers: Additional request headers
+
+    Returns:
+        List[Any]: All listed objects
+    """
+    return [item async for item in iter_models(client, model, path, params, headers)]
+
+
+async def count_objects(
+    client: Any,
+    path: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, Any]] = None,
+) -> int:
+    """Count the objects of a Harbor list endpoint with a single request.
+
+    Args:
+        client: Harbor API client instance
+        path: Path of the list endpoint
+        params: Additional query parameters
+        headers: Additional request headers
+
+    Returns:
+        int: Number of objects, at least 1 if the endpoint does not send
+        ``X-Total-Count`` but lists any object
+    """
+    items, total_count = await fetch_page(client, path, params, headers, 1, 1)
+    return total_count if total_count is not None else len(items)
+
+
+def project_path(project_name: str, resource: str) -> Tuple[str, Dict[str, str]]:
+    """Build the path and headers of a project scoped list endpoint.
+
+    Args:
+        project_name: Name of the project
+        resource: Resource path below the project, e.g. ``members``
+
+    Returns:
+        Tuple of path and headers
+    """
+    return (
+        f"/projects/{project_name}/{resource}",
+        get_project_headers(project_name),
+    )
+
+
+async def stream_diff(
+    current_items: AsyncIterator[Any],
+    desired: Dict[str, Any],
+    key: Callable[[Any], str],
+) -> AsyncIterator[Tuple[str, str, Optional[Any], Optional[Any]]]:
+    """Diff streamed Harbor objects against the desired objects keyed by name.
+
+    Objects present in Harbor and in the desired set are reported for update,
+    objects only present in Harbor for deletion, desired objects missing in
+    Harbor for creation once the listing is exhausted. If several Harbor
+    objects map to the same desired key, only the first one is reported.
+
+    Args:
+        current_items: Stream of Harbor objects
+        desired: Map of keys to desired objects
+        key: Function returning the key of a Harbor object
+
+    Yields:
+        Tuple of action, key, current object and desired object
+    """
+    seen = set()
+    async for item in current_items:
+        name = key(item)
+        if name not in desired:
+            yield DELETE, name, item, None
+        elif name not in seen:
+            seen.add(name)
+            yield UPDATE, name, item, desired[name]
+
+    for name, target in desired.items():
+        if name not in seen:
+            yield CREATE, name, None, target
+
+
+async def collect_diff(
+    current_items: AsyncIterator[Any],
+    desired: Dict[str, Any],
+    key: Callable[[Any], str],
+) -> ListingDiff:
+    """Diff a streamed listing and keep only the objects that need changes.
+
+    Unlisted objects are collected instead of being deleted right away, as
+    deleting while paginating would shift later objects onto pages that
+    were already read.
+
+    Args:
+        current_items: Stream of Harbor objects
+        desired: Map of keys to desired objects
+        key: Function returning the key of a Harbor object
+
+    Returns:
+        ListingDiff: Matched, unlisted and missing objects
+    """
+    diff = ListingDiff()
+    async for action, name, current, _ in stream_diff(current_items, desired, key):
+        if action == UPDATE:
+            diff.matched[name] = current
+        elif action == DELETE:
+            diff.unlisted.setdefault(name, current)
+        else:
+            diff.missing.append(name)
+    return diff
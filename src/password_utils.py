@@ -1,22 +1,16 @@
-import os
 from logging import Logger
 
 from harborapi import HarborAsyncClient
 from harborapi.exceptions import Unauthorized
 
-
-# Environment variables for Harbor configuration
-ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "admin")
-OLD_ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD_OLD")
-NEW_ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD_NEW")
-API_URL = os.environ.get("HARBOR_API_URL")
+from instance import getenv
 
 
 async def update_password(client: HarborAsyncClient, logger: Logger) -> None:
     """Update the Harbor admin password.
 
-    This function attempts to update the admin password from OLD_ADMIN_PASSWORD
-    to NEW_ADMIN_PASSWORD using the provided client.
+    This function attempts to update the admin password from ADMIN_PASSWORD_OLD
+    to ADMIN_PASSWORD_NEW of the current instance.
 
     Args:
         client: Harbor API client instance
@@ -29,11 +23,13 @@ async def update_password(client: HarborAsyncClient, logger: Logger) -> None:
     try:
         logger.info("Starting admin password update")
 
+        old_password = getenv("ADMIN_PASSWORD_OLD")
+
         # Create client with old password
         old_password_client = HarborAsyncClient(
-            url=API_URL,
-            username=ADMIN_USERNAME,
-            secret=OLD_ADMIN_PASSWORD,
+            url=getenv("HARBOR_API_URL"),
+            username=getenv("ADMIN_USERNAME", "admin"),
+            secret=old_password,
             timeout=10,
             verify=False,
         )
@@ -49,8 +45,8 @@ async def update_password(client: HarborAsyncClient, logger: Logger) -> None:
         try:
             await old_password_client.set_user_password(
                 user_id=admin.user_id,
-                old_password=OLD_ADMIN_PASSWORD,
-                new_password=NEW_ADMIN_PASSWORD,
+                old_password=old_password,
+                new_password=getenv("ADMIN_PASSWORD_NEW"),
             )
             logger.info("Admin password updated successfully")
         except Exception as e:
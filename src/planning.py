@@ -0,0 +1,412 @@
+"""Harbor plan module.
+
+A plan runs the read and diff logic of every stage without changing Harbor.
+The transport of the Harbor client is replaced by a recorder, which answers
+reads from a cache shared by all stages and records every write as a change
+instead of sending it. The resulting change set can be applied later as it
+is, without reading Harbor again.
+"""
+
+import asyncio
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging import Logger
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from harborapi.exceptions import check_response_status
+
+from apply import apply_operations, current_operation
+
+PLAN_VERSION = 1
+# Resources created by a plan get placeholder IDs far above Harbor's IDs
+PLACEHOLDER_ID_BASE = 10**12
+# Request headers that change the meaning of a recorded write
+REPLAYED_HEADERS = ("x-is-resource-name", "x-resource-name-in-location")
+ACTIONS = {"POST": "create", "PUT": "update", "PATCH": "update", "DELETE": "delete"}
+
+_planning: ContextVar[bool] = ContextVar("planning", default=False)
+
+
+@contextmanager
+def planning_context() -> Iterator[None]:
+    """Mark the enclosed code as planning, so stages keep no local state."""
+    token = _planning.set(True)
+    try:
+        yield
+    finally:
+        _planning.reset(token)
+
+
+def planning() -> bool:
+    """Check whether the current code runs as part of a plan.
+
+    Returns:
+        bool: True while a plan is computed
+    """
+    return _planning.get()
+
+
+def normalize(value: Any) -> Any:
+    """Normalize a value for comparison.
+
+    Harbor returns some flags, e.g. project metadata, as ``"true"`` strings.
+
+    Args:
+        value: Value from Harbor or a request body
+
+    Returns:
+        The value with booleans as strings
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return [normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    return value
+
+
+def field_diff(
+    current: Dict[str, Any], desired: Dict[str, Any], prefix: str = ""
+) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """Compare the fields of an update with the resource read from Harbor.
+
+    Args:
+        current: Resource as read from Harbor
+        desired: Body of the update
+        prefix: Prefix of the field names, for nested objects
+
+    Returns:
+        Tuple of the changed fields with their old and new value, and the
+        fields Harbor did not return and that could not be compared
+    """
+    diff: Dict[str, Dict[str, Any]] = {}
+    uncompared: List[str] = []
+    for key, value in desired.items():
+        name = f"{prefix}{key}"
+        if key not in current:
+            if value is not None:
+                uncompared.append(name)
+            continue
+        old = current[key]
+        if isinstance(old, dict) and "editable" in old and not isinstance(value, dict):
+            # Configuration settings are returned with their metadata
+            old = old.get("value")
+        if isinstance(old, dict) and isinstance(value, dict):
+            nested_diff, nested_uncompared = field_diff(old, value, f"{name}.")
+            diff.update(nested_diff)
+            uncompared.extend(nested_uncompared)
+        elif normalize(old) != normalize(value):
+            diff[name] = {"from": old, "to": value}
+    return diff, uncompared
+
+
+class PlanRecorder(httpx.AsyncBaseTransport):
+    """HTTP transport that caches reads and records writes instead of sending them."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, api_url: str):
+        """Initialize the recorder.
+
+        Args:
+            transport: Transport sending the reads to Harbor
+            api_url: Harbor API URL, recorded paths are relative to it
+        """
+        self.transport = transport
+        self.base_path = urlparse(api_url).path.rstrip("/")
+        self.stage: Optional[str] = None
+        self.changes: List[Dict[str, Any]] = []
+        self.errors: List[Dict[str, str]] = []
+        self.reads = 0
+        self.cached_reads = 0
+        self.unchanged = 0
+        self._created = 0
+        self._responses: Dict[Tuple[str, ...], asyncio.Future] = {}
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._items: Dict[str, List[Dict[str, Any]]] = {}
+
+    def _path(self, url: httpx.URL) -> str:
+        """Return the path of a URL relative to the Harbor API URL."""
+        return url.path.removeprefix(self.base_path)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        """Answer a read from the cache or Harbor, record a write.
+
+        Args:
+            request: Request of the Harbor client
+
+        Returns:
+            httpx.Response: Harbor's response to a read, a made-up success
+            response to a write
+        """
+        if request.method == "GET":
+            return await self._read(request)
+        return self._record(request)
+
+    async def _read(self, request: httpx.Request) -> httpx.Response:
+        """Answer a read, sending it to Harbor only once per plan."""
+        key = (str(request.url),) + tuple(
+            request.headers.get(name, "") for name in REPLAYED_HEADERS
+        )
+        future = self._responses.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._responses[key] = future
+            try:
+                response = await self.transport.handle_async_request(request)
+                content = await response.aread()
+                await response.aclose()
+            except Exception as e:
+                del self._responses[key]
+                future.set_exception(e)
+                future.exception()  # Retrieved, reads waiting for it fail too
+                raise
+            self.reads += 1
+            headers = [
+                (name, value)
+                for name, value in response.headers.items()
+                if name.lower() not in ("content-encoding", "content-length")
+            ]
+            if response.status_code == 200:
+                self._remember(self._path(request.url), content)
+            future.set_result((response.status_code, headers, content))
+        else:
+            self.cached_reads += 1
+        status_code, headers, content = await asyncio.shield(future)
+        return httpx.Response(
+            status_code, headers=headers, content=content, request=request
+        )
+
+    def _remember(self, path: str, content: bytes) -> None:
+        """Keep a read resource to compare later updates and deletes with."""
+        try:
+            data = json.loads(content)
+        except ValueError:
+            return
+        if isinstance(data, list):
+            self._items.setdefault(path, []).extend(
+                item for item in data if isinstance(item, dict)
+            )
+        elif isinstance(data, dict):
+            self._objects[path] = data
+
+    def _current(self, path: str) -> Optional[Dict[str, Any]]:
+        """Return a resource as read from Harbor.
+
+        Args:
+            path: Path of the resource
+
+        Returns:
+            The resource read from the path itself or found by ID or name in
+            the list read from its parent path, None if it was not read
+        """
+        if path in self._objects:
+            return self._objects[path]
+        parent, _, name = path.rpartition("/")
+        for item in self._items.get(parent, []):
+            if name in (
+                str(item.get("id")),
+                str(item.get("project_id")),
+                str(item.get("name")),
+            ):
+                return item
+        return None
+
+    def _record(self, request: httpx.Request) -> httpx.Response:
+        """Record a write as a change and answer it like Harbor would."""
+        path = self._path(request.url)
+        body = json.loads(request.content) if request.content else None
+        change: Dict[str, Any] = {
+            "stage": self.stage,
+            "action": ACTIONS.get(request.method, request.method.lower()),
+            "method": request.method,
+            "path": path,
+        }
+        if request.url.params:
+            change["params"] = dict(request.url.params)
+        headers = {
+            name: request.headers[name]
+            for name in REPLAYED_HEADERS
+            if name in request.headers
+        }
+        if headers:
+            change["headers"] = headers
+        operation = current_operation()
+        if operation:
+            change["batch"], change["key"] = operation
+
+        current = self._current(path)
+        response_headers = {}
+        response_body = None
+        if request.method == "POST":
+            created_id = PLACEHOLDER_ID_BASE + self._created
+            self._created += 1
+            change["created_id"] = created_id
+            name = (
+                body.get("project_name") if isinstance(body, dict) else None
+            ) or created_id
+            response_headers["Location"] = f"{request.url.path}/{name}"
+            response_body = {
+                **(body if isinstance(body, dict) else {}),
+                "id": created_id,
+            }
+        elif change["action"] == "update" and current and isinstance(body, dict):
+            diff, uncompared = field_diff(current, body)
+            # The name a resource is addressed by is not repeated by Harbor
+            uncompared = [
+                name for name in uncompared if body.get(name) != path.rsplit("/")[-1]
+            ]
+            if not diff and not uncompared:
+                self.unchanged += 1
+                return httpx.Response(200, request=request)
+            change["diff"] = diff
+            if uncompared:
+                change["uncompared"] = uncompared
+        elif change["action"] == "delete":
+            change["current"] = current
+        change["body"] = body
+        self.changes.append(change)
+        return httpx.Response(
+            201 if request.method == "POST" else 200,
+            headers=response_headers,
+            json=response_body,
+            request=request,
+        )
+
+    def change_set(self, api_url: str) -> Dict[str, Any]:
+        """Return the recorded change set.
+
+        Args:
+            api_url: URL of the Harbor instance the plan was computed against
+
+        Returns:
+            Dict[str, Any]: Change set with counts per stage and action
+        """
+        counts: Dict[str, Dict[str, int]] = {}
+        for change in self.changes:
+            stage_counts = counts.setdefault(
+                change["stage"], {"create": 0, "update": 0, "delete": 0}
+            )
+            stage_counts[change["action"]] = stage_counts.get(change["action"], 0) + 1
+        return {
+            "version": PLAN_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "source": api_url,
+            "reads": self.reads,
+            "cached_reads": self.cached_reads,
+            "unchanged": self.unchanged,
+            "counts": counts,
+            "changes": self.changes,
+            "errors": self.errors,
+        }
+
+
+def substitute_ids(value: Any, created_ids: Dict[int, Any]) -> Any:
+    """Replace the placeholder IDs of created resources in a request body.
+
+    Args:
+        value: Request body or part of it
+        created_ids: IDs Harbor assigned by placeholder ID
+
+    Returns:
+        The value with the IDs Harbor assigned
+    """
+    if isinstance(value, int) and value in created_ids:
+        return created_ids[value]
+    if isinstance(value, list):
+        return [substitute_ids(item, created_ids) for item in value]
+    if isinstance(value, dict):
+        return {key: substitute_ids(item, created_ids) for key, item in value.items()}
+    return value
+
+
+def change_batches(
+    changes: List[Dict[str, Any]],
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Group the changes the way their stages applied them.
+
+    Changes recorded by one call of the apply engine form a batch, which can
+    run concurrently again. Other changes run one at a time.
+
+    Args:
+        changes: Changes of a change set, in recorded order
+
+    Yields:
+        Tuple of the stage and the changes of a batch
+    """
+    batch: List[Dict[str, Any]] = []
+    for change in changes:
+        if batch and (
+            change.get("batch") is None
+            or (change["stage"], change["batch"])
+            != (batch[0]["stage"], batch[0].get("batch"))
+        ):
+            yield batch[0]["stage"], batch
+            batch = []
+        batch.append(change)
+    if batch:
+        yield batch[0]["stage"], batch
+
+
+async def apply_change_set(
+    client: Any, change_set: Dict[str, Any], logger: Logger
+) -> None:
+    """Send the writes of a change set to Harbor.
+
+    Batches run in recorded order. Placeholder IDs of resources created by
+    earlier changes are replaced by the IDs Harbor assigned.
+
+    Args:
+        client: Harbor API client instance
+        change_set: Change set computed by a plan
+        logger: Logger instance
+
+    Raises:
+        ValueError: If the change set has an unsupported version
+        ApplyError: If a write failed, later batches are not applied
+    """
+    if change_set.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version: {change_set.get('version')}")
+    created_ids: Dict[int, Any] = {}
+
+    async def send(change: Dict[str, Any]) -> None:
+        path = "/".join(
+            str(created_ids.get(int(segment), segment))
+            if segment.isdigit()
+            else segment
+            for segment in change["path"].split("/")
+        )
+        resp = await client.client.request(
+            change["method"],
+            client.url + path,
+            params=change.get("params"),
+            json=substitute_ids(change.get("body"), created_ids),
+            headers=client._get_headers(change.get("headers")),
+        )
+        client.log_response(resp)
+        check_response_status(resp)
+        if "created_id" in change:
+            location = resp.headers.get("location", "")
+            created = location.rstrip("/").rsplit("/", 1)[-1]
+            if not created and resp.content:
+                created = resp.json().get("id")
+            created_ids[change["created_id"]] = (
+                int(created) if str(created).isdigit() else created
+            )
+
+    logger.info(
+        "Applying plan",
+        extra={"changes": len(change_set["changes"]), "source": change_set["source"]},
+    )
+    for stage, batch in change_batches(change_set["changes"]):
+        await apply_operations(
+            f"plan-{stage.removesuffix('.json')}",
+            [
+                (change.get("key"), lambda change=change: send(change))
+                for change in batch
+            ],
+            logger,
+        )
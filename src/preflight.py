@@ -0,0 +1,382 @@
+"""Harbor configuration preflight module.
+
+All configuration files are loaded and checked before a synchronization sends
+its first request. An invalid file late in the stage order then no longer
+fails a run after the earlier stages were applied. Entries are validated
+against the harborapi models the stages build from them, and references
+between files, e.g. robot namespaces and ``{{ project:name }}`` templates,
+against the projects and registries the configuration declares.
+"""
+
+import asyncio
+import json
+from logging import Logger
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type
+
+from harborapi.models import (
+    Configurations,
+    ProjectReq,
+    Registry,
+    ReplicationPolicy,
+    RetentionPolicy,
+    Robot,
+    ScheduleObj,
+    WebhookPolicy,
+)
+from pydantic import BaseModel, ValidationError
+
+from project_members import GROUP_KEY_SUFFIX, ProjectRole
+from utils import TEMPLATE_PATTERN, read_config_text, replace_env_vars_in_obj
+from instance import getenv
+from project_selectors import PROJECT_NAME_KEY, PROJECTS_KEY, parse_selector
+
+# Environment variables a configuration file needs during its stage
+REQUIRED_ENV = {
+    "configurations.json": (
+        "OIDC_STATIC_CLIENT_TOKEN",
+        "OIDC_ENDPOINT",
+        "ROBOT_NAME_PREFIX",
+    ),
+}
+
+MEMBER_KEYS = {PROJECT_NAME_KEY, PROJECTS_KEY} | {
+    name
+    for role in ProjectRole
+    for name in (role.name.lower(), role.name.lower() + GROUP_KEY_SUFFIX)
+}
+WEBHOOK_KEYS = {PROJECT_NAME_KEY, PROJECTS_KEY, "policies"}
+SCHEDULE_KEYS = {"parameters", "schedule", "adaptive"}
+
+
+class PreflightError(Exception):
+    """Raised if configuration files are invalid."""
+
+    def __init__(self, errors: List[str]):
+        """Initialize the error.
+
+        Args:
+            errors: Descriptions of all invalid settings
+        """
+        self.errors = errors
+        super().__init__(f"{len(errors)} configuration errors: " + "; ".join(errors))
+
+
+def load_config_file(path: Path) -> Tuple[Any, List[Tuple[str, str]]]:
+    """Load a configuration file the way its stage does, without Harbor.
+
+    ID templates are replaced by 0, as the IDs are only known to Harbor.
+
+    Args:
+        path: Path of the configuration file or directory
+
+    Returns:
+        Tuple of the parsed content and the type and name of its ID templates
+
+    Raises:
+        json.JSONDecodeError: If the file is not valid JSON
+        ValueError: If an environment variable placeholder is not set, or a
+            fragment is no JSON array
+    """
+    content = read_config_text(str(path))
+    templates = TEMPLATE_PATTERN.findall(content)
+    data = json.loads(TEMPLATE_PATTERN.sub("0", content))
+    return replace_env_vars_in_obj(data), templates
+
+
+def model_errors(model: Type[BaseModel], entry: Any, location: str) -> List[str]:
+    """Validate an entry against a harborapi model.
+
+    Args:
+        model: Model the stage builds from the entry
+        entry: Configuration entry
+        location: Location of the entry, prefixed to the errors
+
+    Returns:
+        List[str]: Validation errors, also for fields the model does not know
+    """
+    if not isinstance(entry, dict):
+        return [f"{location}: expected an object"]
+    errors = [
+        f"{location}.{key}: unknown field"
+        for key in sorted(set(entry) - set(model.model_fields))
+    ]
+    try:
+        model.model_validate(entry)
+    except ValidationError as e:
+        errors.extend(
+            f"{location}.{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in e.errors()
+        )
+    return errors
+
+
+def check_entries(
+    data: Any,
+    location: str,
+    check_entry: Callable[[Dict[str, Any], str], List[str]],
+    name_key: Optional[str] = None,
+) -> List[str]:
+    """Validate the entries of a configuration file holding a list.
+
+    Args:
+        data: Content of the configuration file
+        location: Name of the configuration file
+        check_entry: Function validating a single entry
+        name_key: Field that must be set and unique, None for none
+
+    Returns:
+        List[str]: Validation errors
+    """
+    if not isinstance(data, list):
+        return [f"{location}: expected a list"]
+    errors: List[str] = []
+    names: Set[str] = set()
+    for index, entry in enumerate(data):
+        entry_location = f"{location}[{index}]"
+        if not isinstance(entry, dict):
+            errors.append(f"{entry_location}: expected an object")
+            continue
+        errors.extend(check_entry(entry, entry_location))
+        if name_key is None:
+            continue
+        name = entry.get(name_key)
+        if not name:
+            errors.append(f"{entry_location}.{name_key}: field required")
+        elif name in names:
+            errors.append(f"{entry_location}.{name_key}: duplicate {name!r}")
+        names.add(name)
+    return errors
+
+
+def check_project_target(entry: Dict[str, Any], location: str) -> List[str]:
+    """Validate that an entry targets a project or a project selector.
+
+    Args:
+        entry: Configuration entry
+        location: Location of the entry
+
+    Returns:
+        List[str]: Validation errors
+    """
+    if PROJECT_NAME_KEY in entry and PROJECTS_KEY in entry:
+        return [f"{location}: use either {PROJECT_NAME_KEY} or {PROJECTS_KEY}"]
+    if PROJECTS_KEY in entry:
+        try:
+            parse_selector(entry[PROJECTS_KEY])
+        except ValueError as e:
+            return [f"{location}.{PROJECTS_KEY}: {e}"]
+        return []
+    if not entry.get(PROJECT_NAME_KEY):
+        return [f"{location}: {PROJECT_NAME_KEY} or {PROJECTS_KEY} required"]
+    return []
+
+
+def check_member_entry(entry: Dict[str, Any], location: str) -> List[str]:
+    """Validate an entry of project-members.json."""
+    errors = check_project_target(entry, location)
+    for key in sorted(set(entry) - MEMBER_KEYS):
+        errors.append(f"{location}.{key}: unknown field")
+    for key in sorted(set(entry) & MEMBER_KEYS - {PROJECT_NAME_KEY, PROJECTS_KEY}):
+        value = entry[key]
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            errors.append(f"{location}.{key}: expected a list of names")
+    return errors
+
+
+def check_webhook_entry(entry: Dict[str, Any], location: str) -> List[str]:
+    """Validate an entry of webhooks.json."""
+    errors = check_project_target(entry, location)
+    for key in sorted(set(entry) - WEBHOOK_KEYS):
+        errors.append(f"{location}.{key}: unknown field")
+    errors.extend(
+        check_entries(
+            entry.get("policies", []),
+            f"{location}.policies",
+            lambda policy, policy_location: model_errors(
+                WebhookPolicy, policy, policy_location
+            ),
+            "name",
+        )
+    )
+    return errors
+
+
+def check_robot_entry(entry: Dict[str, Any], location: str) -> List[str]:
+    """Validate an entry of robots.json."""
+    errors = model_errors(Robot, entry, location)
+    if not entry.get("permissions"):
+        errors.append(f"{location}.permissions: at least one permission required")
+    return errors
+
+
+def check_retention_entry(entry: Dict[str, Any], location: str) -> List[str]:
+    """Validate an entry of retention-policies.json."""
+    errors = model_errors(RetentionPolicy, entry, location)
+    if (entry.get("scope") or {}).get("ref") is None:
+        errors.append(f"{location}.scope.ref: field required")
+    return errors
+
+
+def check_schedule(data: Any, location: str) -> List[str]:
+    """Validate a purge job or garbage collection schedule."""
+    if not isinstance(data, dict):
+        return [f"{location}: expected an object"]
+    errors = [
+        f"{location}.{key}: unknown field" for key in sorted(set(data) - SCHEDULE_KEYS)
+    ]
+    if "schedule" not in data:
+        errors.append(f"{location}.schedule: field required")
+    else:
+        errors.extend(
+            model_errors(ScheduleObj, data["schedule"], f"{location}.schedule")
+        )
+    return errors
+
+
+# Validation of each configuration file
+FILE_CHECKS: Dict[str, Callable[[Any, str], List[str]]] = {
+    "configurations.json": lambda data, location: model_errors(
+        Configurations, data, location
+    ),
+    "registries.json": lambda data, location: check_entries(
+        data,
+        location,
+        lambda entry, entry_location: model_errors(Registry, entry, entry_location),
+        "name",
+    ),
+    "projects.json": lambda data, location: check_entries(
+        data,
+        location,
+        lambda entry, entry_location: model_errors(ProjectReq, entry, entry_location),
+        PROJECT_NAME_KEY,
+    ),
+    "project-members.json": lambda data, location: check_entries(
+        data, location, check_member_entry
+    ),
+    "replications.json": lambda data, location: check_entries(
+        data,
+        location,
+        lambda entry, entry_location: model_errors(
+            ReplicationPolicy, entry, entry_location
+        ),
+        "name",
+    ),
+    "replication-monitor.json": lambda data, location: (
+        [] if isinstance(data, dict) else [f"{location}: expected an object"]
+    ),
+    "robots.json": lambda data, location: check_entries(
+        data, location, check_robot_entry, "name"
+    ),
+    "webhooks.json": lambda data, location: check_entries(
+        data, location, check_webhook_entry
+    ),
+    "purge-job-schedule.json": check_schedule,
+    "garbage-collection-schedule.json": check_schedule,
+    "retention-policies.json": lambda data, location: check_entries(
+        data, location, check_retention_entry
+    ),
+}
+
+
+def check_references(
+    files: Dict[str, Tuple[Any, List[Tuple[str, str]]]],
+) -> List[str]:
+    """Check references between configuration files.
+
+    Projects are only checked if projects.json exists, as projects missing
+    in it are removed from Harbor. The same holds for registries.
+
+    Args:
+        files: Parsed content and ID templates by configuration file
+
+    Returns:
+        List[str]: Errors for references to undeclared projects or registries
+    """
+    declared: Dict[str, Optional[Set[str]]] = {"project": None, "registry": None}
+    for kind, filename, name_key in (
+        ("project", "projects.json", PROJECT_NAME_KEY),
+        ("registry", "registries.json", "name"),
+    ):
+        if filename in files and isinstance(files[filename][0], list):
+            declared[kind] = {
+                entry.get(name_key)
+                for entry in files[filename][0]
+                if isinstance(entry, dict)
+            }
+
+    errors = []
+    for filename, (data, templates) in files.items():
+        for kind, name in dict.fromkeys(templates):
+            if declared[kind] is not None and name not in declared[kind]:
+                errors.append(f"{filename}: {{{{ {kind}:{name} }}}} is not declared")
+
+    projects = declared["project"]
+    if projects is None:
+        return errors
+    for filename in ("project-members.json", "webhooks.json"):
+        data = files.get(filename, (None, []))[0]
+        for index, entry in enumerate(data if isinstance(data, list) else []):
+            project_name = isinstance(entry, dict) and entry.get(PROJECT_NAME_KEY)
+            if project_name and project_name not in projects:
+                errors.append(
+                    f"{filename}[{index}].{PROJECT_NAME_KEY}: "
+                    f"project {project_name!r} is not declared"
+                )
+    robots = files.get("robots.json", (None, []))[0]
+    for index, robot in enumerate(robots if isinstance(robots, list) else []):
+        for permission in (isinstance(robot, dict) and robot.get("permissions")) or []:
+            namespace = isinstance(permission, dict) and permission.get("namespace")
+            if (
+                namespace
+                and namespace != "*"
+                and permission.get("kind") == "project"
+                and namespace not in projects
+            ):
+                errors.append(
+                    f"robots.json[{index}].permissions: "
+                    f"project {namespace!r} is not declared"
+                )
+    return errors
+
+
+async def validate_config_files(config_paths: Dict[str, Path], logger: Logger) -> None:
+    """Validate all configuration files before synchronizing any of them.
+
+    The files are loaded concurrently. Missing files are skipped, as their
+    stages are.
+
+    Args:
+        config_paths: Configuration file paths by file name
+        logger: Logger instance
+
+    Raises:
+        PreflightError: With all errors found, if any file is invalid
+    """
+    paths = {filename: path for filename, path in config_paths.items() if path.exists()}
+    results = await asyncio.gather(
+        *(asyncio.to_thread(load_config_file, path) for path in paths.values()),
+        return_exceptions=True,
+    )
+
+    errors: List[str] = []
+    files: Dict[str, Tuple[Any, List[Tuple[str, str]]]] = {}
+    for filename, result in zip(paths, results):
+        if isinstance(result, json.JSONDecodeError):
+            errors.append(f"{filename}: invalid JSON: {result}")
+        elif isinstance(result, Exception):
+            errors.append(f"{filename}: {result}")
+        else:
+            files[filename] = result
+            check = FILE_CHECKS.get(filename)
+            if check:
+                errors.extend(check(result[0], filename))
+        for name in REQUIRED_ENV.get(filename, ()):
+            if getenv(name) is None:
+                errors.append(f"{filename}: environment variable {name} is not set")
+    errors.extend(check_references(files))
+
+    if errors:
+        logger.error("Invalid configuration files", extra={"errors": errors})
+        raise PreflightError(errors)
+    logger.info("Validated configuration files", extra={"files": sorted(paths)})
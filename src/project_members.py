@@ -1,19 +1,22 @@
 """Harbor project members management module.
 
 This module handles the synchronization of Harbor project members,
-including role assignments and member management.
+including role assignments and member management for users and user groups.
 """
 
 import logging
 import json
 from enum import Enum
-from typing import Sequence
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 from harborapi.client import HarborAsyncClient
-from harborapi.models import ProjectMemberEntity
+from harborapi.models import ProjectMemberEntity, UserGroup
 from harborapi.exceptions import NotFound, HarborAPIException
 
-from .utils import load_json
+from utils import load_json
+from project_selectors import expand_project_entries
+from pagination import iter_records, list_models, project_path
+from reconciler import Reconciler
 
 
 class ProjectRole(Enum):
@@ -25,117 +28,285 @@ class ProjectRole(Enum):
     MAINTAINER = 4
 
 
-async def remove_unlisted_members(
+# Roles from the most to the least privileged, a member listed under several
+# roles of a project gets the most privileged one
+ROLE_PRECEDENCE = (
+    ProjectRole.ADMIN,
+    ProjectRole.MAINTAINER,
+    ProjectRole.DEVELOPER,
+    ProjectRole.GUEST,
+)
+
+USER_ENTITY_TYPE = "u"
+GROUP_ENTITY_TYPE = "g"
+GROUP_KEY_SUFFIX = "_groups"
+
+# Configuration keys listing the users and groups of a role
+ROLE_KEYS = {
+    role.name.lower() + suffix
+    for role in ProjectRole
+    for suffix in ("", GROUP_KEY_SUFFIX)
+}
+
+# Types of the user groups Harbor can create by name, by authentication mode.
+# LDAP groups are given by DN and imported by Harbor when assigned.
+GROUP_TYPES = {"http_auth": 2, "oidc_auth": 3}
+
+
+class MemberRecord(NamedTuple):
+    """Fields of a listed project member the synchronization needs."""
+
+    id: int
+    entity_name: str
+    entity_type: Optional[str]
+    role_id: int
+
+
+def member_key(member: Any) -> Tuple[str, str]:
+    """Build the key used to match current and target project members.
+
+    Users and groups live in separate namespaces in Harbor, so a user and a
+    group with the same name are distinct members.
+
+    Args:
+        member: Project member entity or record.
+
+    Returns:
+        Tuple of entity type and entity name.
+    """
+    return (member.entity_type or USER_ENTITY_TYPE, member.entity_name)
+
+
+async def load_user_groups(
+    client: HarborAsyncClient, logger: logging.Logger
+) -> Dict[str, UserGroup]:
+    """Fetch all Harbor user groups indexed by group name and LDAP group DN.
+
+    Args:
+        client: Harbor API client instance.
+        logger: Logger instance for output.
+
+    Returns:
+        Map of group names and LDAP group DNs to their user group.
+    """
+    user_groups = await list_models(client, UserGroup, "/usergroups")
+    logger.info("Fetched user groups", extra={"group_count": len(user_groups)})
+
+    group_map: Dict[str, UserGroup] = {}
+    for group in user_groups:
+        if group.ldap_group_dn:
+            group_map[group.ldap_group_dn] = group
+        if group.group_name:
+            group_map[group.group_name] = group
+    return group_map
+
+
+def is_ldap_group_dn(group_name: str) -> bool:
+    """Check whether a configured group is given by LDAP group DN.
+
+    Args:
+        group_name: Configured group name or DN.
+
+    Returns:
+        True if the group is an LDAP DN, e.g. ``cn=devs,ou=groups,dc=example``.
+    """
+    return "=" in group_name
+
+
+async def create_missing_groups(
     client: HarborAsyncClient,
-    project_name: str,
-    current_members: Sequence[ProjectMemberEntity],
-    target_members: Sequence[ProjectMemberEntity],
+    config: List[Dict[str, Any]],
+    group_map: Dict[str, UserGroup],
     logger: logging.Logger,
 ) -> None:
-    """Remove project members that are not in the target list.
+    """Create the configured user groups Harbor does not know yet.
+
+    OIDC and HTTP groups only exist in Harbor once one of their members
+    logged in. They are created by name, so they can be assigned before.
 
     Args:
         client: Harbor API client instance.
-        project_name: Name of the project.
-        current_members: List of current project members.
-        target_members: List of desired project members.
+        config: Project members configuration.
+        group_map: Map of group names and LDAP group DNs to their user group,
+            updated with the created groups.
         logger: Logger instance for output.
     """
-    target_usernames = {member.entity_name for member in target_members}
+    missing = sorted(
+        {
+            group_name
+            for project in config
+            for key, group_names in project.items()
+            if key in ROLE_KEYS and key.endswith(GROUP_KEY_SUFFIX)
+            for group_name in group_names
+            if group_name not in group_map and not is_ldap_group_dn(group_name)
+        }
+    )
+    if not missing:
+        return
 
-    for current_member in current_members:
-        if current_member.entity_name not in target_usernames:
-            logger.info(
-                "Removing member from project",
-                extra={"member": current_member.entity_name, "project": project_name},
-            )
-            try:
-                await client.remove_project_member(
-                    project_name_or_id=project_name,
-                    member_id=current_member.id,
+    auth_mode = getattr((await client.get_config()).auth_mode, "value", None)
+    group_type = GROUP_TYPES.get(auth_mode)
+    if group_type is None:
+        logger.warning(
+            "Groups not found and cannot be created in this authentication mode",
+            extra={"groups": missing, "auth_mode": auth_mode},
+        )
+        return
+
+    for group_name in missing:
+        logger.info("Creating user group", extra={"group": group_name})
+        await client.create_usergroup(
+            UserGroup(group_name=group_name, group_type=group_type)
+        )
+    group_map.update(await load_user_groups(client, logger))
+
+
+def build_target_members(
+    project: Dict[str, Any], group_map: Dict[str, UserGroup]
+) -> List[ProjectMemberEntity]:
+    """Build the desired member list of a project from its configuration.
+
+    Users are listed under the role name (e.g. ``developer``), groups under the
+    role name with a ``_groups`` suffix (e.g. ``developer_groups``). Groups are
+    given by group name or LDAP group DN and resolved to existing Harbor user
+    groups where possible. A member listed under several roles is only
+    assigned the most privileged one, see ROLE_PRECEDENCE.
+
+    Args:
+        project: Project members configuration entry.
+        group_map: Map of group names and LDAP group DNs to their user group.
+
+    Returns:
+        List of desired project members, one per member key.
+    """
+    target_members = []
+    for role in ROLE_PRECEDENCE:
+        role_members = project.get(role.name.lower(), [])
+        target_members.extend(
+            [
+                ProjectMemberEntity(
+                    entity_name=username,
+                    entity_type=USER_ENTITY_TYPE,
+                    role_id=role.value,
                 )
-            except HarborAPIException as e:
-                logger.error(
-                    "Failed to remove project member: %s",
-                    str(e),
-                    extra={
-                        "member": current_member.entity_name,
-                        "project": project_name,
-                    },
+                for username in role_members
+            ]
+        )
+
+        role_groups = project.get(role.name.lower() + GROUP_KEY_SUFFIX, [])
+        for group_name in role_groups:
+            group = group_map.get(group_name)
+            target_members.append(
+                ProjectMemberEntity(
+                    entity_name=group.group_name if group else group_name,
+                    entity_id=group.id if group else None,
+                    entity_type=GROUP_ENTITY_TYPE,
+                    role_id=role.value,
                 )
-                raise
+            )
 
+    # Roles are visited by precedence, so the first entry of a member wins
+    unique_members: Dict[Tuple[str, str], ProjectMemberEntity] = {}
+    for member in target_members:
+        unique_members.setdefault(member_key(member), member)
+    return list(unique_members.values())
 
-async def sync_member_roles(
-    client: HarborAsyncClient,
-    project_name: str,
-    current_members: Sequence[ProjectMemberEntity],
-    target_members: Sequence[ProjectMemberEntity],
-    logger: logging.Logger,
-) -> None:
-    """Synchronize project member roles and add new members.
+
+def merge_project_entries(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge the member lists of all entries targeting the same project.
+
+    Args:
+        entries: Project members configuration entries of a single project
+
+    Returns:
+        Project members configuration with the member lists of all entries
+    """
+    merged: Dict[str, List[str]] = {}
+    for entry in entries:
+        for key, members in entry.items():
+            if key not in ROLE_KEYS:
+                continue
+            role_members = merged.setdefault(key, [])
+            role_members.extend(m for m in members if m not in role_members)
+    return merged
+
+
+def member_reconciler(
+    client: HarborAsyncClient, project_name: str, logger: logging.Logger
+) -> Reconciler:
+    """Build the reconciler of the members of a project.
+
+    Members are matched by ``member_key`` and only written if they are missing
+    or their role differs. Groups are added by ID, or by DN for LDAP groups.
+    Users and groups Harbor does not know yet are skipped with a warning.
 
     Args:
         client: Harbor API client instance.
         project_name: Name of the project.
-        current_members: List of current project members.
-        target_members: List of desired project members.
         logger: Logger instance for output.
+
+    Returns:
+        Reconciler of the project members.
     """
-    for target_member in target_members:
-        existing_member_id = next(
-            (
-                existing.id
-                for existing in current_members
-                if existing.entity_name == target_member.entity_name
-            ),
-            None,
+
+    def warn_not_found(target_member: ProjectMemberEntity) -> None:
+        is_group = target_member.entity_type == GROUP_ENTITY_TYPE
+        logger.warning(
+            "Group not found - skipping" if is_group else "User not found - skipping",
+            extra={
+                "member": target_member.entity_name,
+                "hint": "Make sure a group member has logged in at least once"
+                if is_group
+                else "Make sure user has logged in at least once",
+            },
         )
 
+    async def add_member(target_member: ProjectMemberEntity) -> None:
         try:
-            if existing_member_id:  # Update existing member
-                logger.info(
-                    "Updating project role for member",
-                    extra={
-                        "member": target_member.entity_name,
-                        "project": project_name,
-                        "role": target_member.role_id,
-                    },
-                )
-                await client.update_project_member_role(
+            if target_member.entity_type != GROUP_ENTITY_TYPE:
+                await client.add_project_member_user(
                     project_name_or_id=project_name,
-                    member_id=existing_member_id,
-                    role=target_member.role_id,
+                    username_or_id=target_member.entity_name,
+                    role_id=target_member.role_id,
                 )
-            else:  # Add new member
-                logger.info(
-                    "Adding new member to project",
-                    extra={
-                        "member": target_member.entity_name,
-                        "project": project_name,
-                        "role": target_member.role_id,
-                    },
+            elif target_member.entity_id is not None:
+                await client.add_project_member_group(
+                    project_name_or_id=project_name,
+                    ldap_group_dn_or_id=target_member.entity_id,
+                    role_id=target_member.role_id,
                 )
-                await client.add_project_member_user(
+            elif is_ldap_group_dn(target_member.entity_name):
+                await client.add_project_member_group(
                     project_name_or_id=project_name,
-                    username_or_id=target_member.entity_name,
+                    ldap_group_dn_or_id=target_member.entity_name,
                     role_id=target_member.role_id,
                 )
+            else:
+                warn_not_found(target_member)
         except NotFound:
-            logger.warning(
-                "User not found - skipping",
-                extra={
-                    "member": target_member.entity_name,
-                    "hint": "Make sure user has logged in at least once",
-                },
-            )
-        except HarborAPIException as e:
-            logger.error(
-                "Failed to manage project member: %s",
-                str(e),
-                extra={"member": target_member.entity_name, "project": project_name},
-            )
-            raise
+            warn_not_found(target_member)
+
+    path, headers = project_path(project_name, "members")
+    return Reconciler(
+        stage="project-members",
+        resource="project member",
+        log_field="member",
+        list_current=lambda: iter_records(client, MemberRecord, path, headers=headers),
+        key=member_key,
+        desired_key=member_key,
+        create=add_member,
+        update=lambda member, target_member: client.update_project_member_role(
+            project_name_or_id=project_name,
+            member_id=member.id,
+            role=target_member.role_id,
+        ),
+        delete=lambda member: client.remove_project_member(
+            project_name_or_id=project_name, member_id=member.id
+        ),
+        in_sync=lambda member, target_member: member.role_id == target_member.role_id,
+        describe=lambda key: key[1],
+        context={"project": project_name},
+    )
 
 
 async def sync_project_members(
@@ -145,12 +316,17 @@ async def sync_project_members(
 
     The function will:
     1. Load the project members configuration from the specified file
-    2. For each project:
+    2. Resolve configured groups against the Harbor user groups, creating
+       OIDC and HTTP groups Harbor does not know yet
+    3. Expand project selectors into the matching projects
+    4. For each project:
         - Get current members
         - Remove members not in the config
         - Update roles for existing members
         - Add new members with specified roles
 
+    Members of a project are written concurrently, see ``Reconciler``.
+
     Args:
         client: Harbor API client instance.
         path: Path to the project members configuration file.
@@ -165,32 +341,27 @@ async def sync_project_members(
         logger.info("Loading project members configuration from %s", path)
         config = load_json(path)
 
-        for project in config:
-            project_name = project["project_name"]
-            logger.info("Syncing project members", extra={"project": project_name})
+        # Only list user groups when any project assigns group members
+        group_map: Dict[str, UserGroup] = {}
+        if any(
+            key in ROLE_KEYS and key.endswith(GROUP_KEY_SUFFIX) and members
+            for project in config
+            for key, members in project.items()
+        ):
+            group_map = await load_user_groups(client, logger)
+            await create_missing_groups(client, config, group_map, logger)
 
-            # Get current members
-            current_members = await client.get_project_members(
-                project_name_or_id=project_name, limit=None
-            )
+        # Expand project selectors into per-project member lists
+        project_configs = await expand_project_entries(client, config, logger)
 
-            # Build target member list
-            target_members = []
-            for role in ProjectRole:
-                role_members = project.get(role.name.lower(), [])
-                target_members.extend(
-                    [
-                        ProjectMemberEntity(entity_name=username, role_id=role.value)
-                        for username in role_members
-                    ]
-                )
+        for project_name, entries in project_configs.items():
+            project = merge_project_entries(entries)
+            logger.info("Syncing project members", extra={"project": project_name})
 
-            # Sync members
-            await remove_unlisted_members(
-                client, project_name, current_members, target_members, logger
-            )
-            await sync_member_roles(
-                client, project_name, current_members, target_members, logger
+            # Remove, update and add members to match the config
+            target_members = build_target_members(project, group_map)
+            await member_reconciler(client, project_name, logger).reconcile(
+                target_members, logger
             )
 
     except (FileNotFoundError, json.JSONDecodeError) as e:
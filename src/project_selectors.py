@@ -0,0 +1,303 @@
+"""Harbor project selector module.
+
+This module expands configuration entries that target projects by selector
+(glob, regular expression or project metadata) instead of a single
+``project_name`` into one entry per matching project.
+"""
+
+import fnmatch
+import hashlib
+import re
+from functools import lru_cache
+from logging import Logger
+from typing import Any, Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+from pagination import list_records
+from instance import instance_name
+from incremental import handles_project
+
+PROJECTS_KEY = "projects"
+PROJECT_NAME_KEY = "project_name"
+
+
+class ProjectRecord(NamedTuple):
+    """Fields of a listed project the selectors match against."""
+
+    name: str
+    metadata: Optional[Dict[str, Any]]
+
+
+class ProjectIndex:
+    """In-memory index of the Harbor projects used to expand selectors."""
+
+    def __init__(self, projects: List[Any]):
+        """Build the index from a project listing.
+
+        Args:
+            projects: Project records as listed from the Harbor API
+        """
+        self.metadata: Dict[str, Dict[str, str]] = {}
+        for project in projects:
+            self.metadata[project.name] = {
+                key: normalize_metadata_value(value)
+                for key, value in (project.metadata or {}).items()
+                if value is not None
+            }
+        self.names = sorted(self.metadata)
+        self.fingerprint = hashlib.sha256(
+            repr(
+                sorted(
+                    (name, sorted(meta.items())) for name, meta in self.metadata.items()
+                )
+            ).encode()
+        ).hexdigest()
+
+
+# Project index and selector expansions by instance, expansions are kept
+# together with the fingerprint of the index they were computed on
+_project_indexes: Dict[Optional[str], ProjectIndex] = {}
+_expansion_caches: Dict[Optional[str], Tuple[str, Dict[str, List[str]]]] = {}
+
+
+def normalize_metadata_value(value: Any) -> str:
+    """Normalize a project metadata value for comparison.
+
+    Harbor stores project metadata as strings, while configuration files
+    often use booleans or numbers.
+
+    Args:
+        value: Metadata value
+
+    Returns:
+        str: Lower-case string representation of the value
+    """
+    return str(value).lower()
+
+
+@lru_cache(maxsize=None)
+def compile_glob(pattern: str) -> Pattern[str]:
+    """Compile a glob pattern once.
+
+    Args:
+        pattern: Glob pattern (e.g. ``team-*``)
+
+    Returns:
+        Pattern[str]: Compiled regular expression
+    """
+    return re.compile(fnmatch.translate(pattern))
+
+
+@lru_cache(maxsize=None)
+def compile_regex(pattern: str) -> Pattern[str]:
+    """Compile a regular expression once.
+
+    Args:
+        pattern: Regular expression
+
+    Returns:
+        Pattern[str]: Compiled regular expression
+    """
+    return re.compile(pattern)
+
+
+def has_project_selectors(entries: List[Dict[str, Any]]) -> bool:
+    """Check whether any configuration entry uses a project selector.
+
+    Args:
+        entries: Configuration entries
+
+    Returns:
+        bool: True if at least one entry has a ``projects`` selector
+    """
+    return any(PROJECTS_KEY in entry for entry in entries)
+
+
+def selector_key(selector: Any) -> str:
+    """Build a stable cache key for a project selector.
+
+    Args:
+        selector: Project selector
+
+    Returns:
+        str: Cache key
+    """
+    if isinstance(selector, dict):
+        return repr(
+            sorted((key, selector_key(value)) for key, value in selector.items())
+        )
+    if isinstance(selector, list):
+        return repr([selector_key(item) for item in selector])
+    return repr(selector)
+
+
+def parse_selector(selector: Any) -> Tuple[List[str], Optional[str], Dict[str, str]]:
+    """Split a project selector into glob patterns, regex and metadata criteria.
+
+    A selector is either a glob string, a list of glob strings, or an object
+    with the optional keys ``pattern`` (glob string or list), ``regex`` and
+    ``metadata``. All given criteria must match.
+
+    Args:
+        selector: Project selector
+
+    Returns:
+        Tuple of glob patterns, regular expression and metadata criteria
+
+    Raises:
+        ValueError: If the selector has an unsupported format
+    """
+    if isinstance(selector, str):
+        return [selector], None, {}
+    if isinstance(selector, list):
+        return list(selector), None, {}
+    if isinstance(selector, dict):
+        unknown_keys = set(selector) - {"pattern", "regex", "metadata"}
+        if unknown_keys:
+            raise ValueError(
+                f"Unsupported project selector keys: {sorted(unknown_keys)}"
+            )
+        patterns = selector.get("pattern", [])
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        metadata = {
+            key: normalize_metadata_value(value)
+            for key, value in selector.get("metadata", {}).items()
+        }
+        return list(patterns), selector.get("regex"), metadata
+    raise ValueError(f"Unsupported project selector: {selector!r}")
+
+
+def match_projects(index: ProjectIndex, selector: Any) -> List[str]:
+    """Match a project selector against the project index.
+
+    Args:
+        index: Project index
+        selector: Project selector
+
+    Returns:
+        List[str]: Names of the matching projects
+    """
+    patterns, regex, metadata = parse_selector(selector)
+    globs = [compile_glob(pattern) for pattern in patterns]
+    compiled_regex = compile_regex(regex) if regex else None
+
+    matches = []
+    for name in index.names:
+        if globs and not any(glob.match(name) for glob in globs):
+            continue
+        if compiled_regex and not compiled_regex.search(name):
+            continue
+        project_metadata = index.metadata[name]
+        if any(project_metadata.get(key) != value for key, value in metadata.items()):
+            continue
+        matches.append(name)
+    return matches
+
+
+async def get_project_index(client: Any, logger: Logger) -> ProjectIndex:
+    """Return the project index, listing the projects on first use.
+
+    The index is built once and reused by every stage until
+    ``invalidate_project_index`` is called.
+
+    Args:
+        client: Harbor API client instance
+        logger: Logger instance
+
+    Returns:
+        ProjectIndex: Index of the current Harbor projects
+    """
+    name = instance_name()
+    if name not in _project_indexes:
+        projects = await list_records(client, ProjectRecord, "/projects")
+        _project_indexes[name] = ProjectIndex(projects)
+        logger.info(
+            "Built project index",
+            extra={"project_count": len(_project_indexes[name].names)},
+        )
+    return _project_indexes[name]
+
+
+def invalidate_project_index() -> None:
+    """Drop the project index so it is rebuilt on next use.
+
+    Cached selector expansions are kept and only discarded once the rebuilt
+    index shows that the project set has actually changed.
+    """
+    _project_indexes.pop(instance_name(), None)
+
+
+def expand_selector(index: ProjectIndex, selector: Any) -> List[str]:
+    """Expand a project selector, reusing cached expansions.
+
+    Args:
+        index: Project index
+        selector: Project selector
+
+    Returns:
+        List[str]: Names of the matching projects
+    """
+    name = instance_name()
+    fingerprint, expansion_cache = _expansion_caches.get(name, (None, {}))
+    if fingerprint != index.fingerprint:
+        expansion_cache = {}
+        _expansion_caches[name] = (index.fingerprint, expansion_cache)
+
+    key = selector_key(selector)
+    if key not in expansion_cache:
+        expansion_cache[key] = match_projects(index, selector)
+    return expansion_cache[key]
+
+
+async def expand_project_entries(
+    client: Any, entries: List[Dict[str, Any]], logger: Logger
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Group configuration entries by the project they apply to.
+
+    Entries with a ``project_name`` apply to that project, entries with a
+    ``projects`` selector apply to every matching project. The project index
+    is only fetched if a selector is used. Projects assigned to other
+    replicas or outside the project scope of the run are left out.
+
+    Args:
+        client: Harbor API client instance
+        entries: Configuration entries
+        logger: Logger instance
+
+    Returns:
+        Map of project names to the entries that apply to them, in
+        configuration order
+
+    Raises:
+        KeyError: If an entry has neither ``project_name`` nor ``projects``
+        ValueError: If a selector has an unsupported format
+    """
+    index = (
+        await get_project_index(client, logger)
+        if has_project_selectors(entries)
+        else None
+    )
+
+    project_entries: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        if PROJECTS_KEY in entry:
+            project_names = expand_selector(index, entry[PROJECTS_KEY])
+            logger.info(
+                "Expanded project selector",
+                extra={
+                    "selector": entry[PROJECTS_KEY],
+                    "project_count": len(project_names),
+                },
+            )
+        else:
+            project_names = [entry[PROJECT_NAME_KEY]]
+
+        body = {
+            key: value
+            for key, value in entry.items()
+            if key not in (PROJECTS_KEY, PROJECT_NAME_KEY)
+        }
+        for project_name in project_names:
+            if handles_project(project_name):
+                project_entries.setdefault(project_name, []).append(body)
+    return project_entries
@@ -1,8 +1,47 @@
 import json
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, NamedTuple, Optional
 from logging import Logger
 
 from utils import fill_template
+from pagination import count_objects, iter_records
+from project_selectors import invalidate_project_index, normalize_metadata_value
+from incremental import handles_project
+from quotas import sync_project_quotas
+from reconciler import Reconciler
+
+# Project fields the listing allows to compare. Harbor only applies the
+# storage limit and proxy cache registry on creation, quotas are synchronized
+# separately.
+COMPARED_FIELDS = {"project_name", "metadata", "storage_limit", "registry_id"}
+
+
+class ProjectRecord(NamedTuple):
+    """Fields of a listed project the synchronization needs."""
+
+    name: str
+    metadata: Optional[Dict[str, str]]
+
+
+def project_up_to_date(target_project: Dict[str, Any], current: ProjectRecord) -> bool:
+    """Check whether a project needs no update.
+
+    Args:
+        target_project: Project configuration
+        current: Project as listed by Harbor
+
+    Returns:
+        bool: True if the configured metadata matches and the configuration
+        has no fields the listing does not allow to compare
+    """
+    if not set(target_project) <= COMPARED_FIELDS:
+        return False
+    current_metadata = current.metadata or {}
+    return all(
+        key in current_metadata
+        and normalize_metadata_value(current_metadata[key])
+        == normalize_metadata_value(value)
+        for key, value in (target_project.get("metadata") or {}).items()
+    )
 
 
 async def load_target_projects(
@@ -25,77 +64,49 @@ async def load_target_projects(
     return json.loads(target_projects_string)
 
 
-async def delete_unused_projects(
-    client: Any,
-    current_projects: Dict[str, Any],
-    target_project_names: Set[str],
-    logger: Logger,
-) -> None:
-    """Delete projects that are not in the target configuration if they are empty.
+def project_reconciler(client: Any, logger: Logger) -> Reconciler:
+    """Build the reconciler of the Harbor projects.
 
-    Args:
-        client: Harbor API client instance
-        current_projects: Map of current project names to their configurations
-        target_project_names: Set of project names from target configuration
-        logger: Logger instance
-    """
-    for project_name, _ in current_projects.items():
-        if project_name not in target_project_names:
-            try:
-                repositories = await client.get_repositories(
-                    project_name=project_name, limit=None
-                )
-
-                if not repositories:
-                    logger.info("Deleting project", extra={"project": project_name})
-                    await client.delete_project(project_name_or_id=project_name)
-                else:
-                    logger.warning(
-                        "Cannot delete non-empty project",
-                        extra={
-                            "project": project_name,
-                            "repo_count": len(repositories),
-                        },
-                    )
-            except Exception as e:
-                logger.error(
-                    "Failed to process project deletion",
-                    extra={"project": project_name, "error": str(e)},
-                )
-
-
-async def update_or_create_projects(
-    client: Any,
-    target_projects: List[Dict[str, Any]],
-    current_project_map: Dict[str, Any],
-    logger: Logger,
-) -> None:
-    """Update existing projects or create new ones based on target configuration.
+    Unlisted projects are only deleted if they are empty, projects whose
+    configuration matches are not updated. Failed project writes are logged
+    without failing the synchronization.
 
     Args:
         client: Harbor API client instance
-        target_projects: List of target project configurations
-        current_project_map: Map of current project names to their configurations
         logger: Logger instance
+
+    Returns:
+        Reconciler: Reconciler of the projects keyed by name
     """
-    for target_project in target_projects:
-        project_name = target_project["project_name"]
-        try:
-            if project_name in current_project_map:
-                logger.info(
-                    "Updating existing project", extra={"project": project_name}
-                )
-                await client.update_project(
-                    project_name_or_id=project_name, project=target_project
-                )
-            else:
-                logger.info("Creating new project", extra={"project": project_name})
-                await client.create_project(project=target_project)
-        except Exception as e:
-            logger.error(
-                "Failed to process project configuration",
-                extra={"project": project_name, "error": str(e)},
+
+    async def delete_project(current: ProjectRecord) -> None:
+        repo_count = await count_objects(
+            client, f"/projects/{current.name}/repositories"
+        )
+        if repo_count:
+            logger.warning(
+                "Cannot delete non-empty project",
+                extra={"project": current.name, "repo_count": repo_count},
             )
+            return
+        await client.delete_project(project_name_or_id=current.name)
+
+    return Reconciler(
+        stage="projects",
+        resource="project",
+        log_field="project",
+        list_current=lambda: iter_records(client, ProjectRecord, "/projects"),
+        key=lambda proj: proj.name,
+        desired_key=lambda proj: proj["project_name"],
+        create=lambda target_project: client.create_project(project=target_project),
+        update=lambda proj, target_project: client.update_project(
+            project_name_or_id=proj.name, project=target_project
+        ),
+        delete=delete_project,
+        in_sync=lambda proj, target_project: project_up_to_date(target_project, proj),
+        manages=handles_project,
+        raise_failures=False,
+    )
 
 
 async def sync_projects(client: Any, path: str, logger: Logger) -> None:
@@ -103,9 +114,10 @@ async def sync_projects(client: Any, path: str, logger: Logger) -> None:
 
     This function performs the following operations:
     1. Reads and parses the project configuration file
-    2. Retrieves current projects from Harbor
+    2. Streams current projects from Harbor and diffs them against the config
     3. Deletes projects that are not in the config (if they are empty)
-    4. Updates existing projects or creates new ones based on config
+    4. Updates existing projects whose metadata differs or creates new ones
+    5. Updates the storage quotas that differ from the config
 
     Args:
         client: Harbor API client instance
@@ -122,20 +134,19 @@ async def sync_projects(client: Any, path: str, logger: Logger) -> None:
         # Load target project configuration
         target_projects = await load_target_projects(client, path, logger)
 
-        # Get current projects from Harbor
-        current_projects = await client.get_projects(limit=None)
-        current_project_map = {proj.name: proj for proj in current_projects}
-        target_project_names = {proj["project_name"] for proj in target_projects}
+        # Only handle the projects assigned to this replica and run
+        target_projects = [
+            proj for proj in target_projects if handles_project(proj["project_name"])
+        ]
 
-        # Delete projects not in config if they're empty
-        await delete_unused_projects(
-            client, current_project_map, target_project_names, logger
-        )
+        # Delete empty unlisted projects, update and create projects
+        await project_reconciler(client, logger).reconcile(target_projects, logger)
 
-        # Update or create projects from config
-        await update_or_create_projects(
-            client, target_projects, current_project_map, logger
-        )
+        # Correct storage limits that differ from the config
+        await sync_project_quotas(client, target_projects, logger)
+
+        # Project selectors of later stages must see the updated project set
+        invalidate_project_index()
 
     except json.JSONDecodeError as e:
         logger.error("Invalid project configuration JSON", extra={"error": str(e)})
@@ -4,13 +4,16 @@ from logging import Logger
 from harborapi.exceptions import NotFound
 
 from utils import load_json
+from adaptive_schedule import adapt_purge_job_schedule
 
 
 async def sync_purge_job_schedule(client: Any, path: str, logger: Logger) -> None:
     """Synchronize the Harbor purge job schedule configuration.
 
     This function reads the purge job schedule configuration from a file and
-    either updates an existing schedule or creates a new one in Harbor.
+    either updates an existing schedule or creates a new one in Harbor. If the
+    configuration has an ``adaptive`` section, the cron expression is chosen
+    from the audit log growth rate.
 
     Args:
         client: Harbor API client instance
@@ -35,6 +38,11 @@ async def sync_purge_job_schedule(client: Any, path: str, logger: Logger) -> Non
             )
             raise
 
+        if "adaptive" in purge_job_schedule:
+            purge_job_schedule = await adapt_purge_job_schedule(
+                client, purge_job_schedule, logger
+            )
+
         # Try to update existing schedule, create new one if it doesn't exist
         try:
             await client.get_purge_job_schedule()
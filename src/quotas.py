@@ -0,0 +1,132 @@
+"""Harbor project quota module.
+
+Harbor only applies the ``storage_limit`` of a project when the project is
+created, later changes go through its quota. All project quotas are read in
+one listing, only the quotas whose hard storage limit differs from the
+configuration are updated, and the storage usage of every project is
+exported as metrics.
+"""
+
+from logging import Logger
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from harborapi.models import QuotaUpdateReq, ResourceList
+
+from apply import apply_operations
+from incremental import handles_project
+from metrics import set_gauge
+from pagination import iter_records
+
+# Quota resource of the project storage limit
+STORAGE = "storage"
+
+
+class QuotaRecord(NamedTuple):
+    """Fields of a listed quota the synchronization needs."""
+
+    id: int
+    ref: Optional[Dict[str, Any]]
+    hard: Optional[Dict[str, int]]
+    used: Optional[Dict[str, int]]
+
+
+def export_quota_metrics(project_name: str, quota: QuotaRecord) -> None:
+    """Export the storage usage of a project.
+
+    Args:
+        project_name: Name of the project
+        quota: Quota of the project
+    """
+    used = (quota.used or {}).get(STORAGE, 0)
+    hard = (quota.hard or {}).get(STORAGE, -1)
+    set_gauge(
+        "project_storage_used_bytes",
+        used,
+        "Storage used by a project.",
+        project=project_name,
+    )
+    set_gauge(
+        "project_storage_limit_bytes",
+        hard,
+        "Storage limit of a project, -1 if unlimited.",
+        project=project_name,
+    )
+    if hard > 0:
+        set_gauge(
+            "project_storage_usage_ratio",
+            used / hard,
+            "Share of its storage limit a project uses.",
+            project=project_name,
+        )
+
+
+async def sync_project_quotas(
+    client: Any, target_projects: List[Dict[str, Any]], logger: Logger
+) -> None:
+    """Update the storage quotas that differ from the project configuration.
+
+    Quotas are updated concurrently, see ``apply_operations``.
+
+    Args:
+        client: Harbor API client instance
+        target_projects: Project configurations, the ones with a
+            ``storage_limit`` are synchronized
+        logger: Logger instance
+
+    Raises:
+        ApplyError: If quota updates failed
+    """
+    storage_limits = {
+        project["project_name"]: project["storage_limit"]
+        for project in target_projects
+        if project.get("storage_limit") is not None
+    }
+
+    changed: Dict[str, QuotaRecord] = {}
+    async for quota in iter_records(
+        client, QuotaRecord, "/quotas", {"reference": "project"}
+    ):
+        project_name = (quota.ref or {}).get("name")
+        if not project_name or not handles_project(project_name):
+            continue
+        export_quota_metrics(project_name, quota)
+        if project_name not in storage_limits:
+            continue
+        if (quota.hard or {}).get(STORAGE) != storage_limits[project_name]:
+            changed[project_name] = quota
+
+    async def update_quota(project_name: str, quota: QuotaRecord) -> None:
+        storage_limit = storage_limits[project_name]
+        logger.info(
+            "Updating project quota",
+            extra={
+                "project": project_name,
+                "from": (quota.hard or {}).get(STORAGE),
+                "to": storage_limit,
+            },
+        )
+        hard = {**(quota.hard or {}), STORAGE: storage_limit}
+        try:
+            await client.update_quota(
+                id=quota.id, quota=QuotaUpdateReq(hard=ResourceList(hard))
+            )
+        except Exception as e:
+            logger.error(
+                "Failed to update project quota",
+                extra={"project": project_name, "error": str(e)},
+            )
+            raise
+        export_quota_metrics(project_name, quota._replace(hard=hard))
+
+    await apply_operations(
+        "quotas",
+        (
+            (name, lambda name=name, quota=quota: update_quota(name, quota))
+            for name, quota in changed.items()
+        ),
+        logger,
+    )
+    logger.info(
+        "Project quotas synchronized",
+        extra={"limits": len(storage_limits), "updated": len(changed)},
+    )
@@ -0,0 +1,276 @@
+"""Harbor reconciler module.
+
+The stages syncing a list of Harbor objects share one shape: list the
+objects in Harbor, match them to the configured entries by key, delete the
+unlisted objects and create or update the configured ones. A ``Reconciler``
+declares this for one resource type, i.e. how to list, key and compare its
+objects and how to write them, and runs the diff, the concurrent writes, the
+logging and the metrics the same way for every resource type.
+
+Listed objects are compact records, see ``pagination.iter_records``.
+``record_matches`` compares such a record with its configured entry on the
+fields the configuration sets, so unchanged objects are not written.
+"""
+
+from dataclasses import dataclass, field
+from logging import Logger
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from apply import ApplyError, apply_operations
+from metrics import set_gauge
+from pagination import CREATE, DELETE, UPDATE, stream_diff
+
+# Action of configured objects that need no write
+UNCHANGED = "unchanged"
+
+
+def config_matches(configured: Any, current: Any) -> bool:
+    """Check whether a value listed by Harbor matches its configuration.
+
+    Only what the configuration sets is compared: objects match if every
+    configured field matches, lists if every configured element matches a
+    different listed element, in any order as Harbor does not keep it, other
+    values if they are equal. Fields Harbor adds, like ids and defaults, are
+    ignored.
+
+    Args:
+        configured: Configured value
+        current: Value listed by Harbor, plain JSON
+
+    Returns:
+        bool: True if the value needs no update
+    """
+    if isinstance(configured, dict):
+        return isinstance(current, dict) and all(
+            config_matches(value, current.get(key)) for key, value in configured.items()
+        )
+    if isinstance(configured, list):
+        return (
+            isinstance(current, list)
+            and len(configured) == len(current)
+            and elements_match(configured, current)
+        )
+    return configured == current
+
+
+def elements_match(configured: List[Any], current: List[Any]) -> bool:
+    """Check whether list elements can be paired up so that each pair matches.
+
+    Args:
+        configured: Configured elements
+        current: Elements listed by Harbor, as many as configured
+
+    Returns:
+        bool: True if every configured element matches a different listed one
+    """
+    if not configured:
+        return True
+    first, rest = configured[0], configured[1:]
+    return any(
+        config_matches(first, item)
+        and elements_match(rest, current[:index] + current[index + 1 :])
+        for index, item in enumerate(current)
+    )
+
+
+def record_matches(
+    current: Any, target: Dict[str, Any], ignored: Iterable[str] = ()
+) -> bool:
+    """Check whether a listed record matches its configured entry.
+
+    Args:
+        current: Record listed by Harbor
+        target: Configured entry
+        ignored: Configured fields not to compare, e.g. the key or secrets
+
+    Returns:
+        bool: True if every other configured field is a field of the record
+        and matches, see ``config_matches``
+    """
+    ignored = set(ignored)
+    fields = {key: value for key, value in target.items() if key not in ignored}
+    return set(fields) <= set(current._fields) and all(
+        config_matches(value, getattr(current, key)) for key, value in fields.items()
+    )
+
+
+@dataclass
+class Reconciler:
+    """Declarative reconciliation of one Harbor resource type.
+
+    Harbor objects are keyed by ``key`` and configured entries by
+    ``desired_key``. Unlisted objects are deleted first, then missing entries
+    are created and matched ones updated, all concurrently, see
+    ``apply_operations``. Failed deletes do not stop the writes, the failures
+    of both are raised together. Matched objects for which ``in_sync``
+    returns True are left alone, without it every matched object is updated.
+    """
+
+    # Name of the reconciliation, used in logs and metrics
+    stage: str
+    # Name of the resource type in log messages, e.g. ``registry``
+    resource: str
+    # Extra field naming the object in log records
+    log_field: str
+    list_current: Callable[[], AsyncIterator[Any]]
+    key: Callable[[Any], Hashable]
+    desired_key: Callable[[Any], Hashable]
+    create: Callable[[Any], Awaitable[Any]]
+    update: Callable[[Any, Any], Awaitable[Any]]
+    delete: Callable[[Any], Awaitable[Any]]
+    in_sync: Optional[Callable[[Any, Any], bool]] = None
+    # Whether the reconciliation may delete an unlisted object, by its key
+    manages: Optional[Callable[[Hashable], bool]] = None
+    # Value logged for an object, by its key
+    describe: Callable[[Hashable], Any] = lambda key: key
+    # Extra fields of all log records, also labels of the metrics
+    context: Dict[str, str] = field(default_factory=dict)
+    # Whether failed writes fail the reconciliation or are only logged
+    raise_failures: bool = True
+    concurrency: Optional[int] = None
+
+    def _extra(self, key: Hashable) -> Dict[str, Any]:
+        """Return the extra log fields of an object."""
+        return {**self.context, self.log_field: self.describe(key)}
+
+    async def _write(
+        self,
+        action: str,
+        key: Hashable,
+        write: Callable[..., Awaitable[Any]],
+        objects: Tuple[Any, ...],
+        logger: Logger,
+    ) -> None:
+        """Log and perform the write of one object.
+
+        Args:
+            action: CREATE, UPDATE or DELETE
+            key: Key of the object
+            write: Function performing the write
+            objects: Arguments of the write
+            logger: Logger instance
+
+        Raises:
+            Exception: If the write failed and failures are raised
+        """
+        messages = {
+            CREATE: f"Creating new {self.resource}",
+            UPDATE: f"Updating existing {self.resource}",
+            DELETE: f"Deleting {self.resource} not in config",
+        }
+        logger.info(messages[action], extra=self._extra(key))
+        try:
+            await write(*objects)
+        except Exception as e:
+            logger.error(
+                f"Failed to {action} {self.resource}",
+                extra={**self._extra(key), "error": str(e)},
+            )
+            if self.raise_failures:
+                raise
+
+    async def reconcile(self, desired: Iterable[Any], logger: Logger) -> Dict[str, int]:
+        """Reconcile the Harbor objects with the configured entries.
+
+        Args:
+            desired: Configured entries, a later entry overrides an earlier
+                one with the same key
+            logger: Logger instance
+
+        Returns:
+            Dict[str, int]: Number of objects by action
+
+        Raises:
+            ApplyError: If writes failed and failures are raised
+            Exception: If listing the Harbor objects failed
+        """
+        desired_map = {self.desired_key(entry): entry for entry in desired}
+        matched: Dict[Hashable, Any] = {}
+        unlisted: List[Tuple[Hashable, Any]] = []
+        try:
+            async for action, key, current, _ in stream_diff(
+                self.list_current(), desired_map, self.key
+            ):
+                if action == UPDATE:
+                    matched[key] = current
+                elif action == DELETE and (self.manages is None or self.manages(key)):
+                    unlisted.append((key, current))
+        except Exception as e:
+            logger.error(
+                f"Failed to fetch existing {self.resource} objects",
+                extra={**self.context, "error": str(e)},
+            )
+            raise
+
+        failures = []
+        try:
+            await apply_operations(
+                f"{self.stage}-deletes",
+                (
+                    (
+                        key,
+                        lambda key=key, current=current: self._write(
+                            DELETE, key, self.delete, (current,), logger
+                        ),
+                    )
+                    for key, current in unlisted
+                ),
+                logger,
+                self.concurrency,
+            )
+        except ApplyError as e:
+            # Logged by _write, the writes of the other objects still run
+            failures.extend(e.failures)
+
+        counts = {CREATE: 0, UPDATE: 0, UNCHANGED: 0, DELETE: len(unlisted)}
+        operations = []
+        for key, target in desired_map.items():
+            current = matched.get(key)
+            if current is None:
+                action, write, objects = CREATE, self.create, (target,)
+            elif self.in_sync is not None and self.in_sync(current, target):
+                counts[UNCHANGED] += 1
+                logger.info(
+                    f"{self.resource.capitalize()} is up to date",
+                    extra=self._extra(key),
+                )
+                continue
+            else:
+                action, write, objects = UPDATE, self.update, (current, target)
+            counts[action] += 1
+            operations.append(
+                (
+                    key,
+                    lambda key=key, action=action, write=write, objects=objects: (
+                        self._write(action, key, write, objects, logger)
+                    ),
+                )
+            )
+        try:
+            await apply_operations(self.stage, operations, logger, self.concurrency)
+        except ApplyError as e:
+            failures.extend(e.failures)
+
+        for action, count in counts.items():
+            set_gauge(
+                "reconciled_objects",
+                count,
+                "Objects of the last reconciliation by action.",
+                stage=self.stage,
+                action=action,
+                **self.context,
+            )
+        if failures:
+            raise ApplyError(self.stage, failures, len(unlisted) + len(operations))
+        return counts
@@ -1,8 +1,79 @@
-from typing import Any, Dict, List, Set
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 from logging import Logger
 import json
 
 from utils import load_json
+from pagination import iter_records
+from reconciler import Reconciler, record_matches
+from configuration import (
+    secret_changed,
+    secret_fingerprint,
+    store_secret_fingerprints,
+)
+
+
+class RegistryRecord(NamedTuple):
+    """Fields of a listed registry the synchronization needs."""
+
+    id: int
+    name: str
+    type: Optional[str]
+    url: Optional[str]
+    description: Optional[str]
+    insecure: Optional[bool]
+    credential: Optional[Dict[str, Any]]
+
+
+def credential_secret_key(registry_name: str) -> str:
+    """Return the name the fingerprint of a registry's secret is kept under.
+
+    Args:
+        registry_name: Name of the registry
+
+    Returns:
+        str: Name of the fingerprint
+    """
+    return f"registry:{registry_name}"
+
+
+def split_credential_secret(
+    target_registry: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Split the access secret off a registry configuration.
+
+    Harbor masks the access secret of a listed registry, so it is compared by
+    the fingerprint of its last applied value instead.
+
+    Args:
+        target_registry: Registry configuration
+
+    Returns:
+        Tuple of the configuration without the secret and the secret
+    """
+    credential = dict(target_registry.get("credential") or {})
+    secret = credential.pop("access_secret", None)
+    if "credential" not in target_registry:
+        return target_registry, secret
+    return {**target_registry, "credential": credential}, secret
+
+
+def registry_up_to_date(
+    current: RegistryRecord, target_registry: Dict[str, Any]
+) -> bool:
+    """Check whether a registry needs no update.
+
+    Args:
+        current: Registry as listed by Harbor
+        target_registry: Registry configuration
+
+    Returns:
+        bool: True if the configured fields match and the access secret was
+        applied before
+    """
+    target_registry, secret = split_credential_secret(target_registry)
+    return record_matches(current, target_registry) and not (
+        secret and secret_changed(credential_secret_key(current.name), secret)
+    )
 
 
 def load_target_registries(path: str, logger: Logger) -> List[Dict[str, Any]]:
@@ -29,85 +100,65 @@ def load_target_registries(path: str, logger: Logger) -> List[Dict[str, Any]]:
         raise
 
 
-async def delete_unused_registries(
-    client: Any,
-    current_registry_map: Dict[str, Any],
-    target_registry_names: Set[str],
-    logger: Logger,
-) -> None:
-    """Delete registries that exist in Harbor but not in the config.
+def registry_reconciler(client: Any, logger: Logger) -> Reconciler:
+    """Build the reconciler of the Harbor registries.
 
-    Args:
-        client: Harbor API client instance
-        current_registry_map: Map of current registry names to their configurations
-        target_registry_names: Set of registry names from target configuration
-        logger: Logger instance
-
-    Raises:
-        Exception: If deletion of any registry fails
-    """
-    for registry_name, registry in current_registry_map.items():
-        if registry_name not in target_registry_names:
-            try:
-                logger.info(
-                    "Deleting registry not in config", extra={"registry": registry_name}
-                )
-                await client.delete_registry(id=registry.id)
-            except Exception as e:
-                logger.error(
-                    "Failed to delete registry",
-                    extra={"registry": registry_name, "error": str(e)},
-                )
-                raise
-
-
-async def update_or_create_registries(
-    client: Any,
-    target_registries: List[Dict[str, Any]],
-    current_registry_map: Dict[str, Any],
-    logger: Logger,
-) -> None:
-    """Update existing registries or create new ones based on configuration.
+    A registry whose type changed is deleted and recreated after its update,
+    together with the proxy cache project using it. Registries whose
+    configured fields and access secret did not change are not updated.
 
     Args:
         client: Harbor API client instance
-        target_registries: List of target registry configurations
-        current_registry_map: Map of current registry names to their configurations
         logger: Logger instance
 
-    Raises:
-        Exception: If update or creation of any registry fails
+    Returns:
+        Reconciler: Reconciler of the registries keyed by name
     """
-    for target_registry in target_registries:
-        registry_name = target_registry["name"]
-        try:
-            if registry_name in current_registry_map:
-                logger.info(
-                    "Updating existing registry", extra={"registry": registry_name}
-                )
-                await client.update_registry(
-                    id=current_registry_map[registry_name].id, registry=target_registry
-                )
-                if current_registry_map[registry_name].type != target_registry["type"]:
-                    logger.info(
-                        "Registry type has changed, deleting and recreating",
-                        extra={"registry": registry_name}
+
+    def remember_secret(target_registry: Dict[str, Any]) -> None:
+        _, secret = split_credential_secret(target_registry)
+        if secret:
+            store_secret_fingerprints(
+                {
+                    credential_secret_key(target_registry["name"]): secret_fingerprint(
+                        secret
                     )
-                    registry_id = current_registry_map[registry_name].id
-                    projects = await client.get_projects(query=f"registry_id={registry_id}")
-                    project_id = int(projects[0].project_id)
-                    await client.delete_project(project_name_or_id=project_id)
-                    await client.delete_registry(id=registry_id)
-                    await client.create_registry(registry=target_registry)
-            else:
-                logger.info("Creating new registry", extra={"registry": registry_name})
-                await client.create_registry(registry=target_registry)
-        except Exception as e:
-            logger.error(
-                "Failed to process registry configuration",
-                extra={"registry": registry_name, "error": str(e)},
+                },
+                logger,
             )
-            raise
+
+    async def create_registry(target_registry: Dict[str, Any]) -> None:
+        await client.create_registry(registry=target_registry)
+        remember_secret(target_registry)
+
+    async def update_registry(
+        current: RegistryRecord, target_registry: Dict[str, Any]
+    ) -> None:
+        await client.update_registry(id=current.id, registry=target_registry)
+        remember_secret(target_registry)
+        if current.type != target_registry["type"]:
+            logger.info(
+                "Registry type has changed, deleting and recreating",
+                extra={"registry": current.name},
+            )
+            projects = await client.get_projects(query=f"registry_id={current.id}")
+            project_id = int(projects[0].project_id)
+            await client.delete_project(project_name_or_id=project_id)
+            await client.delete_registry(id=current.id)
+            await client.create_registry(registry=target_registry)
+
+    return Reconciler(
+        stage="registries",
+        resource="registry",
+        log_field="registry",
+        list_current=lambda: iter_records(client, RegistryRecord, "/registries"),
+        key=lambda registry: registry.name,
+        desired_key=lambda registry: registry["name"],
+        create=create_registry,
+        update=update_registry,
+        delete=lambda registry: client.delete_registry(id=registry.id),
+        in_sync=registry_up_to_date,
+    )
 
 
 async def sync_registries(client: Any, path: str, logger: Logger) -> None:
@@ -119,6 +170,8 @@ async def sync_registries(client: Any, path: str, logger: Logger) -> None:
     3. Updates existing registries with new configurations
     4. Creates new registries defined in the config
 
+    Registries are written concurrently, see ``Reconciler``.
+
     Args:
         client: Harbor API client instance
         path: Path to the registries configuration file
@@ -135,22 +188,8 @@ async def sync_registries(client: Any, path: str, logger: Logger) -> None:
         # Load registry configurations
         target_registries = load_target_registries(path, logger)
 
-        # Get current registries from Harbor
-        current_registries = await client.get_registries(limit=None)
-
-        # Create lookup maps for efficient access
-        current_registry_map = {reg.name: reg for reg in current_registries}
-        target_registry_names = {reg["name"] for reg in target_registries}
-
-        # Delete registries not in config
-        await delete_unused_registries(
-            client, current_registry_map, target_registry_names, logger
-        )
-
-        # Update or create registries from config
-        await update_or_create_registries(
-            client, target_registries, current_registry_map, logger
-        )
+        # Delete, update and create registries to match the config
+        await registry_reconciler(client, logger).reconcile(target_registries, logger)
 
         logger.info("Registry synchronization completed successfully")
 
@@ -0,0 +1,412 @@
+"""Harbor replication monitor module.
+
+This module polls the executions and tasks of the replication policies,
+exports lag, throughput and failure rate per policy as metrics and optionally
+tunes the ``speed`` and ``copy_by_chunk`` settings of the policies managed
+in replications.json.
+"""
+
+import asyncio
+import fnmatch
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from harborapi.models import ReplicationPolicy
+
+from instance import getenv
+from utils import (
+    TEMPLATE_PATTERN,
+    RateLimiter,
+    load_json,
+    read_config_text,
+    replace_env_vars_in_obj,
+)
+from metrics import set_gauge
+from pagination import iter_models
+
+SUCCEEDED_STATUS = "Succeed"
+UNLIMITED_SPEED = -1
+
+# Configuration of the replication rules, a directory of fragments first
+REPLICATION_CONFIG_NAMES = ("replications.d", "replications.json")
+
+
+@dataclass
+class ReplicationStats:
+    """Replication statistics of a single policy."""
+
+    policy_name: str
+    executions: int
+    lag_seconds: Optional[float]
+    artifacts_per_second: Optional[float]
+    failure_rate: Optional[float]
+    avg_task_seconds: Optional[float]
+
+
+def load_monitor_config(path: str, logger: Logger) -> Dict[str, Any]:
+    """Load the replication monitor configuration from file.
+
+    Args:
+        path: Path to the replication monitor configuration file
+        logger: Logger instance
+
+    Returns:
+        Replication monitor configuration
+
+    Raises:
+        FileNotFoundError: If the configuration file does not exist
+        json.JSONDecodeError: If the configuration file is not valid JSON
+    """
+    try:
+        return load_json(path)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logger.error(
+            "Failed to load replication monitor configuration",
+            extra={"path": path, "error": str(e)},
+        )
+        raise
+
+
+def managed_replication_names(path: str, logger: Logger) -> Set[str]:
+    """Return the names of the replication rules configured in replications.json.
+
+    The replication configuration is looked up next to the monitor
+    configuration, then in CONFIG_FOLDER_PATH. Id templates are not resolved,
+    only the names are read.
+
+    Args:
+        path: Path to the replication monitor configuration file
+        logger: Logger instance
+
+    Returns:
+        Set[str]: Names of the configured rules, empty if there is no
+        replication configuration
+    """
+    folders = [Path(path).parent]
+    if getenv("CONFIG_FOLDER_PATH"):
+        folders.append(Path(getenv("CONFIG_FOLDER_PATH")))
+    for folder in folders:
+        for name in REPLICATION_CONFIG_NAMES:
+            config_path = folder / name
+            if not config_path.exists():
+                continue
+            content = TEMPLATE_PATTERN.sub("0", read_config_text(str(config_path)))
+            rules = replace_env_vars_in_obj(json.loads(content))
+            return {rule["name"] for rule in rules if "name" in rule}
+    logger.warning("No replication configuration found, no rule is tuned")
+    return set()
+
+
+def seconds_between(start: Optional[datetime], end: Optional[datetime]) -> float:
+    """Return the seconds between two timestamps, treating naive ones as UTC.
+
+    Args:
+        start: Start time
+        end: End time
+
+    Returns:
+        float: Elapsed seconds, 0 if either timestamp is missing
+    """
+    if not start or not end:
+        return 0.0
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    return max((end - start).total_seconds(), 0.0)
+
+
+def compute_stats(
+    policy_name: str, executions: List[Any], tasks: List[Any], now: datetime
+) -> ReplicationStats:
+    """Compute replication statistics from the most recent executions.
+
+    Harbor does not report transferred bytes for replications, so throughput
+    is measured in replicated artifacts per second.
+
+    Args:
+        policy_name: Name of the replication policy
+        executions: Most recent executions, newest first
+        tasks: Tasks of the most recent finished execution
+        now: Current time
+
+    Returns:
+        ReplicationStats: Statistics of the policy
+    """
+    lag_seconds = None
+    last_success = next(
+        (e for e in executions if e.status == SUCCEEDED_STATUS and e.end_time), None
+    )
+    if last_success:
+        lag_seconds = seconds_between(last_success.end_time, now)
+    elif executions:
+        lag_seconds = seconds_between(executions[-1].start_time, now)
+
+    finished = [e for e in executions if e.end_time]
+    succeeded = sum(e.succeed or 0 for e in finished)
+    duration = sum(seconds_between(e.start_time, e.end_time) for e in finished)
+    total = sum(e.total or 0 for e in finished)
+    failed = sum(e.failed or 0 for e in finished)
+
+    task_durations = [
+        seconds_between(t.start_time, t.end_time) for t in tasks if t.end_time
+    ]
+
+    return ReplicationStats(
+        policy_name=policy_name,
+        executions=len(executions),
+        lag_seconds=lag_seconds,
+        artifacts_per_second=succeeded / duration if duration else None,
+        failure_rate=failed / total if total else None,
+        avg_task_seconds=(
+            sum(task_durations) / len(task_durations) if task_durations else None
+        ),
+    )
+
+
+def export_stats(stats: ReplicationStats) -> None:
+    """Export replication statistics as metrics.
+
+    Args:
+        stats: Statistics of a replication policy
+    """
+    labels = {"policy": stats.policy_name}
+    set_gauge(
+        "replication_executions_observed",
+        stats.executions,
+        "Number of replication executions evaluated per policy.",
+        **labels,
+    )
+    if stats.lag_seconds is not None:
+        set_gauge(
+            "replication_lag_seconds",
+            stats.lag_seconds,
+            "Seconds since the last successful replication execution.",
+            **labels,
+        )
+    if stats.artifacts_per_second is not None:
+        set_gauge(
+            "replication_artifacts_per_second",
+            stats.artifacts_per_second,
+            "Replicated artifacts per second of execution time.",
+            **labels,
+        )
+    if stats.failure_rate is not None:
+        set_gauge(
+            "replication_failure_rate",
+            stats.failure_rate,
+            "Ratio of failed to total replication tasks.",
+            **labels,
+        )
+    if stats.avg_task_seconds is not None:
+        set_gauge(
+            "replication_task_duration_seconds_avg",
+            stats.avg_task_seconds,
+            "Average duration of the tasks of the last finished execution.",
+            **labels,
+        )
+
+
+def tune_policy(
+    policy: Any, stats: ReplicationStats, auto_tune: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """Compute new ``speed`` and ``copy_by_chunk`` settings for a policy.
+
+    A policy with a failure rate above ``max_failure_rate`` is slowed down to
+    half its speed and switched to chunked copying. A policy that lags more
+    than ``max_lag_seconds`` behind is sped up to twice its speed. The speed
+    (KB/s) always stays within ``min_speed`` and ``max_speed``, where a
+    ``max_speed`` of -1 allows unlimited speed.
+
+    Args:
+        policy: Current replication policy
+        stats: Statistics of the policy
+        auto_tune: Auto-tuning configuration
+
+    Returns:
+        Changed settings, or None if the policy is kept as is
+    """
+    min_speed = auto_tune.get("min_speed", 1024)
+    max_speed = auto_tune.get("max_speed", UNLIMITED_SPEED)
+    max_lag_seconds = auto_tune.get("max_lag_seconds", 3600)
+    max_failure_rate = auto_tune.get("max_failure_rate", 0.1)
+
+    speed = policy.speed if policy.speed and policy.speed > 0 else UNLIMITED_SPEED
+    copy_by_chunk = bool(policy.copy_by_chunk)
+    new_speed, new_copy_by_chunk = speed, copy_by_chunk
+
+    if stats.failure_rate is not None and stats.failure_rate > max_failure_rate:
+        current = speed if speed != UNLIMITED_SPEED else max_speed
+        new_speed = (
+            max(min_speed, current // 2) if current != UNLIMITED_SPEED else speed
+        )
+        new_copy_by_chunk = copy_by_chunk or auto_tune.get("copy_by_chunk", True)
+    elif (
+        stats.lag_seconds is not None
+        and stats.lag_seconds > max_lag_seconds
+        and speed != UNLIMITED_SPEED
+    ):
+        new_speed = (
+            speed * 2 if max_speed == UNLIMITED_SPEED else min(max_speed, speed * 2)
+        )
+
+    # Keep the speed within the configured bounds
+    if new_speed != UNLIMITED_SPEED:
+        new_speed = max(min_speed, new_speed)
+    if max_speed != UNLIMITED_SPEED and (
+        new_speed == UNLIMITED_SPEED or new_speed > max_speed
+    ):
+        new_speed = max_speed
+
+    if new_speed == speed and new_copy_by_chunk == copy_by_chunk:
+        return None
+    return {"speed": new_speed, "copy_by_chunk": new_copy_by_chunk}
+
+
+async def monitor_policy(
+    client: Any,
+    policy: Any,
+    config: Dict[str, Any],
+    limiter: RateLimiter,
+    logger: Logger,
+    managed: bool = False,
+) -> ReplicationStats:
+    """Poll the executions and tasks of a single policy and export its stats.
+
+    Args:
+        client: Harbor API client instance
+        policy: Replication policy
+        config: Replication monitor configuration
+        limiter: Rate limiter shared by all requests of the monitor
+        logger: Logger instance
+        managed: Whether the policy is configured in replications.json and
+            may be tuned
+
+    Returns:
+        ReplicationStats: Statistics of the policy
+    """
+    execution_count = config.get("executions", 5)
+
+    await limiter.wait()
+    executions = await client.get_replications(
+        policy_id=policy.id,
+        sort="-start_time",
+        page_size=execution_count,
+        limit=execution_count,
+    )
+
+    tasks = []
+    last_finished = next((e for e in executions if e.end_time), None)
+    if last_finished:
+        await limiter.wait()
+        tasks = await client.get_replication_tasks(
+            execution_id=last_finished.id,
+            page_size=config.get("tasks", 50),
+            limit=config.get("tasks", 50),
+        )
+
+    stats = compute_stats(policy.name, executions, tasks, datetime.now(timezone.utc))
+    export_stats(stats)
+    logger.info(
+        "Replication policy statistics",
+        extra={
+            "replication": policy.name,
+            "lag_seconds": stats.lag_seconds,
+            "artifacts_per_second": stats.artifacts_per_second,
+            "failure_rate": stats.failure_rate,
+        },
+    )
+
+    auto_tune = config.get("auto_tune", {})
+    if managed and auto_tune.get("enabled", False):
+        changes = tune_policy(policy, stats, auto_tune)
+        if changes:
+            logger.info(
+                "Tuning replication policy",
+                extra={"replication": policy.name, **changes},
+            )
+            policy.speed = changes["speed"]
+            policy.copy_by_chunk = changes["copy_by_chunk"]
+            await limiter.wait()
+            await client.update_replication_policy(policy_id=policy.id, policy=policy)
+
+    return stats
+
+
+async def monitor_replications(client: Any, path: str, logger: Logger) -> None:
+    """Monitor and optionally tune the replication policies.
+
+    This function performs the following operations:
+    1. Loads the replication monitor configuration from file
+    2. Retrieves the replication policies matching the configured names
+    3. Polls executions and tasks per policy in rate-limited batches
+    4. Exports lag, throughput and failure rate per policy as metrics
+    5. Tunes speed and chunked copying within bounds if enabled, only for
+       the policies configured in replications.json
+
+    Args:
+        client: Harbor API client instance
+        path: Path to the replication monitor configuration file
+        logger: Logger instance for recording operations
+
+    Raises:
+        FileNotFoundError: If the configuration file does not exist
+        json.JSONDecodeError: If the configuration file is not valid JSON
+        Exception: If any Harbor API operation fails
+    """
+    logger.info("Starting replication monitoring")
+
+    try:
+        config = load_monitor_config(path, logger)
+        patterns = config.get("policies", ["*"])
+        batch_size = max(config.get("batch_size", 5), 1)
+        limiter = RateLimiter(config.get("requests_per_second", 5))
+        managed_names = set()
+        if config.get("auto_tune", {}).get("enabled", False):
+            managed_names = managed_replication_names(path, logger)
+
+        policies = [
+            policy
+            async for policy in iter_models(
+                client, ReplicationPolicy, "/replication/policies"
+            )
+            if any(fnmatch.fnmatchcase(policy.name, p) for p in patterns)
+        ]
+
+        failed = 0
+        for start in range(0, len(policies), batch_size):
+            batch = policies[start : start + batch_size]
+            results = await asyncio.gather(
+                *(
+                    monitor_policy(
+                        client,
+                        policy,
+                        config,
+                        limiter,
+                        logger,
+                        policy.name in managed_names,
+                    )
+                    for policy in batch
+                ),
+                return_exceptions=True,
+            )
+            for policy, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    failed += 1
+                    logger.error(
+                        "Failed to monitor replication policy",
+                        extra={"replication": policy.name, "error": str(result)},
+                    )
+
+        logger.info(
+            "Replication monitoring completed",
+            extra={"policy_count": len(policies), "failed": failed},
+        )
+
+    except Exception as e:
+        logger.error("Replication monitoring failed", extra={"error": str(e)})
+        raise
@@ -1,8 +1,34 @@
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, NamedTuple, Optional
 from logging import Logger
 import json
 
 from utils import fill_template
+from pagination import iter_records
+from reconciler import Reconciler, record_matches
+
+# Settings kept from Harbor when omitted in the config, e.g. set by the
+# replication monitor's auto-tuning
+TUNABLE_FIELDS = ("speed", "copy_by_chunk")
+
+
+class ReplicationRecord(NamedTuple):
+    """Fields of a listed replication rule the synchronization needs."""
+
+    id: int
+    name: str
+    description: Optional[str]
+    src_registry: Optional[Dict[str, Any]]
+    dest_registry: Optional[Dict[str, Any]]
+    dest_namespace: Optional[str]
+    dest_namespace_replace_count: Optional[int]
+    trigger: Optional[Dict[str, Any]]
+    filters: Optional[List[Dict[str, Any]]]
+    replicate_deletion: Optional[bool]
+    deletion: Optional[bool]
+    override: Optional[bool]
+    enabled: Optional[bool]
+    speed: Optional[int]
+    copy_by_chunk: Optional[bool]
 
 
 async def load_replication_configs(
@@ -33,95 +59,50 @@ async def load_replication_configs(
         raise
 
 
-async def delete_unused_replications(
-    client: Any,
-    current_replications: List[Any],
-    target_replication_names: Set[str],
-    logger: Logger,
-) -> None:
-    """Delete replication rules that exist in Harbor but not in config.
+def replication_reconciler(client: Any) -> Reconciler:
+    """Build the reconciler of the Harbor replication rules.
 
-    Args:
-        client: Harbor API client instance
-        current_replications: List of current replication rules
-        target_replication_names: Set of replication names from target configuration
-        logger: Logger instance
-
-    Raises:
-        Exception: If deletion of any replication rule fails
-    """
-    for current_replication in current_replications:
-        if current_replication.name not in target_replication_names:
-            try:
-                logger.info(
-                    "Deleting replication rule as it is not defined in config",
-                    extra={"replication": current_replication.name},
-                )
-                await client.delete_replication_policy(policy_id=current_replication.id)
-            except Exception as e:
-                logger.error(
-                    "Failed to delete replication rule",
-                    extra={"replication": current_replication.name, "error": str(e)},
-                )
-                raise
-
-
-async def process_single_replication(
-    client: Any,
-    target_replication: Dict[str, Any],
-    current_replications: List[Any],
-    logger: Logger,
-) -> None:
-    """Process a single replication rule, either updating existing or creating new.
+    Rules whose configured fields match are not updated, updates keep the
+    TUNABLE_FIELDS of a rule the configuration omits.
 
     Args:
         client: Harbor API client instance
-        target_replication: Replication rule configuration
-        current_replications: List of current replication rules
-        logger: Logger instance
 
-    Raises:
-        KeyError: If required fields are missing from replication configuration
-        Exception: If any Harbor API operation fails
+    Returns:
+        Reconciler: Reconciler of the replication rules keyed by name
     """
-    try:
-        target_replication_name = target_replication["name"]
-        current_replication_names = [repl.name for repl in current_replications]
-
-        if target_replication_name in current_replication_names:
-            # Update existing replication
-            replication_id = current_replications[
-                current_replication_names.index(target_replication_name)
-            ].id
-            logger.info(
-                "Updating existing replication rule",
-                extra={"replication": target_replication_name},
-            )
-            await client.update_replication_policy(
-                policy_id=replication_id, policy=target_replication
-            )
-        else:
-            # Create new replication
-            logger.info(
-                "Creating new replication rule",
-                extra={"replication": target_replication_name},
-            )
-            await client.create_replication_policy(policy=target_replication)
-    except KeyError as e:
-        logger.error(
-            "Invalid replication configuration",
-            extra={
-                "replication": target_replication,
-                "error": f"Missing required field: {str(e)}",
+
+    async def update_replication(
+        current: ReplicationRecord, target_replication: Dict[str, Any]
+    ) -> None:
+        target_replication = {
+            **{
+                field: getattr(current, field)
+                for field in TUNABLE_FIELDS
+                if getattr(current, field) is not None
             },
+            **target_replication,
+        }
+        await client.update_replication_policy(
+            policy_id=current.id, policy=target_replication
         )
-        raise
-    except Exception as e:
-        logger.error(
-            "Failed to process replication rule",
-            extra={"replication": target_replication_name, "error": str(e)},
-        )
-        raise
+
+    return Reconciler(
+        stage="replications",
+        resource="replication rule",
+        log_field="replication",
+        list_current=lambda: iter_records(
+            client, ReplicationRecord, "/replication/policies"
+        ),
+        key=lambda repl: repl.name,
+        desired_key=lambda repl: repl["name"],
+        create=lambda target_replication: client.create_replication_policy(
+            policy=target_replication
+        ),
+        update=update_replication,
+        delete=lambda repl: client.delete_replication_policy(policy_id=repl.id),
+        in_sync=record_matches,
+    )
 
 
 async def sync_replications(client: Any, path: str, logger: Logger) -> None:
@@ -129,10 +110,12 @@ async def sync_replications(client: Any, path: str, logger: Logger) -> None:
 
     This function performs the following operations:
     1. Loads replication configurations from template file
-    2. Retrieves existing replication rules from Harbor
+    2. Streams existing replication rules from Harbor across all pages
     3. Deletes rules that exist in Harbor but not in config
     4. Updates existing rules or creates new ones based on config
 
+    Rules are written concurrently, see ``Reconciler``.
+
     Args:
         client: Harbor API client instance
         path: Path to the replication configuration file
@@ -150,28 +133,8 @@ async def sync_replications(client: Any, path: str, logger: Logger) -> None:
         # Load replication configurations
         target_replications = await load_replication_configs(client, path, logger)
 
-        # Get current replications from Harbor
-        try:
-            current_replications = await client.get_replication_policies()
-        except Exception as e:
-            logger.error(
-                "Failed to fetch existing replications", extra={"error": str(e)}
-            )
-            raise
-
-        # Create set of target replication names
-        target_replication_names = {repl["name"] for repl in target_replications}
-
-        # Delete replications not in config
-        await delete_unused_replications(
-            client, current_replications, target_replication_names, logger
-        )
-
-        # Update or create replications
-        for target_replication in target_replications:
-            await process_single_replication(
-                client, target_replication, current_replications, logger
-            )
+        # Delete, update and create replications to match the config
+        await replication_reconciler(client).reconcile(target_replications, logger)
 
         logger.info("Replication rule synchronization completed successfully")
 
@@ -1,13 +1,135 @@
+import asyncio
 import json
-from typing import Any, Dict, List
+import os
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
 from logging import Logger
+
 from harborapi.exceptions import NotFound
+from harborapi.models import RetentionPolicy
 
 from utils import fill_template
+from pagination import iter_records
+from incremental import handles_project
+from apply import apply_operations
+
+# Maximum number of retention policies created or updated at the same time
+RETENTION_CONCURRENCY = int(os.environ.get("RETENTION_CONCURRENCY", "8"))
+
+
+class ProjectRecord(NamedTuple):
+    """Fields of a listed project needed to find its retention policy."""
+
+    project_id: int
+    name: str
+    metadata: Optional[Dict[str, Any]]
+
+
+async def load_project_retention_ids(
+    client: Any, logger: Logger
+) -> Tuple[Dict[str, int], Dict[int, Optional[int]]]:
+    """Resolve project IDs and retention IDs from a single project listing.
+
+    Args:
+        client: Harbor API client instance
+        logger: Logger instance
+
+    Returns:
+        Tuple of a map of project names to IDs and a map of project IDs to
+        retention IDs (None if the project has no retention policy)
+    """
+    project_ids: Dict[str, int] = {}
+    retention_ids: Dict[int, Optional[int]] = {}
+    async for project in iter_records(client, ProjectRecord, "/projects"):
+        retention_id = (project.metadata or {}).get("retention_id")
+        project_ids[project.name] = project.project_id
+        retention_ids[project.project_id] = (
+            int(retention_id) if retention_id is not None else None
+        )
+    logger.info(
+        "Resolved project retention ids", extra={"project_count": len(project_ids)}
+    )
+    return project_ids, retention_ids
+
+
+def retention_projection(policy: Any) -> Dict[str, Any]:
+    """Project a retention policy onto the fields managed by the config.
+
+    Server-assigned rule IDs and priorities, trigger references and empty or
+    disabled-by-default rule fields are left out, so a policy read from Harbor
+    compares equal to its configuration.
+
+    Args:
+        policy: Retention policy as dictionary or model
+
+    Returns:
+        Dict[str, Any]: Algorithm, rules and trigger of the policy
+    """
+    if not isinstance(policy, RetentionPolicy):
+        policy = RetentionPolicy.model_validate(policy)
+    dumped = policy.model_dump(mode="json", exclude_none=True)
+    rules = [
+        {
+            key: value
+            for key, value in rule.items()
+            if key not in ("id", "priority")
+            and value not in ({}, [])
+            and value is not False
+        }
+        for rule in dumped.get("rules", [])
+    ]
+    trigger = {
+        key: value
+        for key, value in dumped.get("trigger", {}).items()
+        if key != "references"
+    }
+    return {"algorithm": dumped.get("algorithm"), "rules": rules, "trigger": trigger}
+
+
+async def load_retention_projections(
+    client: Any, retention_ids: Iterable[int], logger: Logger
+) -> Dict[int, Optional[Dict[str, Any]]]:
+    """Fetch the referenced retention policies and keep their projections.
+
+    Harbor has no listing of retention policies, so the policies are fetched
+    concurrently, at most RETENTION_CONCURRENCY at a time, before any write.
+
+    Args:
+        client: Harbor API client instance
+        retention_ids: Retention IDs referenced by the configured projects
+        logger: Logger instance
+
+    Returns:
+        Map of retention IDs to the projection of their policy, None if the
+        referenced policy no longer exists
+    """
+    semaphore = asyncio.Semaphore(max(RETENTION_CONCURRENCY, 1))
+
+    async def fetch_projection(
+        retention_id: int,
+    ) -> Tuple[int, Optional[Dict[str, Any]]]:
+        async with semaphore:
+            try:
+                policy = await client.get_retention_policy(retention_id)
+            except NotFound:
+                logger.warning(
+                    "Retention policy not found, creating a new one",
+                    extra={"retention_id": retention_id},
+                )
+                return retention_id, None
+        return retention_id, retention_projection(policy)
+
+    return dict(
+        await asyncio.gather(
+            *(fetch_projection(retention_id) for retention_id in set(retention_ids))
+        )
+    )
 
 
 async def load_retention_policies(
-    client: Any, path: str, logger: Logger
+    client: Any,
+    path: str,
+    logger: Logger,
+    project_ids: Optional[Dict[str, int]] = None,
 ) -> List[Dict[str, Any]]:
     """Load and parse retention policies from template file.
 
@@ -15,6 +137,7 @@ async def load_retention_policies(
         client: Harbor API client instance
         path: Path to the retention policies template file
         logger: Logger instance
+        project_ids: Optional map of project names to IDs for the templates
 
     Returns:
         List of retention policy configurations
@@ -24,7 +147,9 @@ async def load_retention_policies(
         json.JSONDecodeError: If the template content is not valid JSON
     """
     try:
-        retention_policies_string = await fill_template(client, path, logger)
+        retention_policies_string = await fill_template(
+            client, path, logger, project_ids
+        )
         return json.loads(retention_policies_string)
     except FileNotFoundError as e:
         logger.error(
@@ -41,44 +166,55 @@ async def load_retention_policies(
 
 
 async def process_single_policy(
-    client: Any, policy: Dict[str, Any], logger: Logger
+    client: Any,
+    policy: Dict[str, Any],
+    retention_ids: Dict[int, Optional[int]],
+    projections: Dict[int, Optional[Dict[str, Any]]],
+    logger: Logger,
 ) -> None:
     """Process a single retention policy, either updating existing or creating new.
 
+    Existing policies are only updated if their rules or trigger differ from
+    the configuration. A project referencing a policy that no longer exists
+    gets a new one.
+
     Args:
         client: Harbor API client instance
         policy: Retention policy configuration
+        retention_ids: Map of project IDs to retention IDs
+        projections: Map of retention IDs to the projection of their policy,
+            see ``load_retention_projections``
         logger: Logger instance
 
     Raises:
         KeyError: If required fields are missing from policy configuration
         Exception: If any Harbor API operation fails
     """
+    project_id = None
     try:
         project_id = policy["scope"]["ref"]
+        retention_id = retention_ids.get(project_id)
 
-        try:
-            # Try to update existing policy
-            retention_id = await client.get_project_retention_id(project_id)
-            logger.info(
-                "Updating existing retention policy",
-                extra={"project_id": project_id, "retention_id": retention_id},
-            )
-            await client.update_retention_policy(retention_id, policy)
-
-        except NotFound as e:
+        if retention_id is None or projections.get(retention_id) is None:
             # Create new policy if one doesn't exist
             logger.info(
                 "Creating new retention policy", extra={"project_id": project_id}
             )
             await client.create_retention_policy(policy)
-        except Exception as e:
-            # Re-raise unexpected errors
-            logger.error(
-                "Failed to get retention policy ID",
-                extra={"project_id": project_id, "error": str(e)},
+            return
+
+        if projections[retention_id] == retention_projection(policy):
+            logger.info(
+                "Retention policy is up to date",
+                extra={"project_id": project_id, "retention_id": retention_id},
             )
-            raise
+            return
+
+        logger.info(
+            "Updating existing retention policy",
+            extra={"project_id": project_id, "retention_id": retention_id},
+        )
+        await client.update_retention_policy(retention_id, policy)
 
     except KeyError as e:
         logger.error(
@@ -100,6 +236,9 @@ async def sync_retention_policies(client: Any, path: str, logger: Logger) -> Non
     This function reads retention policies from a template file and either updates
     existing policies or creates new ones in Harbor. The template file can contain
     project references that will be resolved using the fill_template utility.
+    Project IDs and retention IDs are resolved from a single project listing,
+    the existing policies are fetched concurrently and policies are processed
+    with bounded concurrency.
 
     Args:
         client: Harbor API client instance
@@ -109,17 +248,55 @@ async def sync_retention_policies(client: Any, path: str, logger: Logger) -> Non
     Raises:
         FileNotFoundError: If the template file does not exist
         json.JSONDecodeError: If the template content is not valid JSON
+        ApplyError: If creating or updating any policy failed
         Exception: If any Harbor API operation fails
     """
     logger.info("Starting retention policy synchronization")
 
     try:
+        # Resolve project and retention IDs from one project listing
+        project_ids, retention_ids = await load_project_retention_ids(client, logger)
+
         # Load and parse retention policies from template
-        retention_policies = await load_retention_policies(client, path, logger)
+        retention_policies = await load_retention_policies(
+            client, path, logger, project_ids
+        )
+
+        # Only handle the projects assigned to this replica and run
+        project_names = {project_id: name for name, project_id in project_ids.items()}
+        retention_policies = [
+            policy
+            for policy in retention_policies
+            if handles_project(project_names.get(policy["scope"]["ref"], ""))
+        ]
 
-        # Process each retention policy
-        for policy in retention_policies:
-            await process_single_policy(client, policy, logger)
+        # Fetch the existing policies before any write
+        projections = await load_retention_projections(
+            client,
+            (
+                retention_ids[policy["scope"]["ref"]]
+                for policy in retention_policies
+                if retention_ids.get(policy["scope"]["ref"]) is not None
+            ),
+            logger,
+        )
+
+        # Process retention policies with bounded concurrency, failures are
+        # raised together once all policies are done
+        await apply_operations(
+            "retention-policies",
+            (
+                (
+                    policy["scope"]["ref"],
+                    lambda policy=policy: process_single_policy(
+                        client, policy, retention_ids, projections, logger
+                    ),
+                )
+                for policy in retention_policies
+            ),
+            logger,
+            RETENTION_CONCURRENCY,
+        )
 
         logger.info("Retention policy synchronization completed successfully")
 
@@ -0,0 +1,445 @@
+"""Harbor tag retention simulator module.
+
+This module evaluates the rules of ``retention-policies.json`` locally against
+streamed repository and artifact listings and reports which artifacts each
+policy would delete, without triggering a dry run on the Harbor server.
+"""
+
+import json
+import re
+import sys
+from array import array
+from datetime import datetime, timezone
+from functools import lru_cache
+from logging import Logger
+from typing import Any, Dict, IO, List, Optional, Pattern, Tuple
+
+from harborapi.utils import get_repo_path
+
+from pagination import iter_pages
+from retention_policies import load_project_retention_ids, load_retention_policies
+
+SECONDS_PER_DAY = 86400
+
+
+class ArtifactBatch:
+    """Columnar batch of the artifacts of a single repository.
+
+    Artifacts are stored column by column in compact arrays instead of one
+    object per artifact, so large repositories fit in memory.
+    """
+
+    __slots__ = ("digests", "tags", "sizes", "push_times", "pull_times")
+
+    def __init__(self):
+        """Initialize an empty batch."""
+        self.digests: List[str] = []
+        self.tags: List[Tuple[str, ...]] = []
+        self.sizes = array("q")
+        self.push_times = array("d")
+        self.pull_times = array("d")
+
+    def __len__(self) -> int:
+        """Return the number of artifacts in the batch."""
+        return len(self.digests)
+
+    def append(self, artifact: Dict[str, Any]) -> None:
+        """Append an artifact from a raw Harbor artifact listing.
+
+        Args:
+            artifact: Artifact JSON object
+        """
+        self.digests.append(artifact.get("digest", ""))
+        self.tags.append(
+            tuple(tag["name"] for tag in artifact.get("tags") or [] if tag.get("name"))
+        )
+        self.sizes.append(artifact.get("size") or 0)
+        self.push_times.append(parse_timestamp(artifact.get("push_time")))
+        self.pull_times.append(parse_timestamp(artifact.get("pull_time")))
+
+
+def parse_timestamp(value: Optional[str]) -> float:
+    """Parse a Harbor timestamp into seconds since the epoch.
+
+    Args:
+        value: ISO 8601 timestamp, Harbor uses 0001-01-01 for "never"
+
+    Returns:
+        float: Seconds since the epoch, 0 if the value is missing
+    """
+    if not value:
+        return 0.0
+    try:
+        timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return max(timestamp.timestamp(), 0.0)
+
+
+@lru_cache(maxsize=None)
+def compile_doublestar(pattern: str) -> Pattern[str]:
+    """Compile a doublestar pattern as used by Harbor selectors.
+
+    ``**`` matches across path separators, ``*`` and ``?`` within a path
+    segment and ``{a,b}`` matches one of the alternatives.
+
+    Args:
+        pattern: Doublestar pattern
+
+    Returns:
+        Pattern[str]: Compiled regular expression
+    """
+    regex = []
+    index = 0
+    depth = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**", index):
+            regex.append(".*")
+            index += 2
+            continue
+        if char == "*":
+            regex.append("[^/]*")
+        elif char == "?":
+            regex.append("[^/]")
+        elif char == "{":
+            regex.append("(?:")
+            depth += 1
+        elif char == "}" and depth:
+            regex.append(")")
+            depth -= 1
+        elif char == "," and depth:
+            regex.append("|")
+        else:
+            regex.append(re.escape(char))
+        index += 1
+    return re.compile("".join(regex) + "\\Z")
+
+
+def selector_matches(selector: Dict[str, Any], value: str) -> bool:
+    """Check whether a value is selected by a single Harbor selector.
+
+    Args:
+        selector: Selector with ``decoration`` and ``pattern``
+        value: Repository name or tag
+
+    Returns:
+        bool: True if the value is selected
+    """
+    matched = bool(compile_doublestar(selector.get("pattern", "**")).match(value))
+    if selector.get("decoration", "").lower().endswith("excludes"):
+        return not matched
+    return matched
+
+
+def tag_selector_matches(selector: Dict[str, Any], tags: Tuple[str, ...]) -> bool:
+    """Check whether an artifact is selected by a tag selector.
+
+    Untagged artifacts are only selected if the selector's ``extras`` enable
+    ``untagged``.
+
+    Args:
+        selector: Tag selector
+        tags: Tags of the artifact
+
+    Returns:
+        bool: True if the artifact is selected
+    """
+    if not tags:
+        extras = json.loads(selector.get("extras") or "{}")
+        return bool(extras.get("untagged"))
+    if selector.get("decoration", "").lower().endswith("excludes"):
+        return all(selector_matches(selector, tag) for tag in tags)
+    return any(selector_matches(selector, tag) for tag in tags)
+
+
+def enabled_retain_rules(policy: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the rules of a policy Harbor evaluates.
+
+    Args:
+        policy: Retention policy
+
+    Returns:
+        List[Dict[str, Any]]: Enabled retain rules
+    """
+    return [
+        rule
+        for rule in policy.get("rules", [])
+        if not rule.get("disabled") and rule.get("action", "retain") == "retain"
+    ]
+
+
+def repository_selected(rule: Dict[str, Any], repository: str) -> bool:
+    """Check whether a rule's repository selectors select a repository.
+
+    Args:
+        rule: Retention rule
+        repository: Repository name without the project prefix
+
+    Returns:
+        bool: True if all repository selectors of the rule match
+    """
+    repository_selectors = rule.get("scope_selectors", {}).get("repository", [])
+    return all(selector_matches(s, repository) for s in repository_selectors)
+
+
+def policy_selects(policy: Dict[str, Any], repository: str) -> bool:
+    """Check whether Harbor processes a repository for a policy.
+
+    Args:
+        policy: Retention policy
+        repository: Repository name without the project prefix
+
+    Returns:
+        bool: True if any enabled retain rule selects the repository
+    """
+    return any(
+        repository_selected(rule, repository) for rule in enabled_retain_rules(policy)
+    )
+
+
+def select_candidates(
+    rule: Dict[str, Any], repository: str, batch: ArtifactBatch
+) -> List[int]:
+    """Return the indices of the artifacts a rule applies to.
+
+    Args:
+        rule: Retention rule
+        repository: Repository name without the project prefix
+        batch: Artifacts of the repository
+
+    Returns:
+        List[int]: Indices of the selected artifacts
+    """
+    if not repository_selected(rule, repository):
+        return []
+    tag_selectors = rule.get("tag_selectors", [])
+    return [
+        index
+        for index in range(len(batch))
+        if all(tag_selector_matches(s, batch.tags[index]) for s in tag_selectors)
+    ]
+
+
+def retained_by_rule(
+    rule: Dict[str, Any], candidates: List[int], batch: ArtifactBatch, now: float
+) -> List[int]:
+    """Evaluate the template of a retain rule on its candidates.
+
+    Args:
+        rule: Retention rule
+        candidates: Indices of the artifacts selected by the rule
+        batch: Artifacts of the repository
+        now: Current time in seconds since the epoch
+
+    Returns:
+        List[int]: Indices of the retained artifacts
+
+    Raises:
+        ValueError: If the rule uses an unsupported template
+    """
+    template = rule.get("template", "always")
+    param = (rule.get("params") or {}).get(template)
+
+    if template == "always":
+        return candidates
+    if template == "nothing":
+        return []
+    if template == "latestPushedK":
+        return sorted(candidates, key=lambda i: batch.push_times[i], reverse=True)[
+            : int(param)
+        ]
+    if template == "latestPulledN":
+        return sorted(candidates, key=lambda i: batch.pull_times[i], reverse=True)[
+            : int(param)
+        ]
+    if template == "latestActiveK":
+        return sorted(
+            candidates,
+            key=lambda i: max(batch.push_times[i], batch.pull_times[i]),
+            reverse=True,
+        )[: int(param)]
+    if template == "nDaysSinceLastPush":
+        threshold = now - float(param) * SECONDS_PER_DAY
+        return [i for i in candidates if batch.push_times[i] >= threshold]
+    if template == "nDaysSinceLastPull":
+        threshold = now - float(param) * SECONDS_PER_DAY
+        return [i for i in candidates if batch.pull_times[i] >= threshold]
+    raise ValueError(f"Unsupported retention template: {template}")
+
+
+def evaluate_repository(
+    policy: Dict[str, Any], repository: str, batch: ArtifactBatch, now: float
+) -> List[int]:
+    """Evaluate a retention policy on the artifacts of one repository.
+
+    Harbor only processes repositories selected by at least one enabled
+    retain rule. In those it retains the union of the artifacts retained by
+    all enabled rules and deletes every other artifact of the repository.
+
+    Args:
+        policy: Retention policy
+        repository: Repository name without the project prefix
+        batch: Artifacts of the repository
+        now: Current time in seconds since the epoch
+
+    Returns:
+        List[int]: Indices of the artifacts that would be deleted
+    """
+    if not policy_selects(policy, repository):
+        return []
+    retained = set()
+    for rule in enabled_retain_rules(policy):
+        candidates = select_candidates(rule, repository, batch)
+        retained.update(retained_by_rule(rule, candidates, batch, now))
+    return [index for index in range(len(batch)) if index not in retained]
+
+
+async def load_artifact_batch(
+    client: Any, project_name: str, repository: str
+) -> ArtifactBatch:
+    """Stream the artifacts of a repository into a columnar batch.
+
+    Args:
+        client: Harbor API client instance
+        project_name: Name of the project
+        repository: Repository name without the project prefix
+
+    Returns:
+        ArtifactBatch: Artifacts of the repository
+    """
+    batch = ArtifactBatch()
+    path = f"{get_repo_path(project_name, repository)}/artifacts"
+    params = {"with_tag": "true", "with_label": "false", "with_scan_overview": "false"}
+    async for artifacts in iter_pages(client, path, params):
+        for artifact in artifacts:
+            batch.append(artifact)
+    return batch
+
+
+async def simulate_project(
+    client: Any,
+    project_name: str,
+    policy: Dict[str, Any],
+    now: float,
+    output: IO[str],
+) -> Dict[str, Any]:
+    """Simulate a retention policy on every repository of a project.
+
+    One report line is written per repository with deletions. Repositories
+    no enabled retain rule selects are skipped without listing their
+    artifacts, Harbor leaves them untouched.
+
+    Args:
+        client: Harbor API client instance
+        project_name: Name of the project
+        policy: Retention policy
+        now: Current time in seconds since the epoch
+        output: Stream the report lines are written to
+
+    Returns:
+        Dict[str, Any]: Summary of the project
+    """
+    summary = {
+        "project": project_name,
+        "repositories": 0,
+        "artifacts": 0,
+        "deleted_count": 0,
+        "reclaimable_bytes": 0,
+    }
+    async for repositories in iter_pages(
+        client, f"/projects/{project_name}/repositories"
+    ):
+        for repo in repositories:
+            repository = repo["name"].split("/", 1)[-1]
+            if not policy_selects(policy, repository):
+                continue
+            batch = await load_artifact_batch(client, project_name, repository)
+            deleted = evaluate_repository(policy, repository, batch, now)
+
+            reclaimable_bytes = sum(batch.sizes[i] for i in deleted)
+            summary["repositories"] += 1
+            summary["artifacts"] += len(batch)
+            summary["deleted_count"] += len(deleted)
+            summary["reclaimable_bytes"] += reclaimable_bytes
+
+            if deleted:
+                output.write(
+                    json.dumps(
+                        {
+                            "project": project_name,
+                            "repository": repository,
+                            "artifacts": len(batch),
+                            "reclaimable_bytes": reclaimable_bytes,
+                            "deleted": [
+                                {
+                                    "digest": batch.digests[i],
+                                    "tags": list(batch.tags[i]),
+                                    "size": batch.sizes[i],
+                                }
+                                for i in deleted
+                            ],
+                        }
+                    )
+                    + "\n"
+                )
+    return summary
+
+
+async def simulate_retention(
+    client: Any, path: str, logger: Logger, output: Optional[IO[str]] = None
+) -> List[Dict[str, Any]]:
+    """Simulate the retention policies of a configuration file locally.
+
+    The report is written as JSON lines: one line per repository listing the
+    artifacts that would be deleted, followed by one summary line per project.
+    Reclaimable bytes are the summed artifact sizes; blobs shared with
+    retained artifacts are only freed by garbage collection if unreferenced.
+
+    Args:
+        client: Harbor API client instance
+        path: Path to the retention policies template file
+        logger: Logger instance for recording operations
+        output: Stream the report is written to, stdout by default
+
+    Returns:
+        List[Dict[str, Any]]: Summary per project
+
+    Raises:
+        FileNotFoundError: If the template file does not exist
+        json.JSONDecodeError: If the template content is not valid JSON
+        Exception: If any Harbor API operation fails
+    """
+    output = output or sys.stdout
+    logger.info("Starting retention simulation")
+
+    project_ids, _ = await load_project_retention_ids(client, logger)
+    project_names = {project_id: name for name, project_id in project_ids.items()}
+    policies = await load_retention_policies(client, path, logger, project_ids)
+
+    now = datetime.now(timezone.utc).timestamp()
+    summaries = []
+    for policy in policies:
+        project_id = policy["scope"]["ref"]
+        project_name = project_names.get(project_id)
+        if project_name is None:
+            logger.warning(
+                "Skipping retention policy of unknown project",
+                extra={"project_id": project_id},
+            )
+            continue
+        logger.info("Simulating retention policy", extra={"project": project_name})
+        summary = await simulate_project(client, project_name, policy, now, output)
+        output.write(json.dumps({"summary": True, **summary}) + "\n")
+        summaries.append(summary)
+
+    logger.info(
+        "Retention simulation completed",
+        extra={
+            "project_count": len(summaries),
+            "reclaimable_bytes": sum(s["reclaimable_bytes"] for s in summaries),
+        },
+    )
+    return summaries
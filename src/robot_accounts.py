@@ -1,17 +1,45 @@
 import json
-import os
-from typing import List, Dict, Any, Tuple
+from typing import AsyncIterator, List, Dict, Any, NamedTuple, Optional, Type
 from logging import Logger
 
 from harborapi.models import Robot
 from harborapi.exceptions import Conflict, BadRequest
 
 from utils import load_json
+from instance import getenv
+from pagination import iter_models, iter_records
+from incremental import handles_entry
+from reconciler import Reconciler, record_matches
+from configuration import (
+    secret_changed,
+    secret_fingerprint,
+    store_secret_fingerprints,
+)
 
 
-ROBOT_NAME_PREFIX = os.environ.get("ROBOT_NAME_PREFIX", "")
 HARBOR_BUILD_PREFIX = "build."
 ROBOT_NAME_PROJECT_SUFFIX = "+"
+# Configured robot fields not compared with the listed robot: Harbor changes
+# the name and never returns the secret
+UNCOMPARED_FIELDS = ("name", "secret")
+
+
+class RobotRecord(NamedTuple):
+    """Fields of a listed robot account the synchronization needs."""
+
+    id: int
+    name: str
+    description: Optional[str]
+    duration: Optional[int]
+    disable: Optional[bool]
+    level: Optional[str]
+    permissions: Optional[List[Dict[str, Any]]]
+
+
+class ProjectIdRecord(NamedTuple):
+    """Fields of a listed project needed to list its robot accounts."""
+
+    project_id: int
 
 
 def load_target_robots(path: str, logger: Logger) -> List[Dict[str, Any]]:
@@ -37,35 +65,6 @@ def load_target_robots(path: str, logger: Logger) -> List[Dict[str, Any]]:
         raise
 
 
-def prepare_target_robots(
-    target_robots: List[Dict[str, Any]], logger: Logger
-) -> List[Tuple[str, Dict[str, Any]]]:
-    """Prepare target robots by constructing their full names.
-
-    Args:
-        target_robots: List of robot configurations
-        logger: Logger instance
-
-    Returns:
-        List of tuples containing (name, robot_config)
-
-    Raises:
-        KeyError: If required fields are missing from robot configuration
-    """
-    target_robots_with_names = []
-    for target_robot in target_robots:
-        try:
-            name = target_robot["name"]
-            target_robots_with_names.append((name, target_robot))
-        except KeyError as e:
-            logger.error(
-                "Invalid robot configuration",
-                extra={"robot": target_robot, "error": f"Missing field: {str(e)}"},
-            )
-            raise
-    return target_robots_with_names
-
-
 def normalize_robot_name_for_comparison(robot_name: str) -> str:
     """Normalize robot name for comparison by removing Harbor's automatic build prefix.
 
@@ -81,117 +80,111 @@ def normalize_robot_name_for_comparison(robot_name: str) -> str:
     """
     if robot_name.startswith(HARBOR_BUILD_PREFIX):
         robot_name = robot_name[len(HARBOR_BUILD_PREFIX) :]
-    if robot_name.startswith(ROBOT_NAME_PREFIX):
-        robot_name = robot_name[len(ROBOT_NAME_PREFIX) :]
+    robot_name_prefix = getenv("ROBOT_NAME_PREFIX", "")
+    if robot_name.startswith(robot_name_prefix):
+        robot_name = robot_name[len(robot_name_prefix) :]
     _, sep, tail = robot_name.partition(ROBOT_NAME_PROJECT_SUFFIX)
     return tail if sep else robot_name
 
 
-async def delete_unused_robots(
-    client: Any,
-    current_robot_map: Dict[str, Any],
-    target_robot_names: set,
-    logger: Logger,
-) -> None:
-    """Delete robots that exist in Harbor but not in config.
+def robot_secret_key(robot_name: str) -> str:
+    """Return the name the fingerprint of a robot's secret is kept under.
+
+    Args:
+        robot_name: Name of the robot, with or without Harbor's prefixes
+
+    Returns:
+        str: Name of the fingerprint
+    """
+    return f"robot:{normalize_robot_name_for_comparison(robot_name)}"
 
-    Harbor automatically adds 'build.' prefix to robot account names, so we normalize
-    robot names before comparison to prevent unnecessary deletions.
+
+def robot_secret_changed(target_config: Dict[str, Any]) -> bool:
+    """Check whether the configured secret of a robot was not applied yet.
 
     Args:
-        client: Harbor API client instance
-        current_robot_map: Map of current robot names to their configurations
-        target_robot_names: Set of robot names from target configuration
-        logger: Logger instance
+        target_config: Robot configuration
 
-    Raises:
-        Exception: If deletion of any robot fails
+    Returns:
+        bool: True if a secret is configured and its fingerprint is not the
+        one of the last applied secret
     """
-    # Create normalized target robot names for comparison
-    normalized_target_robot_names = {
-        normalize_robot_name_for_comparison(name) for name in target_robot_names
-    }
-
-    for robot_name, robot in current_robot_map.items():
-        # Normalize current robot name for comparison
-        normalized_current_robot_name = normalize_robot_name_for_comparison(robot_name)
-
-        if normalized_current_robot_name not in normalized_target_robot_names:
-            try:
-                logger.info("Deleting robot not in config", extra={"robot": robot_name})
-                await client.delete_robot(robot_id=robot.id)
-            except Exception as e:
-                logger.error(
-                    "Failed to delete robot",
-                    extra={"robot": robot_name, "error": str(e)},
-                )
-                raise
-
-
-async def process_single_robot(
-    client: Any,
-    full_name: str,
-    target_config: Dict[str, Any],
-    current_robot_map: Dict[str, Any],
-    logger: Logger,
-) -> None:
-    """Process a single robot account, either updating existing or creating new.
+    secret = target_config.get("secret")
+    return bool(secret) and secret_changed(
+        robot_secret_key(target_config["name"]), secret
+    )
+
+
+def robot_up_to_date(current: RobotRecord, target_config: Dict[str, Any]) -> bool:
+    """Check whether a robot account needs no update.
 
     Args:
-        client: Harbor API client instance
-        full_name: Full name of the robot account
+        current: Robot as listed by Harbor
         target_config: Robot configuration
-        current_robot_map: Map of current robot names to their configurations
-        logger: Logger instance
 
-    Raises:
-        Exception: If processing of robot configuration fails
+    Returns:
+        bool: True if the configured fields match and the secret was applied
+        before
     """
-    try:
-        target_robot = Robot(**target_config)
-        target_robot.name = full_name
+    return record_matches(
+        current, target_config, UNCOMPARED_FIELDS
+    ) and not robot_secret_changed(target_config)
 
-        # Check if robot exists by comparing normalized names
-        existing_robot = None
-        normalized_target_robot_name = normalize_robot_name_for_comparison(full_name)
 
-        for current_robot_name, current_robot in current_robot_map.items():
-            normalized_current_robot_name = normalize_robot_name_for_comparison(
-                current_robot_name
-            )
-            if normalized_current_robot_name == normalized_target_robot_name:
-                existing_robot = current_robot
-                break
-
-        if existing_robot:
-            # Use the existing robot's actual name for updates
-            target_robot.name = existing_robot.name  # Don't change the name
-            robot_id = existing_robot.id
-            logger.info(
-                "Updating existing robot",
-                extra={"robot": existing_robot.name, "robot_id": robot_id},
+def robot_reconciler(client: Any, logger: Logger) -> Reconciler:
+    """Build the reconciler of the Harbor robot accounts.
+
+    Harbor automatically adds 'build.' prefix to robot account names, so robots
+    are keyed by their normalized names to prevent unnecessary deletions.
+    Updates keep the robot's actual name. Robots whose configured fields
+    match are not updated, and secrets are only set if they changed.
+
+    Args:
+        client: Harbor API client instance
+        logger: Logger instance
+
+    Returns:
+        Reconciler: Reconciler of the system and project level robots
+    """
+
+    async def update_robot(current: RobotRecord, target_config: Dict[str, Any]) -> None:
+        if not record_matches(current, target_config, UNCOMPARED_FIELDS):
+            target_robot = Robot(**target_config)
+            target_robot.name = current.name  # Don't change the name
+            await client.update_robot(robot_id=current.id, robot=target_robot)
+        if robot_secret_changed(target_config):
+            await set_robot_secret(
+                client, target_config, current.id, current.name, logger
             )
-            await client.update_robot(robot_id=robot_id, robot=target_robot)
-            await set_robot_secret(client, target_config, robot_id, existing_robot.name, logger)
-        else:
-            # Create new robot
-            try:
-                logger.info("Creating new robot", extra={"robot": full_name})
-                created_robot = await client.create_robot(robot=target_robot)
-                await set_robot_secret(client, target_config, created_robot.id, created_robot.name, logger)
-            except (Conflict, BadRequest) as e:
-                logger.error(
-                    "Failed to create robot",
-                    extra={"robot": full_name, "error": str(e)},
-                )
-                return
 
-    except Exception as e:
-        logger.error(
-            "Failed to process robot configuration",
-            extra={"robot": full_name, "error": str(e)},
+    async def create_robot(target_config: Dict[str, Any]) -> None:
+        target_robot = Robot(**target_config)
+        target_robot.name = target_config["name"]
+        try:
+            created_robot = await client.create_robot(robot=target_robot)
+        except (Conflict, BadRequest) as e:
+            logger.error(
+                "Failed to create robot",
+                extra={"robot": target_config["name"], "error": str(e)},
+            )
+            return
+        await set_robot_secret(
+            client, target_config, created_robot.id, created_robot.name, logger
         )
-        raise
+
+    return Reconciler(
+        stage="robots",
+        resource="robot",
+        log_field="robot",
+        list_current=lambda: iter_all_robots(client),
+        key=lambda robot: normalize_robot_name_for_comparison(robot.name),
+        desired_key=lambda robot: normalize_robot_name_for_comparison(robot["name"]),
+        create=create_robot,
+        update=update_robot,
+        delete=lambda robot: client.delete_robot(robot_id=robot.id),
+        in_sync=robot_up_to_date,
+        manages=handles_entry,
+    )
 
 
 async def sync_robot_accounts(client: Any, path: str, logger: Logger) -> None:
@@ -199,11 +192,13 @@ async def sync_robot_accounts(client: Any, path: str, logger: Logger) -> None:
 
     This function performs the following operations:
     1. Loads robot account configurations from file
-    2. Retrieves existing robot accounts (both system and project level)
+    2. Streams existing robot accounts (both system and project level)
     3. Deletes robot accounts that exist in Harbor but not in config
     4. Updates existing robot accounts or creates new ones
     5. Sets robot secrets from environment variables if available
 
+    Robots are written concurrently, see ``Reconciler``.
+
     Args:
         client: Harbor API client instance
         path: Path to the robot accounts configuration file
@@ -217,31 +212,15 @@ async def sync_robot_accounts(client: Any, path: str, logger: Logger) -> None:
     logger.info("Starting robot account synchronization")
 
     try:
-        # Load robot configurations
-        target_robots = load_target_robots(path, logger)
-
-        # Fetch all existing robots
-        try:
-            current_robots = await get_all_robots(client, logger)
-            current_robot_map = {robot.name: robot for robot in current_robots}
-        except Exception as e:
-            logger.error("Failed to fetch existing robots", extra={"error": str(e)})
-            raise
-
-        # Prepare target robots with full names
-        target_robots_with_names = prepare_target_robots(target_robots, logger)
-        target_robot_names = {name for name, _ in target_robots_with_names}
+        # Load robot configurations, only the changed ones in incremental runs
+        target_robots = [
+            robot
+            for robot in load_target_robots(path, logger)
+            if handles_entry(robot["name"])
+        ]
 
-        # Delete robots not in config
-        await delete_unused_robots(
-            client, current_robot_map, target_robot_names, logger
-        )
-
-        # Update or create robots
-        for full_name, target_config in target_robots_with_names:
-            await process_single_robot(
-                client, full_name, target_config, current_robot_map, logger
-            )
+        # Delete, update and create robots to match the config
+        await robot_reconciler(client, logger).reconcile(target_robots, logger)
 
         logger.info("Robot account synchronization completed successfully")
 
@@ -250,33 +229,36 @@ async def sync_robot_accounts(client: Any, path: str, logger: Logger) -> None:
         raise
 
 
-async def get_all_robots(client: Any, logger: Logger) -> List[Robot]:
-    """Fetch all robot accounts from Harbor (both system and project level).
+async def iter_all_robots(
+    client: Any, model: Optional[Type[Any]] = None
+) -> AsyncIterator[Any]:
+    """Stream all robot accounts from Harbor (both system and project level).
 
     Args:
         client: Harbor API client instance
-        logger: Logger instance for recording operations
+        model: harborapi model to stream the robots as, compact RobotRecords
+            if None
 
-    Returns:
-        List[Robot]: Combined list of system and project level robots
+    Yields:
+        System level robots followed by project level robots
 
     Raises:
         Exception: If fetching robots fails
     """
-    # Get system level robots
-    system_robots = await client.get_robots(query="Level=system", limit=None)
 
-    # Get project level robots
-    projects = await client.get_projects(limit=None)
-    project_robots = []
+    def iter_robots(query: str) -> AsyncIterator[Any]:
+        if model is None:
+            return iter_records(client, RobotRecord, "/robots", {"q": query})
+        return iter_models(client, model, "/robots", {"q": query})
 
-    for project in projects:
-        robots = await client.get_robots(
-            query=f"Level=project,ProjectID={project.project_id}", limit=None
-        )
-        project_robots.extend(robots)
+    # Stream system level robots
+    async for robot in iter_robots("Level=system"):
+        yield robot
 
-    return system_robots + project_robots
+    # Stream project level robots
+    async for project in iter_records(client, ProjectIdRecord, "/projects"):
+        async for robot in iter_robots(f"Level=project,ProjectID={project.project_id}"):
+            yield robot
 
 
 def construct_full_robot_name(target_robot: Dict[str, Any]) -> str:
@@ -294,13 +276,18 @@ def construct_full_robot_name(target_robot: Dict[str, Any]) -> str:
     namespace = target_robot["permissions"][0]["namespace"]
     robot_name = target_robot["name"]
 
+    robot_name_prefix = getenv("ROBOT_NAME_PREFIX", "")
     if namespace != "*":
-        return f"{ROBOT_NAME_PREFIX}{namespace}+{robot_name}"
-    return f"{ROBOT_NAME_PREFIX}{robot_name}"
+        return f"{robot_name_prefix}{namespace}+{robot_name}"
+    return f"{robot_name_prefix}{robot_name}"
 
 
 async def set_robot_secret(
-    client: Any, target_config: Dict[str, Any], robot_id: int, robot_name: str, logger: Logger
+    client: Any,
+    target_config: Dict[str, Any],
+    robot_id: int,
+    robot_name: str,
+    logger: Logger,
 ) -> None:
     """Set robot account secret from configuration.
 
@@ -327,6 +314,9 @@ async def set_robot_secret(
         try:
             logger.info("Setting robot secret", extra={"robot": robot_name})
             await client.refresh_robot_secret(robot_id, secret)
+            store_secret_fingerprints(
+                {robot_secret_key(robot_name): secret_fingerprint(secret)}, logger
+            )
         except Exception as e:
             logger.error(
                 "Failed to set robot secret",
@@ -0,0 +1,300 @@
+"""Harbor session authentication module.
+
+Harbor verifies the password hash on every basic auth request. This module
+logs in once, authenticates the following requests with the session cookie
+and keeps the session in a file so later runs can reuse it. Basic auth is
+only used to bootstrap the session and to rotate the admin password.
+"""
+
+import asyncio
+import hashlib
+import json
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from harborapi import HarborAsyncClient
+from harborapi.exceptions import Unauthorized, check_response_status
+
+from password_utils import sync_admin_password
+from instance import getenv
+
+SESSION_COOKIE = "sid"
+CSRF_COOKIE = "__csrf"
+CSRF_HEADER = "X-Harbor-CSRF-Token"
+
+
+class SessionHttpClient(httpx.AsyncClient):
+    """HTTP client logging in again once if Harbor rejects the session."""
+
+    def __init__(self, harbor: "SessionHarborClient", **kwargs: Any):
+        """Initialize the HTTP client.
+
+        Args:
+            harbor: Harbor client owning the session
+            **kwargs: Arguments of ``httpx.AsyncClient``
+        """
+        super().__init__(**kwargs)
+        self.harbor = harbor
+
+    async def request(self, method: str, url: Any, **kwargs: Any) -> httpx.Response:
+        """Send a request, retrying it once in a new session on 401.
+
+        Args:
+            method: HTTP method
+            url: Request URL
+            **kwargs: Arguments of ``httpx.AsyncClient.request``
+
+        Returns:
+            httpx.Response: Harbor's response
+        """
+        generation = self.harbor.session_generation
+        resp = await super().request(method, url, **kwargs)
+        if resp.status_code != 401 or not self.harbor.session_active:
+            return resp
+        if not await self.harbor.renew_session(generation):
+            return resp
+        headers = dict(kwargs.get("headers") or {})
+        if CSRF_HEADER in headers and self.harbor.csrf_token:
+            headers[CSRF_HEADER] = self.harbor.csrf_token
+        return await super().request(method, url, **{**kwargs, "headers": headers})
+
+
+class SessionHarborClient(HarborAsyncClient):
+    """Harbor client authenticating with a login session once it is started.
+
+    Until a session is active, requests use basic auth like the plain client.
+    A session that expires during a run is started again on the first
+    request Harbor rejects.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        """Initialize the client, see ``HarborAsyncClient``."""
+        self.session_active = False
+        self.csrf_token: Optional[str] = None
+        # Number of sessions started, tells requests whether they were
+        # rejected in a session that has already been replaced
+        self.session_generation = 0
+        self.session_login: Optional[Tuple[str, str, Logger]] = None
+        self._session_lock: Optional[asyncio.Lock] = None
+        super().__init__(*args, **kwargs)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return an HTTP client that keeps cookies, unlike the default one.
+
+        Returns:
+            httpx.AsyncClient: HTTP client
+        """
+        return SessionHttpClient(
+            self,
+            follow_redirects=self.follow_redirects,
+            timeout=self.timeout,
+            verify=self.verify,
+            event_hooks={"response": [self._capture_csrf_token]},
+        )
+
+    async def renew_session(self, generation: int) -> bool:
+        """Start a new session after Harbor rejected the current one.
+
+        Concurrent requests rejected in the same session share one login.
+
+        Args:
+            generation: Session generation the rejected request was sent in
+
+        Returns:
+            bool: True if a new session is active
+        """
+        if self.session_login is None:
+            return False
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        username, password, logger = self.session_login
+        async with self._session_lock:
+            if generation != self.session_generation:
+                return self.session_active
+            logger.info("Harbor session expired, logging in again")
+            try:
+                await login(self, username, password, logger)
+            except Exception as e:
+                logger.error("Failed to renew Harbor session", extra={"error": str(e)})
+                return False
+            save_session(self, credentials_fingerprint(username, password), logger)
+            return True
+
+    async def _capture_csrf_token(self, resp: httpx.Response) -> None:
+        """Remember the CSRF token Harbor sends with its responses.
+
+        Args:
+            resp: HTTP response
+        """
+        token = resp.headers.get(CSRF_HEADER)
+        if token:
+            self.csrf_token = token
+
+    def _get_headers(self, headers: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+        """Return the request headers, without basic auth if a session is active.
+
+        Args:
+            headers: Additional request headers
+
+        Returns:
+            Dict[str, str]: Request headers
+        """
+        if not self.session_active:
+            return super()._get_headers(headers)
+        base_headers = {"Accept": "application/json"}
+        # Harbor requires the CSRF token on modifying requests of a session
+        if self.csrf_token:
+            base_headers[CSRF_HEADER] = self.csrf_token
+        base_headers.update(headers or {})
+        return base_headers
+
+
+def credentials_fingerprint(username: str, password: str) -> str:
+    """Return the fingerprint of the credentials a session was started with.
+
+    Args:
+        username: Admin username
+        password: Admin password
+
+    Returns:
+        str: SHA-256 hex digest of the credentials
+    """
+    return hashlib.sha256(f"{username}:{password}".encode()).hexdigest()
+
+
+def save_session(client: SessionHarborClient, fingerprint: str, logger: Logger) -> None:
+    """Store the session cookies and CSRF token in HARBOR_SESSION_PATH.
+
+    Args:
+        client: Harbor API client with an active session
+        fingerprint: Fingerprint of the credentials the session was started with
+        logger: Logger instance
+    """
+    session_path = getenv("HARBOR_SESSION_PATH")
+    if not session_path:
+        return
+    session = {
+        "fingerprint": fingerprint,
+        "csrf_token": client.csrf_token,
+        "cookies": {
+            name: client.client.cookies.get(name)
+            for name in (SESSION_COOKIE, CSRF_COOKIE)
+            if client.client.cookies.get(name)
+        },
+    }
+    try:
+        path = Path(session_path)
+        path.touch(mode=0o600)
+        path.write_text(json.dumps(session))
+    except OSError as e:
+        logger.warning("Failed to store Harbor session", extra={"error": str(e)})
+
+
+def restore_session(client: SessionHarborClient, fingerprint: str) -> bool:
+    """Load a stored session into the client.
+
+    Sessions started with other credentials are ignored, so a new admin
+    password is still applied with basic auth.
+
+    Args:
+        client: Harbor API client instance
+        fingerprint: Fingerprint of the current credentials
+
+    Returns:
+        bool: True if a session was restored
+    """
+    session_path = getenv("HARBOR_SESSION_PATH")
+    if not session_path:
+        return False
+    try:
+        session = json.loads(Path(session_path).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    if session.get("fingerprint") != fingerprint:
+        return False
+    if SESSION_COOKIE not in session.get("cookies", {}):
+        return False
+
+    for name, value in session["cookies"].items():
+        client.client.cookies.set(name, value)
+    client.csrf_token = session.get("csrf_token")
+    client.session_active = True
+    return True
+
+
+async def login(
+    client: SessionHarborClient, username: str, password: str, logger: Logger
+) -> None:
+    """Start a new Harbor session with the given credentials.
+
+    Args:
+        client: Harbor API client instance
+        username: Admin username
+        password: Admin password
+        logger: Logger instance
+
+    Raises:
+        Unauthorized: If the credentials are rejected
+    """
+    client.session_active = False
+    client.client.cookies.clear()
+
+    # Fetch a CSRF token and cookie, the login form requires them
+    resp = await client.client.get(client.url + "/systeminfo")
+    check_response_status(resp)
+
+    base_url = client.url.rsplit("/api/", 1)[0]
+    resp = await client.client.post(
+        base_url + "/c/login",
+        data={"principal": username, "password": password},
+        headers={CSRF_HEADER: client.csrf_token or ""},
+    )
+    check_response_status(resp)
+    if not client.client.cookies.get(SESSION_COOKIE):
+        raise Unauthorized("Harbor did not return a session cookie")
+
+    client.session_active = True
+    client.session_generation += 1
+    client.session_login = (username, password, logger)
+    logger.info("Started Harbor session", extra={"user": username})
+
+
+async def start_session(
+    client: SessionHarborClient, username: str, password: str, logger: Logger
+) -> None:
+    """Authenticate the client with a reused or newly started Harbor session.
+
+    A stored session is reused if Harbor still accepts it. Otherwise the admin
+    password is synchronized with basic auth and a new session is started.
+
+    Args:
+        client: Harbor API client instance
+        username: Admin username
+        password: Admin password
+        logger: Logger instance
+
+    Raises:
+        Exception: If the password synchronization or login fails
+    """
+    fingerprint = credentials_fingerprint(username, password)
+    client.session_login = (username, password, logger)
+
+    if restore_session(client, fingerprint):
+        try:
+            await client.get_current_user()
+            logger.info("Reusing stored Harbor session")
+            return
+        except Unauthorized:
+            logger.info("Stored Harbor session expired")
+
+    client.session_active = False
+    client.client.cookies.clear()
+    try:
+        await sync_admin_password(client, logger)
+        await login(client, username, password, logger)
+    except Exception as e:
+        logger.error("Failed to start Harbor session", extra={"error": str(e)})
+        raise
+    save_session(client, fingerprint, logger)
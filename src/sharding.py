@@ -0,0 +1,571 @@
+"""Harbor operator sharding module.
+
+Several operator replicas can split the work on one Harbor instance. Every
+replica registers itself with a lease, the live replicas form a consistent
+hash ring and each replica only synchronizes the projects that hash to it.
+Stages changing Harbor-wide settings only run on the replica holding the
+leader lease. Leases are kept in files locally or as Kubernetes Leases
+in-cluster.
+"""
+
+import asyncio
+import bisect
+import fcntl
+import hashlib
+import json
+import socket
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from instance import getenv, instance_name
+from metrics import set_gauge
+
+# Virtual nodes per replica on the hash ring, evens out the shard sizes
+VIRTUAL_NODES = 64
+
+KUBERNETES_API_URL = "https://kubernetes.default.svc"
+SERVICE_ACCOUNT_PATH = Path("/var/run/secrets/kubernetes.io/serviceaccount")
+LEASE_GROUP_LABEL = "harbor-day2-operator/lease-group"
+
+# Shard assignments by instance
+_assignments: Dict[Optional[str], "ShardAssignment"] = {}
+
+# Locks serializing the lease updates of an instance, concurrent updates of
+# the same Kubernetes Lease conflict
+_lease_locks: Dict[Optional[str], asyncio.Lock] = {}
+
+
+def hash_key(value: str) -> int:
+    """Map a value onto the hash ring.
+
+    Args:
+        value: Value to hash
+
+    Returns:
+        int: Position on the ring
+    """
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring assigning keys to replicas.
+
+    Adding or removing a replica only moves the keys of that replica.
+    """
+
+    def __init__(self, members: List[str], virtual_nodes: int = VIRTUAL_NODES):
+        """Build the ring.
+
+        Args:
+            members: Identities of the replicas
+            virtual_nodes: Number of ring positions per replica
+        """
+        points = sorted(
+            (hash_key(f"{member}#{index}"), member)
+            for member in members
+            for index in range(virtual_nodes)
+        )
+        self.positions = [position for position, _ in points]
+        self.members = [member for _, member in points]
+
+    def owner(self, key: str) -> str:
+        """Return the replica a key is assigned to.
+
+        Args:
+            key: Key, e.g. a project name
+
+        Returns:
+            str: Identity of the replica
+        """
+        index = bisect.bisect(self.positions, hash_key(key)) % len(self.positions)
+        return self.members[index]
+
+
+@dataclass
+class ShardAssignment:
+    """Work assignment of this replica."""
+
+    identity: str
+    is_leader: bool
+    members: List[str] = field(default_factory=list)
+    ring: Optional[HashRing] = None
+
+    def owns(self, project_name: str) -> bool:
+        """Check whether a project is assigned to this replica.
+
+        Args:
+            project_name: Name of the project
+
+        Returns:
+            bool: True if this replica synchronizes the project
+        """
+        return self.ring is None or self.ring.owner(project_name) == self.identity
+
+
+class LeaseBackend:
+    """Storage of time limited leases held by replicas."""
+
+    async def try_acquire(self, name: str, holder: str, group: str) -> bool:
+        """Acquire or renew a lease.
+
+        Args:
+            name: Name of the lease
+            holder: Identity of the replica
+            group: Group the lease belongs to, used to list leases
+
+        Returns:
+            bool: True if the replica holds the lease afterwards
+        """
+        raise NotImplementedError
+
+    async def list_holders(self, group: str, prefix: str) -> List[str]:
+        """Return the holders of the unexpired leases of a group.
+
+        Args:
+            group: Group the leases belong to
+            prefix: Prefix of the lease names
+
+        Returns:
+            List[str]: Identities of the holders
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Release resources held by the backend."""
+
+
+def lease_expired(renew_time: float, duration: int, now: float) -> bool:
+    """Check whether a lease has expired.
+
+    Args:
+        renew_time: Last renewal in seconds since the epoch
+        duration: Lease duration in seconds
+        now: Current time in seconds since the epoch
+
+    Returns:
+        bool: True if the lease has expired
+    """
+    return renew_time + duration < now
+
+
+class FileLeaseBackend(LeaseBackend):
+    """Leases stored as JSON files in a shared directory.
+
+    Meant for local use; all replicas must see the same directory.
+    """
+
+    def __init__(self, directory: str, duration: int):
+        """Initialize the backend.
+
+        Args:
+            directory: Directory holding the lease files
+            duration: Lease duration in seconds
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.duration = duration
+
+    def _read(self, name: str) -> Optional[Dict[str, Any]]:
+        """Read a lease file, None if it does not exist."""
+        try:
+            return json.loads((self.directory / f"{name}.json").read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _acquire(self, name: str, holder: str, group: str) -> bool:
+        """Take or renew a lease under the directory lock, blocking."""
+        now = datetime.now(timezone.utc).timestamp()
+        with open(self.directory / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            lease = self._read(name)
+            if (
+                lease
+                and lease["holder"] != holder
+                and not lease_expired(lease["renew_time"], lease["duration"], now)
+            ):
+                return False
+            (self.directory / f"{name}.json").write_text(
+                json.dumps(
+                    {
+                        "holder": holder,
+                        "group": group,
+                        "renew_time": now,
+                        "duration": self.duration,
+                    }
+                )
+            )
+            return True
+
+    def _holders(self, group: str, prefix: str) -> List[str]:
+        """Read the holders of the live leases of a group, blocking."""
+        now = datetime.now(timezone.utc).timestamp()
+        holders = []
+        for path in sorted(self.directory.glob(f"{prefix}*.json")):
+            lease = self._read(path.stem)
+            if (
+                lease
+                and lease.get("group") == group
+                and not lease_expired(lease["renew_time"], lease["duration"], now)
+            ):
+                holders.append(lease["holder"])
+        return holders
+
+    async def try_acquire(self, name: str, holder: str, group: str) -> bool:
+        """See ``LeaseBackend.try_acquire``.
+
+        The file lock and IO run in a thread to keep the event loop free.
+        """
+        return await asyncio.to_thread(self._acquire, name, holder, group)
+
+    async def list_holders(self, group: str, prefix: str) -> List[str]:
+        """See ``LeaseBackend.list_holders``."""
+        return await asyncio.to_thread(self._holders, group, prefix)
+
+
+def format_micro_time(timestamp: datetime) -> str:
+    """Format a timestamp as Kubernetes MicroTime.
+
+    Args:
+        timestamp: Timestamp in UTC
+
+    Returns:
+        str: Formatted timestamp
+    """
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def kubernetes_lease_expired(spec: Dict[str, Any], now: datetime) -> bool:
+    """Check whether the spec of a Kubernetes Lease has expired.
+
+    Args:
+        spec: Lease spec
+        now: Current time
+
+    Returns:
+        bool: True if the lease has expired or was never renewed
+    """
+    renew_time = spec.get("renewTime")
+    if not renew_time or not spec.get("holderIdentity"):
+        return True
+    renewed = datetime.fromisoformat(renew_time.replace("Z", "+00:00"))
+    return lease_expired(
+        renewed.timestamp(), spec.get("leaseDurationSeconds", 0), now.timestamp()
+    )
+
+
+class KubernetesLeaseBackend(LeaseBackend):
+    """Leases stored as ``coordination.k8s.io/v1`` Lease objects.
+
+    Uses the service account of the pod, which needs permission to get, list,
+    create and update leases in its namespace.
+    """
+
+    def __init__(self, duration: int):
+        """Initialize the backend from the in-cluster service account.
+
+        Args:
+            duration: Lease duration in seconds
+        """
+        self.duration = duration
+        self.namespace = (SERVICE_ACCOUNT_PATH / "namespace").read_text().strip()
+        token = (SERVICE_ACCOUNT_PATH / "token").read_text().strip()
+        self.client = httpx.AsyncClient(
+            base_url=KUBERNETES_API_URL,
+            headers={"Authorization": f"Bearer {token}"},
+            verify=str(SERVICE_ACCOUNT_PATH / "ca.crt"),
+            timeout=10,
+        )
+        self.path = f"/apis/coordination.k8s.io/v1/namespaces/{self.namespace}/leases"
+
+    async def try_acquire(self, name: str, holder: str, group: str) -> bool:
+        """See ``LeaseBackend.try_acquire``."""
+        now = datetime.now(timezone.utc)
+        spec = {
+            "holderIdentity": holder,
+            "leaseDurationSeconds": self.duration,
+            "renewTime": format_micro_time(now),
+        }
+
+        resp = await self.client.get(f"{self.path}/{name}")
+        if resp.status_code == 404:
+            lease = {
+                "apiVersion": "coordination.k8s.io/v1",
+                "kind": "Lease",
+                "metadata": {"name": name, "labels": {LEASE_GROUP_LABEL: group}},
+                "spec": {**spec, "acquireTime": format_micro_time(now)},
+            }
+            resp = await self.client.post(self.path, json=lease)
+            if resp.status_code == 409:
+                return False
+            resp.raise_for_status()
+            return True
+        resp.raise_for_status()
+
+        lease = resp.json()
+        current = lease.get("spec", {})
+        if current.get("holderIdentity") != holder:
+            if not kubernetes_lease_expired(current, now):
+                return False
+            spec["acquireTime"] = format_micro_time(now)
+        lease["spec"] = {**current, **spec}
+
+        # The resource version in the metadata makes concurrent updates fail
+        resp = await self.client.put(f"{self.path}/{name}", json=lease)
+        if resp.status_code == 409:
+            return False
+        resp.raise_for_status()
+        return True
+
+    async def list_holders(self, group: str, prefix: str) -> List[str]:
+        """See ``LeaseBackend.list_holders``."""
+        resp = await self.client.get(
+            self.path, params={"labelSelector": f"{LEASE_GROUP_LABEL}={group}"}
+        )
+        resp.raise_for_status()
+        now = datetime.now(timezone.utc)
+        return sorted(
+            lease["spec"]["holderIdentity"]
+            for lease in resp.json().get("items", [])
+            if lease["metadata"]["name"].startswith(prefix)
+            and not kubernetes_lease_expired(lease.get("spec", {}), now)
+        )
+
+    async def close(self) -> None:
+        """Close the HTTP client."""
+        await self.client.aclose()
+
+
+def lease_duration() -> int:
+    """Return the lease duration set by LEASE_DURATION_SECONDS.
+
+    Returns:
+        int: Lease duration in seconds
+    """
+    return int(getenv("LEASE_DURATION_SECONDS", "180"))
+
+
+def lease_lock() -> asyncio.Lock:
+    """Return the lock serializing the lease updates of the current instance.
+
+    Returns:
+        asyncio.Lock: Lock of the instance
+    """
+    return _lease_locks.setdefault(instance_name(), asyncio.Lock())
+
+
+def create_lease_backend() -> Optional[LeaseBackend]:
+    """Create the lease backend selected by SHARD_LEASE_BACKEND.
+
+    Returns:
+        The lease backend, None if sharding is disabled
+
+    Raises:
+        ValueError: If the backend is unknown
+    """
+    backend = getenv("SHARD_LEASE_BACKEND")
+    duration = lease_duration()
+    if not backend:
+        return None
+    if backend == "file":
+        return FileLeaseBackend(
+            getenv("SHARD_LEASE_DIR", "/tmp/harbor-operator-leases"), duration
+        )
+    if backend == "kubernetes":
+        return KubernetesLeaseBackend(duration)
+    raise ValueError(f"Unknown lease backend: {backend}")
+
+
+def lease_names() -> Tuple[str, str, str]:
+    """Return the lease group, leader lease name and member lease prefix.
+
+    Returns:
+        Tuple of group, leader lease name and member lease name prefix
+    """
+    group = getenv("SHARD_LEASE_NAME", "harbor-day2-operator")
+    if instance_name():
+        group = f"{group}-{instance_name()}"
+    return group, f"{group}-leader", f"{group}-member-"
+
+
+def shard_identity() -> str:
+    """Return the identity of this replica, e.g. the pod name.
+
+    Returns:
+        str: Identity of the replica
+    """
+    return getenv("SHARD_IDENTITY") or socket.gethostname()
+
+
+async def join_shards(logger: Logger) -> Optional[ShardAssignment]:
+    """Register this replica and compute its work assignment.
+
+    Without SHARD_LEASE_BACKEND, the replica is the leader and owns all
+    projects.
+
+    Args:
+        logger: Logger instance
+
+    Returns:
+        The assignment, None if sharding is disabled
+
+    Raises:
+        Exception: If the lease backend fails
+    """
+    _assignments.pop(instance_name(), None)
+    backend = create_lease_backend()
+    if backend is None:
+        return None
+
+    identity = shard_identity()
+    group, leader_lease, member_prefix = lease_names()
+    try:
+        async with lease_lock():
+            await backend.try_acquire(f"{member_prefix}{identity}", identity, group)
+            is_leader = await backend.try_acquire(leader_lease, identity, group)
+            members = sorted(set(await backend.list_holders(group, member_prefix)))
+    except Exception as e:
+        logger.error("Failed to join shards", extra={"error": str(e)})
+        raise
+    finally:
+        await backend.close()
+
+    if identity not in members:
+        members = sorted(members + [identity])
+    assignment = ShardAssignment(
+        identity=identity,
+        is_leader=is_leader,
+        members=members,
+        ring=HashRing(members),
+    )
+    _assignments[instance_name()] = assignment
+
+    set_gauge("shard_members", len(members), "Number of live operator replicas.")
+    set_gauge("shard_leader", int(is_leader), "Whether this replica is the leader.")
+    logger.info(
+        "Joined shards",
+        extra={"identity": identity, "leader": is_leader, "members": members},
+    )
+    return assignment
+
+
+async def renew_leadership(logger: Logger) -> bool:
+    """Renew the leader lease before running a Harbor-wide stage.
+
+    Args:
+        logger: Logger instance
+
+    Returns:
+        bool: True if this replica is still the leader
+    """
+    assignment = _assignments.get(instance_name())
+    if assignment is None:
+        return True
+    if not assignment.is_leader:
+        return False
+
+    backend = create_lease_backend()
+    group, leader_lease, _ = lease_names()
+    try:
+        async with lease_lock():
+            await _renew_leader_lease(backend, assignment, leader_lease, group, logger)
+    finally:
+        await backend.close()
+    return assignment.is_leader
+
+
+async def _renew_leader_lease(
+    backend: LeaseBackend,
+    assignment: ShardAssignment,
+    leader_lease: str,
+    group: str,
+    logger: Logger,
+) -> None:
+    """Renew the leader lease held by a replica, recording if it was lost.
+
+    Args:
+        backend: Lease backend
+        assignment: Assignment of the replica, which must be the leader
+        leader_lease: Name of the leader lease
+        group: Group of the leases
+        logger: Logger instance
+    """
+    assignment.is_leader = await backend.try_acquire(
+        leader_lease, assignment.identity, group
+    )
+    if not assignment.is_leader:
+        set_gauge("shard_leader", 0, "Whether this replica is the leader.")
+        logger.warning("Lost shard leadership", extra={"identity": assignment.identity})
+
+
+async def renew_leases(logger: Logger) -> None:
+    """Renew the member lease and, if held, the leader lease of this replica.
+
+    Args:
+        logger: Logger instance
+
+    Raises:
+        Exception: If the lease backend fails
+    """
+    assignment = _assignments.get(instance_name())
+    if assignment is None:
+        return
+
+    backend = create_lease_backend()
+    group, leader_lease, member_prefix = lease_names()
+    try:
+        async with lease_lock():
+            await backend.try_acquire(
+                f"{member_prefix}{assignment.identity}", assignment.identity, group
+            )
+            if assignment.is_leader:
+                await _renew_leader_lease(
+                    backend, assignment, leader_lease, group, logger
+                )
+    finally:
+        await backend.close()
+
+
+async def keep_leases(logger: Logger) -> None:
+    """Renew the leases of this replica until cancelled.
+
+    The leases are renewed three times per LEASE_DURATION_SECONDS, however
+    long the runs in between take. Failed renewals are logged and retried.
+
+    Args:
+        logger: Logger instance
+    """
+    period = max(lease_duration() / 3, 1)
+    while True:
+        await asyncio.sleep(period)
+        try:
+            await renew_leases(logger)
+        except Exception as e:
+            logger.warning("Failed to renew shard leases", extra={"error": str(e)})
+
+
+def shard_members() -> List[str]:
+    """Return the live replicas of the current assignment.
+
+    Returns:
+        List[str]: Identities of the replicas, empty if sharding is disabled
+    """
+    assignment = _assignments.get(instance_name())
+    return assignment.members if assignment else []
+
+
+def owns_project(project_name: str) -> bool:
+    """Check whether this replica synchronizes a project.
+
+    Args:
+        project_name: Name of the project
+
+    Returns:
+        bool: True if sharding is disabled or the project hashes to this replica
+    """
+    assignment = _assignments.get(instance_name())
+    return assignment is None or assignment.owns(project_name)
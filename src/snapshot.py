@@ -0,0 +1,567 @@
+"""Harbor snapshot module.
+
+A snapshot holds every resource type the operator manages, one JSON record
+per line, in the format of the configuration files. It is written while the
+resources are streamed from Harbor, optionally gzip compressed. Restoring a
+snapshot splits it into configuration files again and applies them with the
+regular synchronization stages, so a snapshot can also seed a configuration
+folder.
+
+Ids differ between Harbor instances, so project and registry ids are stored
+as ``{{ project:name }}`` and ``{{ registry:name }}`` templates. Secrets are
+not returned by the Harbor API and are therefore not part of a snapshot.
+"""
+
+import asyncio
+import gzip
+import json
+import re
+import tempfile
+from datetime import datetime, timezone
+from logging import Logger
+from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+    TextIO,
+)
+
+from harborapi.exceptions import NotFound
+from harborapi.models import (
+    Configurations,
+    Project,
+    ProjectMemberEntity,
+    Quota,
+    Registry,
+    ReplicationPolicy,
+    Robot,
+    WebhookPolicy,
+)
+
+from pagination import iter_models, project_path
+from project_members import GROUP_ENTITY_TYPE, GROUP_KEY_SUFFIX, ProjectRole
+from retention_policies import retention_projection
+from robot_accounts import iter_all_robots, normalize_robot_name_for_comparison
+
+SNAPSHOT_VERSION = 1
+
+# Configuration files holding a single object instead of a list of entries
+OBJECT_FILES = {
+    "configurations.json",
+    "purge-job-schedule.json",
+    "garbage-collection-schedule.json",
+}
+
+# Configuration files restored together, in dependency order
+RESTORE_LAYERS = (
+    (
+        "configurations.json",
+        "registries.json",
+        "purge-job-schedule.json",
+        "garbage-collection-schedule.json",
+    ),
+    ("projects.json",),
+    (
+        "project-members.json",
+        "robots.json",
+        "webhooks.json",
+        "retention-policies.json",
+        "replications.json",
+    ),
+)
+
+# Names usable in id templates, see utils.fill_template
+TEMPLATE_NAME_PATTERN = re.compile(r"^[\w.\-]+$")
+# Id templates quoted in JSON, they are unquoted on restore
+QUOTED_TEMPLATE_PATTERN = re.compile(r'"(\{\{ (?:project|registry):[\w.\-]+ \}\})"')
+
+PROJECT_FIELDS = ("cve_allowlist",)
+REGISTRY_FIELDS = ("name", "url", "type", "insecure", "description")
+ROBOT_FIELDS = ("duration", "description", "disable", "level", "permissions")
+WEBHOOK_FIELDS = ("name", "description", "event_types", "targets", "enabled")
+REPLICATION_FIELDS = (
+    "name",
+    "description",
+    "dest_namespace",
+    "dest_namespace_replace_count",
+    "trigger",
+    "filters",
+    "replicate_deletion",
+    "deletion",
+    "override",
+    "enabled",
+    "speed",
+    "copy_by_chunk",
+)
+
+
+def id_template(kind: str, name: Optional[str], fallback: Any) -> Any:
+    """Return the id template of a project or registry.
+
+    Args:
+        kind: ``project`` or ``registry``
+        name: Name of the project or registry
+        fallback: Value used if the name cannot be templated
+
+    Returns:
+        The id template, or the fallback value
+    """
+    if name and TEMPLATE_NAME_PATTERN.match(name):
+        return f"{{{{ {kind}:{name} }}}}"
+    return fallback
+
+
+def dump_fields(model: Any, fields: tuple) -> Dict[str, Any]:
+    """Dump the given fields of a model, leaving out unset values.
+
+    Args:
+        model: harborapi model
+        fields: Names of the fields
+
+    Returns:
+        Dict[str, Any]: JSON compatible field values
+    """
+    dumped = model.model_dump(mode="json", include=set(fields), exclude_none=True)
+    return {key: dumped[key] for key in fields if key in dumped}
+
+
+def open_snapshot(path: str, mode: str) -> IO[str]:
+    """Open a snapshot file, gzip compressed if its name ends with ``.gz``.
+
+    Args:
+        path: Path of the snapshot file
+        mode: ``r`` or ``w``
+
+    Returns:
+        IO[str]: Text stream of the file
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+async def export_configurations(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the editable Harbor configuration.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: Configuration settings
+    """
+    current = await client.get_config()
+    settings = {}
+    for key in Configurations.model_fields:
+        item = getattr(current, key, None)
+        if item is None or getattr(item, "editable", True) is False:
+            continue
+        value = getattr(item, "value", item)
+        if value is not None:
+            settings[key] = value
+    yield settings
+
+
+async def export_registries(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the registries.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: One registry configuration per registry
+    """
+    async for registry in iter_models(client, Registry, "/registries"):
+        entry = dump_fields(registry, REGISTRY_FIELDS)
+        if registry.credential and registry.credential.type:
+            entry["credential"] = {
+                "type": registry.credential.type,
+                "access_key": registry.credential.access_key or "",
+            }
+        yield entry
+
+
+async def export_projects(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the projects with their metadata and storage quota.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: One project configuration per project
+    """
+    # Quotas are listed once instead of per project, keeping only the limits
+    storage_limits: Dict[int, int] = {}
+    async for quota in iter_models(client, Quota, "/quotas", {"reference": "project"}):
+        ref = (quota.ref.root if quota.ref else None) or {}
+        hard = (quota.hard.root if quota.hard else None) or {}
+        if ref.get("id") is not None and "storage" in hard:
+            storage_limits[int(ref["id"])] = hard["storage"]
+
+    registry_names: Dict[int, str] = {}
+    async for registry in iter_models(client, Registry, "/registries"):
+        registry_names[registry.id] = registry.name
+
+    async for project in iter_models(client, Project, "/projects"):
+        metadata = (
+            project.metadata.model_dump(mode="json", exclude_none=True)
+            if project.metadata
+            else {}
+        )
+        # Retention policies are restored from retention-policies.json
+        metadata.pop("retention_id", None)
+        entry: Dict[str, Any] = {"project_name": project.name, "metadata": metadata}
+        entry.update(dump_fields(project, PROJECT_FIELDS))
+        if project.project_id in storage_limits:
+            entry["storage_limit"] = storage_limits[project.project_id]
+        if project.registry_id:
+            entry["registry_id"] = id_template(
+                "registry", registry_names.get(project.registry_id), project.registry_id
+            )
+        yield entry
+
+
+async def export_project_members(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the members of every project by role.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: One project members configuration per project
+    """
+    roles = {role.value: role.name.lower() for role in ProjectRole}
+    async for project in iter_models(client, Project, "/projects"):
+        entry: Dict[str, Any] = {"project_name": project.name}
+        path, headers = project_path(project.name, "members")
+        async for member in iter_models(
+            client, ProjectMemberEntity, path, headers=headers
+        ):
+            role = roles.get(member.role_id)
+            if not role or not member.entity_name:
+                continue
+            if member.entity_type == GROUP_ENTITY_TYPE:
+                role += GROUP_KEY_SUFFIX
+            entry.setdefault(role, []).append(member.entity_name)
+        yield entry
+
+
+async def export_robots(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the system and project robot accounts, without their secrets.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: One robot configuration per robot account
+    """
+    async for robot in iter_all_robots(client, Robot):
+        yield {
+            "name": normalize_robot_name_for_comparison(robot.name),
+            **dump_fields(robot, ROBOT_FIELDS),
+        }
+
+
+async def export_webhooks(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the webhook policies of every project.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: One webhook configuration per project with policies
+    """
+    async for project in iter_models(client, Project, "/projects"):
+        path, headers = project_path(project.name, "webhook/policies")
+        policies = [
+            dump_fields(policy, WEBHOOK_FIELDS)
+            async for policy in iter_models(
+                client, WebhookPolicy, path, headers=headers
+            )
+        ]
+        if policies:
+            yield {"project_name": project.name, "policies": policies}
+
+
+async def export_replications(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the replication rules.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: One replication configuration per rule
+    """
+    async for policy in iter_models(client, ReplicationPolicy, "/replication/policies"):
+        entry = dump_fields(policy, REPLICATION_FIELDS)
+        # The local Harbor has id 0 and is implied by the missing side
+        for key in ("src_registry", "dest_registry"):
+            registry = getattr(policy, key)
+            if registry and registry.id:
+                entry[key] = {"id": id_template("registry", registry.name, registry.id)}
+        yield entry
+
+
+async def export_retention_policies(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the retention policies of every project.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: One retention policy configuration per project with
+        a policy
+    """
+    async for project in iter_models(client, Project, "/projects"):
+        retention_id = project.metadata.retention_id if project.metadata else None
+        if retention_id is None:
+            continue
+        try:
+            policy = await client.get_retention_policy(int(retention_id))
+        except NotFound:
+            continue
+        yield {
+            **retention_projection(policy),
+            "scope": {
+                "level": "project",
+                "ref": id_template("project", project.name, project.project_id),
+            },
+        }
+
+
+def schedule_entry(schedule: Any, parameters: Any) -> Dict[str, Any]:
+    """Build a schedule configuration from Harbor's schedule objects.
+
+    Args:
+        schedule: Harbor schedule object with type and cron
+        parameters: Job parameters as dictionary or JSON string
+
+    Returns:
+        Dict[str, Any]: Schedule configuration
+    """
+    if isinstance(parameters, str):
+        parameters = json.loads(parameters) if parameters else {}
+    entry: Dict[str, Any] = {"parameters": parameters or {}}
+    if schedule:
+        entry["schedule"] = schedule.model_dump(
+            mode="json", include={"type", "cron"}, exclude_none=True
+        )
+    return entry
+
+
+async def export_purge_job_schedule(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the audit log purge schedule.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: Purge job schedule configuration, if one exists
+    """
+    try:
+        purge = await client.get_purge_job_schedule()
+    except NotFound:
+        return
+    if purge and purge.schedule:
+        yield schedule_entry(purge.schedule, purge.job_parameters)
+
+
+async def export_gc_schedule(client: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Export the garbage collection schedule.
+
+    Args:
+        client: Harbor API client instance
+
+    Yields:
+        Dict[str, Any]: Garbage collection schedule configuration, if one exists
+    """
+    try:
+        gc = await client.get_gc_schedule()
+    except NotFound:
+        return
+    if gc and gc.schedule:
+        yield schedule_entry(gc.schedule, gc.parameters)
+
+
+# Exporters of the configuration files, in restore order
+EXPORTERS: Dict[str, Callable[[Any], AsyncIterator[Dict[str, Any]]]] = {
+    "configurations.json": export_configurations,
+    "registries.json": export_registries,
+    "purge-job-schedule.json": export_purge_job_schedule,
+    "garbage-collection-schedule.json": export_gc_schedule,
+    "projects.json": export_projects,
+    "project-members.json": export_project_members,
+    "robots.json": export_robots,
+    "webhooks.json": export_webhooks,
+    "retention-policies.json": export_retention_policies,
+    "replications.json": export_replications,
+}
+
+
+async def write_snapshot(client: Any, output: TextIO, logger: Logger) -> None:
+    """Stream all managed resources of Harbor into a snapshot.
+
+    Only a page of each listing and the record being written are held in
+    memory.
+
+    Args:
+        client: Harbor API client instance
+        output: Text stream to write the snapshot to
+        logger: Logger instance
+
+    Raises:
+        Exception: If any Harbor API operation fails
+    """
+    header = {
+        "snapshot": SNAPSHOT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "source": client.url,
+    }
+    output.write(json.dumps(header, separators=(",", ":")) + "\n")
+
+    for filename, exporter in EXPORTERS.items():
+        count = 0
+        try:
+            async for entry in exporter(client):
+                record = {"file": filename, "entry": entry}
+                output.write(json.dumps(record, separators=(",", ":")) + "\n")
+                count += 1
+        except Exception as e:
+            logger.error(
+                "Failed to export resources",
+                extra={"file": filename, "error": str(e)},
+            )
+            raise
+        logger.info("Exported resources", extra={"file": filename, "count": count})
+
+
+def missing_secret(filename: str, entry: Any) -> Optional[Dict[str, str]]:
+    """Return the resource of a snapshot entry whose secret cannot be restored.
+
+    Args:
+        filename: Configuration file of the entry
+        entry: Entry of the snapshot
+
+    Returns:
+        Log fields identifying the robot account or registry, None if the
+        entry has no secret or it is part of the entry
+    """
+    if filename == "robots.json" and "secret" not in entry:
+        return {"robot": entry.get("name", "")}
+    if filename == "registries.json":
+        credential = entry.get("credential") or {}
+        if credential.get("access_key") and "access_secret" not in credential:
+            return {"registry": entry.get("name", "")}
+    return None
+
+
+def split_snapshot(snapshot: TextIO, folder: Path, logger: Logger) -> Dict[str, int]:
+    """Split a snapshot into configuration files.
+
+    The entries are appended to their files while the snapshot is read, so
+    only one record is held in memory. A warning is logged for every robot
+    account and registry whose secret is not in the snapshot.
+
+    Args:
+        snapshot: Text stream of the snapshot
+        folder: Folder to write the configuration files to
+        logger: Logger instance
+
+    Returns:
+        Dict[str, int]: Number of entries by configuration file
+
+    Raises:
+        ValueError: If the snapshot version is not supported or a record
+            belongs to an unknown configuration file
+    """
+    header = json.loads(snapshot.readline() or "{}")
+    if header.get("snapshot") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {header.get('snapshot')}")
+
+    files: Dict[str, TextIO] = {}
+    counts: Dict[str, int] = {}
+    try:
+        for line in snapshot:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            filename = record["file"]
+            if filename not in EXPORTERS:
+                raise ValueError(f"Unknown configuration file in snapshot: {filename}")
+            resource = missing_secret(filename, record["entry"])
+            if resource:
+                logger.warning(
+                    "Secret not in snapshot, set it again after the restore",
+                    extra=resource,
+                )
+
+            content = QUOTED_TEMPLATE_PATTERN.sub(r"\1", json.dumps(record["entry"]))
+            if filename in OBJECT_FILES:
+                (folder / filename).write_text(content)
+            else:
+                if filename not in files:
+                    files[filename] = open(folder / filename, "w", encoding="utf-8")
+                    files[filename].write("[\n")
+                else:
+                    files[filename].write(",\n")
+                files[filename].write(content)
+            counts[filename] = counts.get(filename, 0) + 1
+    finally:
+        for output in files.values():
+            output.write("\n]\n")
+            output.close()
+    return counts
+
+
+async def restore_snapshot(
+    client: Any,
+    snapshot: TextIO,
+    sync_funcs: Dict[str, Callable[[Any, str, Logger], Awaitable[None]]],
+    logger: Logger,
+    concurrency: int = 4,
+    prune: bool = False,
+) -> None:
+    """Apply a snapshot to Harbor with the synchronization stages.
+
+    The files of a restore layer do not depend on each other and are applied
+    concurrently, at most ``concurrency`` at a time. Files missing in the
+    snapshot are skipped, with ``prune`` missing list files are applied empty
+    instead, deleting all resources of their type.
+
+    Args:
+        client: Harbor API client instance
+        snapshot: Text stream of the snapshot
+        sync_funcs: Synchronization functions by configuration file
+        logger: Logger instance
+        concurrency: Maximum number of files applied at the same time
+        prune: Whether to delete the resources of list files missing in the
+            snapshot
+
+    Raises:
+        ValueError: If the snapshot is invalid
+        Exception: If any synchronization stage fails
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    with tempfile.TemporaryDirectory(prefix="harbor-snapshot-") as folder:
+        counts = split_snapshot(snapshot, Path(folder), logger)
+        logger.info("Read snapshot", extra={"counts": counts})
+
+        async def restore_file(filename: str) -> None:
+            path = Path(folder) / filename
+            if not path.exists():
+                if filename in OBJECT_FILES or not prune:
+                    logger.info(f"No {filename} in snapshot - skipping")
+                    return
+                logger.warning(f"No {filename} in snapshot - pruning")
+                path.write_text("[]")
+            async with semaphore:
+                logger.info("Restoring configuration file", extra={"file": filename})
+                await sync_funcs[filename](client, str(path), logger)
+
+        for layer in RESTORE_LAYERS:
+            await asyncio.gather(*(restore_file(filename) for filename in layer))
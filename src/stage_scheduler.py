@@ -0,0 +1,228 @@
+"""Harbor stage scheduler module.
+
+In daemon mode each stage can be reconciled at its own cadence. Settings
+that rarely drift, e.g. the Harbor configuration or the GC schedule, can be
+checked daily while robot accounts and members are checked every few
+minutes. The next run of a stage is moved by a random share of its interval,
+so the stages of several replicas or instances spread out over time. Failed
+stages are retried with exponential backoff, and a stage waits while a stage
+it depends on has not succeeded.
+"""
+
+import json
+import random
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterable, List, Mapping, Tuple
+
+from metrics import set_gauge
+
+# Share of the interval by which the next run of a stage is randomly moved
+DEFAULT_JITTER = 0.1
+# Seconds before the first retry of a failed stage, doubled with every failure
+DEFAULT_RETRY_SECONDS = 60.0
+
+SCHEDULE_FIELDS = ("interval", "jitter", "retry_seconds")
+
+
+@dataclass
+class StageSchedule:
+    """Interval, jitter and retry backoff of a stage."""
+
+    interval: float
+    jitter: float = DEFAULT_JITTER
+    retry_seconds: float = DEFAULT_RETRY_SECONDS
+
+
+@dataclass
+class StageState:
+    """Scheduling state of a stage."""
+
+    schedule: StageSchedule
+    next_run: float = 0.0
+    failures: int = 0
+    succeeded: bool = False
+
+
+def stage_schedule(entry: Any, default: StageSchedule) -> StageSchedule:
+    """Build the schedule of a stage from its configuration entry.
+
+    Args:
+        entry: Interval in seconds, or an object with some of ``interval``,
+            ``jitter`` and ``retry_seconds``
+        default: Schedule providing the settings the entry leaves out
+
+    Returns:
+        StageSchedule: Schedule of the stage
+
+    Raises:
+        ValueError: If the entry is invalid
+    """
+    if isinstance(entry, (int, float)) and not isinstance(entry, bool):
+        entry = {"interval": entry}
+    if not isinstance(entry, dict):
+        raise ValueError(f"Invalid stage schedule: {entry!r}")
+    unknown = set(entry) - set(SCHEDULE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown stage schedule fields: {', '.join(sorted(unknown))}")
+    schedule = replace(default, **{name: float(value) for name, value in entry.items()})
+    if schedule.interval <= 0 or schedule.retry_seconds <= 0:
+        raise ValueError(f"Stage intervals must be positive: {entry!r}")
+    if not 0 <= schedule.jitter < 1:
+        raise ValueError(f"Stage jitter must be between 0 and 1: {entry!r}")
+    return schedule
+
+
+def parse_stage_schedules(
+    value: str, stages: Iterable[str], default_interval: float
+) -> Dict[str, StageSchedule]:
+    """Parse the schedules of the stages.
+
+    The value is a JSON object with an entry per stage, named by its
+    configuration file with or without ``.json``. A ``default`` entry applies
+    to the stages not listed.
+
+    Args:
+        value: JSON object of stage schedules
+        stages: Configuration files of the stages, in dependency order
+        default_interval: Interval of stages without a schedule
+
+    Returns:
+        Dict[str, StageSchedule]: Schedules by configuration file, in the
+        order of the stages
+
+    Raises:
+        ValueError: If the value is invalid or names an unknown stage
+    """
+    try:
+        entries = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid stage schedules: {e}") from e
+    if not isinstance(entries, dict):
+        raise ValueError("Stage schedules must be a JSON object")
+
+    stages = list(stages)
+    default = StageSchedule(default_interval)
+    if "default" in entries:
+        default = stage_schedule(entries.pop("default"), default)
+    by_stage = {}
+    for name, entry in entries.items():
+        filename = name if name.endswith(".json") else f"{name}.json"
+        if filename not in stages:
+            raise ValueError(f"Unknown stage in stage schedules: {name}")
+        by_stage[filename] = stage_schedule(entry, default)
+    return {stage: by_stage.get(stage, default) for stage in stages}
+
+
+class StageScheduler:
+    """Keeps track of when each stage is due."""
+
+    def __init__(
+        self,
+        schedules: Dict[str, StageSchedule],
+        dependencies: Mapping[str, Iterable[str]],
+    ):
+        """Initialize the scheduler, all stages are due right away.
+
+        Args:
+            schedules: Schedules by stage, in dependency order
+            dependencies: Stages each stage depends on
+        """
+        self.states = {
+            stage: StageState(schedule) for stage, schedule in schedules.items()
+        }
+        self.dependencies = {
+            stage: tuple(dep for dep in dependencies.get(stage, ()) if dep in schedules)
+            for stage in schedules
+        }
+
+    def due(self, now: float) -> List[str]:
+        """Return the stages due at a time.
+
+        Args:
+            now: Current time of the event loop
+
+        Returns:
+            List[str]: Due stages, in dependency order
+        """
+        return [stage for stage, state in self.states.items() if state.next_run <= now]
+
+    def next_run(self) -> float:
+        """Return the time the next stage is due."""
+        return min(state.next_run for state in self.states.values())
+
+    def blocking(self, stage: str) -> List[str]:
+        """Return the dependencies of a stage that have not succeeded.
+
+        Args:
+            stage: Stage to check
+
+        Returns:
+            List[str]: Dependencies that never ran successfully or failed in
+            their last run
+        """
+        return [
+            dep
+            for dep in self.dependencies[stage]
+            if self.states[dep].failures or not self.states[dep].succeeded
+        ]
+
+    def _schedule(self, state: StageState, delay: float, now: float) -> None:
+        """Set the next run of a stage after a delay with jitter."""
+        jitter = state.schedule.jitter
+        state.next_run = now + delay * (1 + random.uniform(-jitter, jitter))
+
+    def record(self, stage: str, success: bool, now: float) -> Tuple[float, int]:
+        """Record the outcome of a stage run and schedule its next run.
+
+        Successful stages run again after their interval. Failed stages are
+        retried after their retry delay, doubled with every consecutive
+        failure up to their interval.
+
+        Args:
+            stage: Stage that ran
+            success: Whether the stage succeeded
+            now: Current time of the event loop
+
+        Returns:
+            Tuple of the seconds until the next run and the number of
+            consecutive failures
+        """
+        state = self.states[stage]
+        schedule = state.schedule
+        if success:
+            state.failures = 0
+            state.succeeded = True
+            delay = schedule.interval
+        else:
+            state.failures += 1
+            delay = min(
+                schedule.retry_seconds * 2 ** (state.failures - 1), schedule.interval
+            )
+        self._schedule(state, delay, now)
+        set_gauge(
+            "stage_consecutive_failures",
+            state.failures,
+            "Consecutive failed runs of a scheduled stage.",
+            stage=stage,
+        )
+        return state.next_run - now, state.failures
+
+    def postpone(self, stage: str, now: float) -> float:
+        """Postpone a stage until the next run of its blocking dependencies.
+
+        Args:
+            stage: Stage with blocking dependencies
+            now: Current time of the event loop
+
+        Returns:
+            float: Seconds until the stage is due again
+        """
+        state = self.states[stage]
+        next_run = min(
+            (self.states[dep].next_run for dep in self.blocking(stage)), default=now
+        )
+        if next_run > now:
+            state.next_run = next_run
+        else:
+            self._schedule(state, state.schedule.retry_seconds, now)
+        return state.next_run - now
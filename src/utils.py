@@ -1,18 +1,57 @@
 import os
 import json
 import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from time import sleep
-from typing import Dict, Any
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from logging import Logger
 
 import chevron
 from harborapi import HarborAsyncClient
 
+from instance import getenv
+
 
 # Environment variables for Harbor configuration
 API_URL = os.environ.get("HARBOR_API_URL")
 
+# ID templates, replaced by the IDs of projects and registries
+TEMPLATE_PATTERN = re.compile(r"{{\s*(project|registry):([\w.\-_]+)\s*}}")
+
+# Maximum number of fragments of a configuration directory read at the same time
+FRAGMENT_READERS = int(os.environ.get("FRAGMENT_READERS", "8"))
+
+# Modification time, size and parsed content of the configuration files by
+# path and parser, shared by all instances of a fleet. Only the latest
+# version of a file is kept.
+_file_cache: Dict[Tuple[str, Callable[[str], Any]], Tuple[int, int, Any]] = {}
+
+
+class RateLimiter:
+    """Spread Harbor API requests evenly to stay below a request rate.
+
+    The limiter is shared by concurrent tasks, every call to ``wait`` reserves
+    the next free time slot.
+    """
+
+    def __init__(self, requests_per_second: float):
+        """Initialize the rate limiter.
+
+        Args:
+            requests_per_second: Maximum request rate, values <= 0 disable limiting
+        """
+        self.interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self.next_slot = 0.0
+
+    async def wait(self) -> None:
+        """Wait until the next request may be sent."""
+        now = asyncio.get_running_loop().time()
+        delay = self.next_slot - now
+        self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
 
 async def wait_until_healthy(client: HarborAsyncClient, logger: Logger) -> None:
     """Wait until the Harbor instance is healthy.
@@ -33,7 +72,7 @@ async def wait_until_healthy(client: HarborAsyncClient, logger: Logger) -> None:
             logger.info("Waiting for harbor to become healthy")
         except Exception as e:
             logger.warning("Health check failed", extra={"error": str(e)})
-        sleep(5)
+        await asyncio.sleep(5)
 
 
 def replace_env_vars_in_obj(obj: Any) -> Any:
@@ -55,7 +94,7 @@ def replace_env_vars_in_obj(obj: Any) -> Any:
 
         def replacer(match):
             var_name = match.group(1)
-            value = os.environ.get(var_name)
+            value = getenv(var_name)
             if value is None:
                 raise ValueError(
                     f"Environment variable '{var_name}' not set for placeholder in JSON."
@@ -67,30 +106,148 @@ def replace_env_vars_in_obj(obj: Any) -> Any:
         return obj
 
 
-def load_json(path: str) -> Dict[str, Any]:
-    """Load JSON data from a file and replace environment variable placeholders.
+def read_config_file(path: str, parse: Callable[[str], Any] = str) -> Any:
+    """Read and parse a configuration file, reusing earlier results.
+
+    The result is cached until the file changes, so files shared by the
+    instances of a fleet are only read and parsed once. Callers must not
+    modify the returned object.
 
     Args:
-        path: Path to the JSON file
+        path: Path to the file
+        parse: Function parsing the file content
 
     Returns:
-        Dict[str, Any]: Parsed JSON data with environment variables replaced
+        Any: Parsed file content
 
     Raises:
         FileNotFoundError: If the file doesn't exist
-        json.JSONDecodeError: If the file is not valid JSON
-        ValueError: If an environment variable placeholder is not set
     """
     file_path = Path(path)
     if not file_path.exists():
         raise FileNotFoundError(f"File not found: {path}")
 
-    with open(file_path, "r") as f:
-        data = json.load(f)
-        return replace_env_vars_in_obj(data)
+    stat = file_path.stat()
+    key = (str(file_path.resolve()), parse)
+    cached = _file_cache.get(key)
+    if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+        cached = (stat.st_mtime_ns, stat.st_size, parse(file_path.read_text()))
+        _file_cache[key] = cached
+    return cached[2]
+
+
+def fragment_paths(path: Path) -> List[Path]:
+    """Return the files a configuration is read from.
+
+    A configuration is either a single file or a directory of fragments, the
+    JSON files directly inside it in the order of their names.
+
+    Args:
+        path: Path of the configuration file or directory
+
+    Returns:
+        List[Path]: The file itself, or the fragments of the directory
+    """
+    if not path.is_dir():
+        return [path]
+    return sorted(
+        fragment
+        for fragment in path.glob("*.json")
+        if fragment.is_file() and not fragment.name.startswith(".")
+    )
+
+
+def read_fragments(path: str, parse: Callable[[str], Any] = str) -> List[Any]:
+    """Read and parse the files of a configuration concurrently.
+
+    Every fragment is cached on its own, see ``read_config_file``, so only
+    changed fragments are parsed again.
+
+    Args:
+        path: Path of the configuration file or directory
+        parse: Function parsing the content of a file
+
+    Returns:
+        List[Any]: Parsed content of each file, in the order of
+        ``fragment_paths``
+
+    Raises:
+        FileNotFoundError: If the configuration does not exist
+    """
+    paths = fragment_paths(Path(path))
+    if len(paths) < 2:
+        return [read_config_file(str(fragment), parse) for fragment in paths]
+    with ThreadPoolExecutor(min(len(paths), FRAGMENT_READERS)) as pool:
+        return list(
+            pool.map(lambda fragment: read_config_file(str(fragment), parse), paths)
+        )
+
+
+def read_config_text(path: str) -> str:
+    """Read the content of a configuration file or directory.
 
+    The fragments of a directory must be JSON arrays, their entries are
+    joined into one array.
+
+    Args:
+        path: Path of the configuration file or directory
+
+    Returns:
+        str: Content of the file, or of all fragments as one array
+
+    Raises:
+        FileNotFoundError: If the configuration does not exist
+        ValueError: If a fragment is no JSON array
+    """
+    if not Path(path).is_dir():
+        return read_config_file(path)
+    entries = []
+    for fragment, content in zip(fragment_paths(Path(path)), read_fragments(path)):
+        content = content.strip()
+        if not (content.startswith("[") and content.endswith("]")):
+            raise ValueError(f"Fragment is no JSON array: {fragment}")
+        if content[1:-1].strip():
+            entries.append(content[1:-1].strip())
+    return "[" + ",\n".join(entries) + "]"
+
+
+def load_json(path: str) -> Dict[str, Any]:
+    """Load JSON data from a file and replace environment variable placeholders.
+
+    The entries of the fragments of a configuration directory are loaded as
+    one list.
+
+    Args:
+        path: Path to the JSON file or configuration directory
 
-async def fill_template(client: HarborAsyncClient, path: str, logger: Logger) -> str:
+    Returns:
+        Dict[str, Any]: Parsed JSON data with environment variables replaced
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+        json.JSONDecodeError: If the file is not valid JSON
+        ValueError: If an environment variable placeholder is not set, or a
+            fragment is no JSON array
+    """
+    if Path(path).is_dir():
+        entries = []
+        for fragment, data in zip(
+            fragment_paths(Path(path)), read_fragments(path, json.loads)
+        ):
+            if not isinstance(data, list):
+                raise ValueError(f"Fragment is no JSON array: {fragment}")
+            entries.extend(data)
+        return replace_env_vars_in_obj(entries)
+    # Placeholders are replaced on every call, as they may differ per instance
+    return replace_env_vars_in_obj(read_config_file(path, json.loads))
+
+
+async def fill_template(
+    client: HarborAsyncClient,
+    path: str,
+    logger: Logger,
+    project_ids: Optional[Dict[str, int]] = None,
+) -> str:
     """Fill a template file with Harbor-specific values.
 
     This function reads a template file and replaces placeholders with actual
@@ -99,8 +256,10 @@ async def fill_template(client: HarborAsyncClient, path: str, logger: Logger) ->
 
     Args:
         client: Harbor API client instance
-        path: Path to the template file
+        path: Path to the template file or configuration directory
         logger: Logger instance for recording operations
+        project_ids: Optional map of project names to IDs, used instead of
+            looking up each project placeholder separately
 
     Returns:
         str: Filled template content
@@ -111,34 +270,36 @@ async def fill_template(client: HarborAsyncClient, path: str, logger: Logger) ->
         Exception: If any Harbor API operation fails
     """
     try:
-        with open(path, "r") as file:
-            content = file.read()
-
-            placeholders = re.findall(
-                r"{{\s*(?:project|registry):[\w.\-_]+\s*}}", content
-            )
-            logger.info("Found id templates", extra={"placeholders": placeholders})
-
-            replacements: Dict[str, Any] = {}
-            for placeholder in (p.strip(" {}") for p in placeholders):
-                try:
-                    placeholder_type, placeholder_value = placeholder.split(":")
+        content = read_config_text(path)
+
+        placeholders = re.findall(r"{{\s*(?:project|registry):[\w.\-_]+\s*}}", content)
+        logger.info("Found id templates", extra={"placeholders": placeholders})
+
+        replacements: Dict[str, Any] = {}
+        for placeholder in dict.fromkeys(p.strip(" {}") for p in placeholders):
+            try:
+                placeholder_type, placeholder_value = placeholder.split(":")
+                if placeholder_type == "project" and project_ids is not None:
+                    if placeholder_value not in project_ids:
+                        raise IndexError(f"Project not found: {placeholder_value}")
+                    replacement_value = project_ids[placeholder_value]
+                else:
                     replacement_value = await fetch_id(
                         client, placeholder_type, placeholder_value, logger
                     )
 
-                    insert_into_dict(
-                        replacements, placeholder.split(".") + [str(replacement_value)]
-                    )
+                insert_into_dict(
+                    replacements, placeholder.split(".") + [str(replacement_value)]
+                )
 
-                except Exception as e:
-                    logger.error(
-                        "Failed to process template placeholder",
-                        extra={"placeholder": placeholder, "error": str(e)},
-                    )
-                    raise
+            except Exception as e:
+                logger.error(
+                    "Failed to process template placeholder",
+                    extra={"placeholder": placeholder, "error": str(e)},
+                )
+                raise
 
-            return chevron.render(content, replacements)
+        return chevron.render(content, replacements)
 
     except FileNotFoundError:
         logger.error("Template file not found", extra={"path": path})
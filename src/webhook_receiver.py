@@ -0,0 +1,226 @@
+"""Harbor webhook receiver module.
+
+In daemon mode the operator can listen for Harbor webhook events and queue a
+targeted reconciliation of the affected project, instead of waiting for the
+next full synchronization to correct the drift. The listener is a minimal
+HTTP/1.1 server on top of asyncio streams, as it only accepts single JSON
+POST requests from Harbor.
+"""
+
+import asyncio
+import json
+from logging import Logger
+from typing import Any, Dict, Optional, Set, Tuple
+
+# Harbor event types that may leave a project drifted from its configuration
+RELEVANT_EVENT_TYPES = {
+    "QUOTA_EXCEED",
+    "QUOTA_WARNING",
+    "REPLICATION",
+    "TAG_RETENTION",
+}
+# Name of the webhook policy the operator registers for itself
+RECEIVER_POLICY_NAME = "harbor-day2-operator"
+MAX_BODY_BYTES = 1024 * 1024
+READ_TIMEOUT_SECONDS = 10
+
+REASONS = {
+    202: "Accepted",
+    204: "No Content",
+    400: "Bad Request",
+    401: "Unauthorized",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+def receiver_policy(url: str, auth_header: Optional[str]) -> Dict[str, Any]:
+    """Build the webhook policy that sends the relevant events to the operator.
+
+    Args:
+        url: URL Harbor reaches the webhook receiver at
+        auth_header: Authorization header Harbor sends, None for none
+
+    Returns:
+        Dict[str, Any]: Webhook policy configuration
+    """
+    target = {"type": "http", "address": url, "skip_cert_verify": False}
+    if auth_header:
+        target["auth_header"] = auth_header
+    return {
+        "name": RECEIVER_POLICY_NAME,
+        "description": "Triggers a reconciliation by the Harbor Day2 Operator",
+        "event_types": sorted(RELEVANT_EVENT_TYPES),
+        "targets": [target],
+        "enabled": True,
+    }
+
+
+def event_project(payload: Dict[str, Any]) -> Optional[str]:
+    """Return the project a Harbor webhook event refers to.
+
+    Args:
+        payload: Webhook event payload
+
+    Returns:
+        Name of the project, None if the event does not name one
+    """
+    event_data = payload.get("event_data") or {}
+    repository = event_data.get("repository") or {}
+    if repository.get("namespace"):
+        return repository["namespace"]
+    if event_data.get("project_name"):
+        return event_data["project_name"]
+
+    replication = event_data.get("replication") or {}
+    for resource in replication.get("successful_artifact") or []:
+        if resource.get("name_tag"):
+            return resource["name_tag"].split("/", 1)[0]
+    for key in ("src_resource", "dest_resource"):
+        namespace = (replication.get(key) or {}).get("namespace")
+        if namespace:
+            return namespace
+    return None
+
+
+class WebhookReceiver:
+    """Receives Harbor webhook events and collects the projects to reconcile."""
+
+    def __init__(self, logger: Logger, auth_header: Optional[str] = None):
+        """Initialize the receiver.
+
+        Args:
+            logger: Logger instance
+            auth_header: Authorization header required on requests, None for none
+        """
+        self.logger = logger
+        self.auth_header = auth_header
+        self.pending: Set[str] = set()
+        self.event = asyncio.Event()
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, port: int, host: str = "0.0.0.0") -> None:
+        """Start listening for webhook events.
+
+        Args:
+            port: Port to listen on
+            host: Address to listen on
+        """
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.logger.info(
+            "Listening for Harbor webhook events", extra={"host": host, "port": port}
+        )
+
+    async def close(self) -> None:
+        """Stop listening for webhook events."""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def wait_for_projects(self, timeout: float) -> Set[str]:
+        """Wait for projects to reconcile.
+
+        Args:
+            timeout: Seconds to wait at most
+
+        Returns:
+            Set[str]: Projects queued since the last call, empty on timeout
+        """
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        projects, self.pending = self.pending, set()
+        self.event.clear()
+        return projects
+
+    def enqueue(self, payload: Dict[str, Any]) -> bool:
+        """Queue the project of a relevant webhook event.
+
+        Args:
+            payload: Webhook event payload
+
+        Returns:
+            bool: True if a project was queued
+        """
+        event_type = payload.get("type")
+        if event_type not in RELEVANT_EVENT_TYPES:
+            return False
+        project_name = event_project(payload)
+        if not project_name:
+            return False
+        self.logger.info(
+            "Queued reconciliation from webhook event",
+            extra={"event_type": event_type, "project": project_name},
+        )
+        self.pending.add(project_name)
+        self.event.set()
+        return True
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[str, Dict[str, str], bytes]:
+        """Read an HTTP request.
+
+        Args:
+            reader: Stream of the connection
+
+        Returns:
+            Tuple of the method, the lower-case headers and the body
+
+        Raises:
+            ValueError: If the request is malformed
+            OverflowError: If the request body is too large
+        """
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise ValueError("Malformed request line")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").rstrip("\r\n")
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY_BYTES:
+            raise OverflowError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return request_line[0].upper(), headers, body
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Handle a webhook request.
+
+        Args:
+            reader: Stream to read the request from
+            writer: Stream to write the response to
+        """
+        try:
+            method, headers, body = await asyncio.wait_for(
+                self._read_request(reader), READ_TIMEOUT_SECONDS
+            )
+            if method != "POST":
+                status = 405
+            elif self.auth_header and headers.get("authorization") != self.auth_header:
+                status = 401
+            else:
+                status = 202 if self.enqueue(json.loads(body)) else 204
+        except OverflowError:
+            status = 413
+        except (ValueError, AttributeError, asyncio.IncompleteReadError) as e:
+            self.logger.warning("Invalid webhook request", extra={"error": str(e)})
+            status = 400
+        except asyncio.TimeoutError:
+            writer.close()
+            return
+
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            "Content-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1")
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
@@ -1,8 +1,25 @@
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, NamedTuple, Optional
 from logging import Logger
 import json
 
 from utils import load_json
+from instance import getenv
+from pagination import iter_records, project_path
+from project_selectors import expand_project_entries
+from webhook_receiver import receiver_policy
+from apply import apply_operations
+from reconciler import Reconciler, record_matches
+
+
+class WebhookPolicyRecord(NamedTuple):
+    """Fields of a listed webhook policy the synchronization needs."""
+
+    id: int
+    name: str
+    description: Optional[str]
+    event_types: Optional[List[str]]
+    targets: Optional[List[Dict[str, Any]]]
+    enabled: Optional[bool]
 
 
 def load_webhook_configs(path: str, logger: Logger) -> List[Dict[str, Any]]:
@@ -29,111 +46,61 @@ def load_webhook_configs(path: str, logger: Logger) -> List[Dict[str, Any]]:
         raise
 
 
-async def delete_unused_policies(
-    client: Any,
-    project_name: str,
-    current_policy_map: Dict[str, Any],
-    target_policy_names: Set[str],
-    logger: Logger,
-) -> None:
-    """Delete webhook policies that exist in Harbor but not in config.
+def policy_reconciler(client: Any, project_name: str) -> Reconciler:
+    """Build the reconciler of the webhook policies of a project.
+
+    Policies whose configured fields match are not updated.
 
     Args:
         client: Harbor API client instance
         project_name: Name of the project
-        current_policy_map: Map of current policy names to their configurations
-        target_policy_names: Set of policy names from target configuration
-        logger: Logger instance
 
-    Raises:
-        Exception: If deletion of any policy fails
+    Returns:
+        Reconciler: Reconciler of the project's webhook policies keyed by name
     """
-    for policy_name, policy in current_policy_map.items():
-        if policy_name not in target_policy_names:
-            try:
-                logger.info(
-                    "Deleting webhook policy not in config",
-                    extra={"project": project_name, "policy": policy_name},
-                )
-                await client.delete_webhook_policy(
-                    project_name_or_id=project_name, webhook_policy_id=policy.id
-                )
-            except Exception as e:
-                logger.error(
-                    "Failed to delete webhook policy",
-                    extra={
-                        "project": project_name,
-                        "policy": policy_name,
-                        "error": str(e),
-                    },
-                )
-                raise
-
-
-async def process_single_policy(
-    client: Any,
-    project_name: str,
-    target_policy: Dict[str, Any],
-    current_policy_map: Dict[str, Any],
-    logger: Logger,
-) -> None:
-    """Process a single webhook policy, either updating existing or creating new.
+    path, headers = project_path(project_name, "webhook/policies")
+    return Reconciler(
+        stage="webhook-policies",
+        resource="webhook policy",
+        log_field="policy",
+        list_current=lambda: iter_records(
+            client, WebhookPolicyRecord, path, headers=headers
+        ),
+        key=lambda policy: policy.name,
+        desired_key=lambda policy: policy["name"],
+        create=lambda target_policy: client.create_webhook_policy(
+            project_name_or_id=project_name, policy=target_policy
+        ),
+        update=lambda policy, target_policy: client.update_webhook_policy(
+            project_name_or_id=project_name,
+            webhook_policy_id=policy.id,
+            policy=target_policy,
+        ),
+        delete=lambda policy: client.delete_webhook_policy(
+            project_name_or_id=project_name, webhook_policy_id=policy.id
+        ),
+        in_sync=record_matches,
+        context={"project": project_name},
+    )
+
+
+def merge_project_policies(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge the webhook policies of all entries targeting the same project.
+
+    Policies are keyed by name, a later entry overrides an earlier policy with
+    the same name.
 
     Args:
-        client: Harbor API client instance
-        project_name: Name of the project
-        target_policy: Webhook policy configuration
-        current_policy_map: Map of current policy names to their configurations
-        logger: Logger instance
+        entries: Webhook configuration entries of a single project
 
-    Raises:
-        KeyError: If required fields are missing from policy configuration
-        Exception: If any Harbor API operation fails
+    Returns:
+        List of webhook policy configurations
     """
-    try:
-        policy_name = target_policy["name"]
-
-        if policy_name in current_policy_map:
-            # Update existing policy
-            policy_id = current_policy_map[policy_name].id
-            logger.info(
-                "Updating existing webhook policy",
-                extra={
-                    "project": project_name,
-                    "policy": policy_name,
-                    "policy_id": policy_id,
-                },
-            )
-            await client.update_webhook_policy(
-                project_name_or_id=project_name,
-                webhook_policy_id=policy_id,
-                policy=target_policy,
-            )
-        else:
-            # Create new policy
-            logger.info(
-                "Creating new webhook policy",
-                extra={"project": project_name, "policy": policy_name},
-            )
-            await client.create_webhook_policy(
-                project_name_or_id=project_name, policy=target_policy
-            )
-    except KeyError as e:
-        logger.error(
-            "Invalid webhook policy configuration",
-            extra={
-                "project": project_name,
-                "policy": target_policy,
-                "error": f"Missing required field: {str(e)}",
-            },
-        )
-        raise
-    except Exception as e:
-        logger.error(
-            "Failed to process webhook policy",
-            extra={"project": project_name, "policy": policy_name, "error": str(e)},
-        )
-        raise
+    policies: Dict[str, Dict[str, Any]] = {}
+    for entry in entries:
+        for policy in entry.get("policies", []):
+            policies[policy["name"]] = policy
+    return list(policies.values())
 
 
 async def sync_webhook(
@@ -158,26 +125,7 @@ async def sync_webhook(
     logger.info("Synchronizing webhooks for project", extra={"project": project_name})
 
     try:
-        # Get current policies
-        current_policies = await client.get_webhook_policies(
-            project_name_or_id=project_name, limit=None
-        )
-
-        # Create lookup maps for efficient access
-        current_policy_map = {policy.name: policy for policy in current_policies}
-        target_policy_names = {policy["name"] for policy in policies}
-
-        # Delete policies not in config
-        await delete_unused_policies(
-            client, project_name, current_policy_map, target_policy_names, logger
-        )
-
-        # Update or create policies
-        for target_policy in policies:
-            await process_single_policy(
-                client, project_name, target_policy, current_policy_map, logger
-            )
-
+        await policy_reconciler(client, project_name).reconcile(policies, logger)
     except Exception as e:
         logger.error(
             "Failed to sync webhooks for project",
@@ -190,8 +138,11 @@ async def sync_webhooks(client: Any, path: str, logger: Logger) -> None:
     """Synchronize Harbor webhooks with configuration file.
 
     This function reads webhook configurations from a file and synchronizes
-    them with Harbor by project. For each project, it will manage webhook
-    policies according to the configuration.
+    them with Harbor by project. Entries target a single project by
+    ``project_name`` or several projects by a ``projects`` selector. For each
+    project, it will manage webhook policies according to the configuration.
+    If WEBHOOK_RECEIVER_URL is set, every project also gets a policy sending
+    the relevant events to the operator's webhook receiver.
 
     Args:
         client: Harbor API client instance
@@ -210,19 +161,33 @@ async def sync_webhooks(client: Any, path: str, logger: Logger) -> None:
         # Load webhook configurations
         webhook_configs = load_webhook_configs(path, logger)
 
-        # Process webhooks for each project
-        for config in webhook_configs:
-            try:
-                await sync_webhook(client, logger, **config)
-            except Exception as e:
-                logger.error(
-                    "Failed to sync webhooks for project",
-                    extra={
-                        "project": config.get("project_name", "unknown"),
-                        "error": str(e),
-                    },
+        # Register the operator's webhook receiver in every project
+        receiver_url = getenv("WEBHOOK_RECEIVER_URL")
+        if receiver_url:
+            policy = receiver_policy(
+                receiver_url, getenv("WEBHOOK_RECEIVER_AUTH_HEADER")
+            )
+            webhook_configs = webhook_configs + [
+                {"projects": "*", "policies": [policy]}
+            ]
+
+        # Expand project selectors into per-project policy lists
+        project_configs = await expand_project_entries(client, webhook_configs, logger)
+
+        # Process the webhooks of the projects concurrently
+        await apply_operations(
+            "webhooks",
+            (
+                (
+                    project_name,
+                    lambda name=project_name, entries=entries: sync_webhook(
+                        client, logger, name, merge_project_policies(entries)
+                    ),
                 )
-                raise
+                for project_name, entries in project_configs.items()
+            ),
+            logger,
+        )
 
         logger.info("Webhook synchronization completed successfully")
 